@@ -2,9 +2,169 @@
 Contains the Player and Scorer classes
 """
 import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from rule_functions import *
+import bdd
+from minimize import minimizedRule
+from truth_table import TruthTable, canonicalRule, checkBoard, \
+    removeImpliedRules, ruleSetTruthTable, rulesAcceptance, ruleTruthTable
 import phase2
 
+# the ways a Player can choose the card to play, see Player.chooseCard
+STRATEGIES = ['parity', 'information']
+
+
+class WindowIndex:
+    """
+    Incremental index of the windows of three consecutive accepted cards on
+    the board. For every window it caches the rules describing it, and for
+    every rule set the windows that it accepts, so that these only have to
+    be computed when a card is appended or a rule set changes.
+    """
+
+    def __init__(self):
+        self.windows = []
+        self.attributes = []
+        # tuple of the rules of a rule set -> [bitmask of the windows it
+        # accepts, number of windows checked so far]
+        self.coverage = {}
+
+    def addWindow(self, cards):
+        """
+        Appends a window of three accepted cards
+
+        Parameters
+        ----------
+        cards: list
+            The three cards of the window, oldest first
+        """
+        self.windows.append(list(cards))
+        self.attributes.append(None)
+
+    def windowAttributes(self, i):
+        """Returns the set of rules that accept the i-th window"""
+        if self.attributes[i] is None:
+            self.attributes[i] = frozenset(
+                getRulesForSequence(self.windows[i]))
+        return self.attributes[i]
+
+    def covered(self, rule_set):
+        """
+        Returns the windows accepted by the conjunction of a rule set, as a
+        bitmask where bit i stands for the i-th window
+        """
+        key = tuple(rule_set)
+        entry = self.coverage.get(key)
+        if entry is None:
+            entry = self.coverage[key] = [0, 0]
+        if entry[1] < len(self.windows):
+            evaluate = parse(
+                combineRulesWithOperator(rule_set, 'and')).compile()
+            for i in range(entry[1], len(self.windows)):
+                if evaluate(self.windows[i]):
+                    entry[0] |= 1 << i
+            entry[1] = len(self.windows)
+        return entry[0]
+
+    def uncoveredAttributes(self, rule_set, rule_sets):
+        """
+        Returns the union of the rules describing the windows which are not
+        accepted by any of the given rule sets other than rule_set
+        """
+        others = 0
+        for rs in rule_sets:
+            if rs != rule_set:
+                others |= self.covered(rs)
+        uncovered = ~others & ((1 << len(self.windows)) - 1)
+
+        attr_set = set()
+        i = 0
+        while uncovered:
+            if uncovered & 1:
+                attr_set.update(self.windowAttributes(i))
+            uncovered >>= 1
+            i += 1
+        return attr_set
+
+    def forget(self, rule_sets):
+        """Drops the coverage of the rule sets that are no longer in use"""
+        keep = set(tuple(rs) for rs in rule_sets)
+        for key in list(self.coverage):
+            if key not in keep:
+                del self.coverage[key]
+
+
+class SubsumptionIndex:
+    """
+    The truth tables of the rule sets of a hypothesis set, to find the rule
+    sets whose accepted cards are all accepted by another rule set. Since
+    the hypothesis is the disjunction of the rule sets, these only make it
+    slower to evaluate. The truth tables and the containments found are
+    cached, so that only the rule sets which were added or changed since the
+    last check have to be compared with the others.
+    """
+
+    def __init__(self):
+        # tuple of the rules of a rule set -> its truth table
+        self.tables = {}
+        # (tuple, tuple) -> whether the first rule set is contained in the
+        # second one
+        self.contained = {}
+
+    def table(self, rule_set):
+        """Returns the truth table of the conjunction of a rule set"""
+        key = tuple(rule_set)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = ruleSetTruthTable(rule_set)
+        return table
+
+    def issubset(self, rule_set, other):
+        """Tells whether every card accepted by rule_set is accepted by
+        other"""
+        key = (tuple(rule_set), tuple(other))
+        contained = self.contained.get(key)
+        if contained is None:
+            contained = self.contained[key] = \
+                self.table(rule_set).issubset(self.table(other))
+        return contained
+
+    def prune(self, rule_sets):
+        """
+        Drops the rule sets contained in another one
+
+        Parameters
+        ----------
+        rule_sets: list
+            The rule sets of a hypothesis set
+
+        Returns
+        -------
+        kept: list
+            The rule sets that are kept, in their original order; of rule
+            sets accepting the same cards, the first one is kept
+        """
+        kept = []
+        for rule_set in rule_sets:
+            if any(self.issubset(rule_set, k) for k in kept):
+                continue
+            kept = [k for k in kept if not self.issubset(k, rule_set)]
+            kept.append(rule_set)
+        self.forget(kept)
+        return kept
+
+    def forget(self, rule_sets):
+        """Drops the tables of the rule sets that are no longer in use"""
+        keep = set(tuple(rs) for rs in rule_sets)
+        for key in list(self.tables):
+            if key not in keep:
+                del self.tables[key]
+        for key in list(self.contained):
+            if key[0] not in keep or key[1] not in keep:
+                del self.contained[key]
+
 
 class Player:
     """
@@ -17,14 +177,30 @@ class Player:
     max_rule_constancy: int
         The maximum number of turns where if the hypothesis set stays unchanged
         then we can declare the game finished and return a rule.
+    deduplicate: bool
+        Whether to remove the logically redundant rule sets from the
+        hypothesis set after each update (see deduplicateHypotheses)
+    strategy: str
+        How to choose the card to play, one of STRATEGIES (see chooseCard)
+    context: phase2.GameContext
+        The state of the game the Player plays in; by default the one of the
+        module-level phase2.game_ended flag
     """
 
-    def __init__(self, cards, max_rule_constancy=5):
+    def __init__(self, cards, max_rule_constancy=5, deduplicate=True,
+                 strategy='parity', context=None):
         assert len(cards) == 3
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy: " + str(strategy))
+        self.context = phase2.legacy_context if context is None else context
+        self.strategy = strategy
+        self.deduplicate = deduplicate
         self.board_state = []
         for c in cards:
             self.board_state.append((c, []))
         self.hypothesis_set = []
+        self.windows = WindowIndex()
+        self.subsumption = SubsumptionIndex()
         self.applyAcceptedCard(cards[2])
 
         self.hand = [generate_random_card() for i in range(14)]
@@ -46,7 +222,10 @@ class Player:
 
     def chooseCard(self):
         """
-        This function chooses which card to play next
+        This function chooses which card to play next. With the 'parity'
+        strategy, it plays a card that the hypothesis accepts on even turns
+        and one that it rejects on odd turns; with the 'information' strategy
+        it plays the card of highest cardInformation.
 
         Returns
         -------
@@ -54,23 +233,69 @@ class Player:
             The next card to play
 
         """
+        if self.strategy == 'information':
+            random.shuffle(self.hand)
+            if not self.hypothesis_set:
+                return random.choice(self.hand)
+            return self.hand[int(np.argmax(self.cardInformation(self.hand)))]
+
         prev = self.board_state[-1][0]
         prev2 = self.board_state[-2][0]
 
         random.shuffle(self.hand)
 
-        rule_tree = parse(combineListOfRules(self.hypothesis_set))
+        evaluate = parse(self.hypothesisRule()).compile()
 
         if self.turn % 2 == 0:
             for cur in self.hand:
-                if rule_tree.evaluate([prev2, prev, cur]):
+                if evaluate([prev2, prev, cur]):
                     return cur
         else:
             for cur in self.hand:
-                if not rule_tree.evaluate([prev2, prev, cur]):
+                if not evaluate([prev2, prev, cur]):
                     return cur
         return random.choice(self.hand)
 
+    def cardInformation(self, hand):
+        """
+        Scores the cards by how much playing them is expected to tell about
+        the rule. A card splits the rule sets of the hypothesis set into the
+        ones that accept it and the ones that reject it, and it splits the
+        rules of each rule set likewise: whatever the dealer answers, the
+        rule sets and rules on the wrong side are dropped or negated. The
+        score is the entropy of the split of the rule sets plus the mean
+        entropy of the splits of their rules, in bits. All the rules are
+        evaluated on all the cards at once, through their truth tables.
+
+        Parameters
+        ----------
+        hand: list
+            The cards to score
+
+        Returns
+        -------
+        scores: numpy.ndarray
+            The score of every card of the hand
+        """
+        prev = self.board_state[-1][0]
+        prev2 = self.board_state[-2][0]
+
+        groups = [g for g in self.hypothesis_set if g]
+        rules = list(dict.fromkeys(r for g in groups for r in g))
+        position = {r: i for i, r in enumerate(rules)}
+        accepted = rulesAcceptance(rules, [[prev2, prev, c] for c in hand])
+
+        # count the accepting rules of every rule set, with the rows of the
+        # rules of all the rule sets laid out one rule set after another
+        rows = [position[r] for g in groups for r in g]
+        lengths = np.array([len(g) for g in groups])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        counts = np.add.reduceat(accepted[rows], starts, axis=0)
+
+        set_fraction = (counts == lengths[:, None]).mean(axis=0)
+        rule_fraction = counts / lengths[:, None]
+        return _entropy(set_fraction) + _entropy(rule_fraction).mean(axis=0)
+
     def applyAcceptedCard(self, current):
         """
         This function adapts the rules for when a card is accepted
@@ -85,24 +310,25 @@ class Player:
         previous = self.board_state[-2][0]
         previous2 = self.board_state[-3][0]
         cards = [previous2, previous, current]
+        self.windows.addWindow(cards)
 
         rule_changed = False
         # first check to see if any of the rule sets accept this card
         for rule_set in self.hypothesis_set:
-            if parse(combineRulesWithOperator(rule_set, 'and')).evaluate(
+            if parse(combineRulesWithOperator(rule_set, 'and')).compile()(
                     cards):
                 return
 
         add_new_set = True
         for rule_set in sorted(self.hypothesis_set, key=lambda rs: len(rs),
                                reverse=True):
-            if not any([parse(r).evaluate(cards) for r in rule_set]):
+            if not any([parse(r).compile()(cards) for r in rule_set]):
                 continue
             else:
                 add_new_set = False
                 new_rule_set = []
                 for r in rule_set:
-                    if parse(r).evaluate(cards):
+                    if parse(r).compile()(cards):
                         new_rule_set.append(r)
                 if len(rule_set) != len(new_rule_set):
                     rule_changed = True
@@ -120,6 +346,8 @@ class Player:
                 new_hypothesis_set.append(rule_set)
 
         self.hypothesis_set = new_hypothesis_set
+        if self.deduplicate:
+            self.deduplicateHypotheses()
 
         if rule_changed:
             self.constant_rule_count = 0
@@ -146,8 +374,8 @@ class Player:
         rule_changed = False
 
         for rule_set in sorted(self.hypothesis_set, key=lambda rs: len(rs)):
-            if parse(
-                    combineRulesWithOperator(rule_set, 'and')).evaluate(cards):
+            if parse(combineRulesWithOperator(
+                    rule_set, 'and')).compile()(cards):
                 rule_changed = True
                 # all of the subrules were true for this cards, what should
                 # be done?
@@ -158,14 +386,8 @@ class Player:
                 # Now the updated rule_set should be p & q & !s, since s was
                 # not in the set of attributes that previous accepted card
                 # sequences had.
-                attr_set = set()
-                for i in range(len(self.board_state) - 2):
-                    c_seq = list(
-                        map(lambda c: c[0], self.board_state[i:i + 3]))
-                    if not any([parse(
-                            combineRulesWithOperator(rs, 'and')).evaluate(c_seq)
-                            for rs in self.hypothesis_set if rs != rule_set]):
-                        attr_set.update(getRulesForSequence(c_seq))
+                attr_set = self.windows.uncoveredAttributes(
+                    rule_set, self.hypothesis_set)
 
                 neg_rules = []
                 for r in getRulesForSequence(cards):
@@ -186,15 +408,69 @@ class Player:
                 new_hypothesis_set.append(rule_set)
 
         self.hypothesis_set = new_hypothesis_set
+        if self.deduplicate:
+            self.deduplicateHypotheses()
+        self.windows.forget(self.hypothesis_set)
 
         if rule_changed:
             self.constant_rule_count = 0
 
+    def deduplicateHypotheses(self):
+        """
+        Removes the rule sets which only accept cards that another rule set
+        accepts, including all but the first of the logically equivalent ones
+        (see SubsumptionIndex); the rules inside each rule set are left as
+        they are (see hypothesisRule)
+        """
+        self.hypothesis_set = self.subsumption.prune(self.hypothesis_set)
+
+    def hypothesisRule(self):
+        """
+        Returns the rule of the hypothesis set, without the rules of each
+        rule set which are implied by another rule of the same set. The rule
+        sets themselves keep these rules: applyAcceptedCard generalizes a
+        rule set by keeping its rules which accept a new card, which the most
+        specific rules alone rarely do.
+
+        Returns
+        -------
+        rule: str
+            String representation of the hypothesized rule
+        """
+        return combineListOfRules(
+            [removeImpliedRules(rule_set) for rule_set in self.hypothesis_set])
+
     def simplifyRules(self):
         """
-        This function gets rid of any redundant rules
+        This function gets rid of any redundant rules, returning the rule of
+        the minimized hypothesis set (see minimize.minimizeRuleSets), which
+        accepts the same cards
+
+        Returns
+        -------
+        rule: str
+            String representation of the hypothesized rule
+        """
+        return minimizedRule(self.hypothesis_set)
+
+    def checkHypothesis(self, rule=None):
         """
-        return combineListOfRules(self.hypothesis_set)
+        Checks the hypothesis against the board, like the Scorer does
+
+        Parameters
+        ----------
+        rule: str
+            The rule of the hypothesis set, if already combined
+
+        Returns
+        -------
+        check: truth_table.BoardCheck
+            The judgement of the rule on the cards of the board, up to the
+            first one it judges differently from the dealer
+        """
+        if rule is None:
+            rule = self.hypothesisRule()
+        return checkBoard(rule, self.board_state, early_exit=True)
 
     def update_card_to_boardstate(self, card, result):
         """
@@ -227,14 +503,21 @@ class Player:
             The next card to be played
         OR
         rule: str
-            The rule hypothesized so far
+            The rule hypothesized so far, simplified (see simplifyRules), or
+            the shortest equivalent rule known to the rule index in use (see
+            truth_table.useRuleIndex)
         """
-        if phase2.game_ended:
-            return combineListOfRules(self.hypothesis_set)
+        if self.context.game_ended:
+            return canonicalRule(self.simplifyRules())
 
         if self.constant_rule_count == self.max_rule_constancy:
-            phase2.game_ended = True
-            return combineListOfRules(self.hypothesis_set)
+            rule = self.simplifyRules()
+            # only declare a rule which describes the board, and keep playing
+            # to correct it otherwise
+            if self.checkHypothesis(rule).describes:
+                self.context.game_ended = True
+                return canonicalRule(rule)
+            self.constant_rule_count = 0
 
         chosen = self.chooseCard()
         self.hand.append(generate_random_card())
@@ -242,6 +525,39 @@ class Player:
         return chosen
 
 
+def _entropy(p):
+    """The entropy in bits of yes/no outcomes with the given probabilities"""
+    p = np.asarray(p, dtype=float)
+    h = np.zeros(p.shape)
+    inside = (p > 0) & (p < 1)
+    q = p[inside]
+    h[inside] = -(q * np.log2(q) + (1 - q) * np.log2(1 - q))
+    return h
+
+
+class FinishedPlayer:
+    """
+    A player at the end of a game, as seen by Scorer.score: the board it
+    played and the rule it guessed
+
+    Parameters
+    ----------
+    board_state: list
+        The board of the game, like Player.boardState returns it
+    rule: str
+        String representation of the guessed rule
+    """
+    def __init__(self, board_state, rule):
+        self.board_state = board_state
+        self.rule = rule
+
+    def boardState(self):
+        return self.board_state
+
+    def play(self):
+        return self.rule
+
+
 class Scorer:
     """
     The Scorer class which implements a function that scores players
@@ -250,8 +566,17 @@ class Scorer:
     ----------
     rule_expr: str
         String representation of a rule
+    context: phase2.GameContext
+        The state of the game being scored; by default the one of the
+        module-level phase2.game_ended flag
+    symbolic: bool
+        Whether to decide if a guessed rule is equivalent to the true rule
+        with their BDDs (see bdd.py) instead of their truth tables, checking
+        the board with the compiled guessed rule
     """
-    def __init__(self, rule_expr):
+    def __init__(self, rule_expr, context=None, symbolic=False):
+        self.context = phase2.legacy_context if context is None else context
+        self.symbolic = symbolic
         self.setRule(rule_expr)
 
     def rule(self):
@@ -278,6 +603,46 @@ class Scorer:
             self.true_rule = parse(rule_expr)
         except:
             raise ValueError("Invalid Rule")
+        self.rule_expr = rule_expr
+        self.true_table = None
+        # guessed rule -> its truth tables (see truth_table.ruleTruthTables),
+        # or the exception raised when computing them
+        self.tables = {}
+
+    def trueTable(self):
+        """
+        Returns the truth table of the true rule, which is only computed the
+        first time
+
+        Returns
+        -------
+        table: TruthTable
+            The lists of three cards accepted by the true rule
+        """
+        if self.true_table is None:
+            self.true_table = ruleTruthTable(self.rule_expr)
+        return self.true_table
+
+    def compareRule(self, rule, sample_size=10):
+        """
+        Compares a rule with the true rule on all lists of three cards
+
+        Parameters
+        ----------
+        rule: Tree
+            The rule to compare with the true rule
+        sample_size: int
+            The maximum number of disagreeing lists of cards to return
+
+        Returns
+        -------
+        count: int
+            The number of lists of three cards on which the rules disagree
+        sample: list
+            Up to sample_size lists of three cards on which they disagree
+        """
+        validGuess = TruthTable.fromRule(rule)
+        return self.trueTable().difference(validGuess, sample_size)
 
     def score(self, player, is_player):
         """
@@ -292,7 +657,8 @@ class Scorer:
                     tuples
                 * player.play()
                     Which returns the final rule, because game_ended is set to
-                    True
+                    True in the context of the Scorer, and in the one of the
+                    player if it has another
         is_player: bool
             Whether the given player ended the game or not
 
@@ -301,10 +667,66 @@ class Scorer:
         score: int
             Score of the game played for the given player
         """
-        print("Inside the score function")
+        return self.score_many([player], 0 if is_player else None)[0]
+
+    def score_many(self, players, ended_by=None, workers=1,
+                   skip_errors=False):
+        """
+        Scores all the players of a game at once. The truth table of the true
+        rule is only computed once, and so is the one of every distinct
+        guessed rule, in parallel if workers is more than 1
+
+        Parameters
+        ----------
+        players: list
+            Player objects, as described in score
+        ended_by: int
+            The index of the player who ended the game, if any
+        workers: int
+            The number of processes computing the truth tables of the guessed
+            rules
+        skip_errors: bool
+            Whether to score None the players whose guessed rule is not a
+            rule or fails to evaluate, instead of raising
+
+        Returns
+        -------
+        scores: list
+            The score of every player
+        """
+        self.context.game_ended = True
+        guesses = []
+        for player in players:
+            getattr(player, 'context', self.context).game_ended = True
+            guesses.append(player.play())
+        if not self.symbolic:
+            self._computeTables([g for g in guesses if not is_card(g)],
+                                workers)
+
+        scores = []
+        for i, (player, guess) in enumerate(zip(players, guesses)):
+            try:
+                scores.append(self._score(player.boardState(), guess,
+                                          i == ended_by))
+            except Exception:
+                if not skip_errors:
+                    raise
+                scores.append(None)
+        return scores
+
+    def _computeTables(self, rules, workers):
+        """Computes the truth tables of the rules that are not known yet"""
+        missing = [r for r in dict.fromkeys(rules) if r not in self.tables]
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(min(workers, len(missing))) as executor:
+                results = list(executor.map(_ruleTables, missing))
+        else:
+            results = [_ruleTables(r) for r in missing]
+        self.tables.update(zip(missing, results))
+
+    def _score(self, boardState, guessedRule, is_player):
         score = 0
         cardsPlayed = 0
-        boardState = player.boardState()
 
         for play in boardState:
             # look at legal plays
@@ -319,32 +741,26 @@ class Scorer:
                 cardsPlayed += 1
                 score += 2
 
-        phase2.game_ended = True
-
-        guessedRule = player.play()
         assert not is_card(guessedRule)
+        if self.symbolic:
+            describes = checkBoard(guessedRule, boardState,
+                                   early_exit=True).describes
+            same = bdd.equivalent(guessedRule, self.rule_expr)
+        else:
+            tables = self.tables[guessedRule]
+            if isinstance(tables, Exception):
+                raise tables
+            describes = checkBoard(guessedRule, boardState,
+                                   table=tables[1]).describes
+            same = tables[0] == self.trueTable()
 
         # Now check that the rule describes all of the cards played
-        describes = True
-        guessedTree = parse(guessedRule)
-        for i in range(2, len(boardState)):
-            if not guessedTree.evaluate(
-                    [boardState[i - 2][0], boardState[i - 1][0],
-                     boardState[i][0]]):
-                describes = False
-            for failedCard in boardState[i][1]:
-                if guessedTree.evaluate(
-                        [boardState[i - 1][0], boardState[i][0],
-                         failedCard]):
-                    describes = False
         if not describes:
             # +30 for a rule that does not describe all cards on the board
             score += 30
 
-        validReal = set(getAllValidSequences(self.true_rule))
-        validGuess = set(getAllValidSequences(guessedTree))
         # the rules are the same
-        if len(validGuess ^ validReal) > 0:
+        if not same:
             # +15 for a rule that is not equivalent to the correct rule
             score += 15
         else:
@@ -357,3 +773,12 @@ class Scorer:
                 score -= 25
 
         return score
+
+
+def _ruleTables(rule):
+    """The truth tables of a guessed rule, or the exception raised while
+    computing them"""
+    try:
+        return ruleTruthTable(rule), ruleTruthTable(rule, True)
+    except Exception as e:
+        return e
@@ -0,0 +1,141 @@
+import random
+import unittest
+import Game
+import phase2
+from rule_functions import ALL_CARDS, combineRulesWithOperator, \
+    getRandomRule, getRulesForSequence, parse
+from simulate import dealCards
+
+
+class TestScorer(unittest.TestCase):
+
+    board = [("2H", []), ("4D", []), ("6H", ["7S"]), ("9D", [])]
+
+    def test_score_many(self):
+        guesses = ["equal(color(current), R)",
+                   "equal(color(current), R)",
+                   "not(equal(color(current), B))",
+                   "odd(current)",
+                   "less(value(current), 5)"]
+        players = [Game.FinishedPlayer(self.board, g) for g in guesses]
+        for workers, symbolic in [(1, False), (2, False), (1, True)]:
+            scorer = Game.Scorer("equal(color(current), R)",
+                                 phase2.GameContext(), symbolic)
+            scores = scorer.score_many(players, ended_by=2, workers=workers,
+                                       skip_errors=True)
+            self.assertEqual([2 - 75, 2 - 75, 2 - 100, 2 + 30 + 15, None],
+                             scores)
+            self.assertEqual(0 if symbolic else 4, len(scorer.tables))
+            self.assertEqual(
+                scores[:4], [scorer.score(p, i == 2)
+                             for i, p in enumerate(players[:4])])
+        self.assertRaises(TypeError, scorer.score_many, players)
+
+
+class TestPlayer(unittest.TestCase):
+
+    def test_deduplicate_generalizes(self):
+        rule_sets = []
+        for deduplicate in [False, True]:
+            player = Game.Player(["3H", "5C", "7S"], deduplicate=deduplicate,
+                                 context=phase2.GameContext())
+            for card in ["9D", "JH", "3C", "5S", "7D", "KC", "9H"]:
+                player.update_card_to_boardstate(card, True)
+            rule_sets.append([sorted(rs) for rs in player.hypothesis_set])
+        self.assertEqual(rule_sets[0], rule_sets[1])
+        self.assertEqual([["equal(even(current), False)",
+                           "not(equal(suit(current), suit(previous)))",
+                           "not(equal(value(current), value(previous)))"]],
+                         rule_sets[1])
+
+    def test_card_information(self):
+        player = Game.Player(["3H", "5C", "7S"], strategy='information',
+                             context=phase2.GameContext())
+        red, odd = "equal(color(current), R)", "odd(current)"
+        player.hypothesis_set = [[red, odd]]
+        self.assertEqual([0, 1, 0, 1], player.cardInformation(
+            ["3H", "2H", "2S", "3S"]).tolist())
+        # the split of the rule sets adds to the mean split of their rules
+        player.hypothesis_set = [[red, odd], [red]]
+        self.assertEqual([0, 1 + 0.5, 0], player.cardInformation(
+            ["3H", "2H", "2S"]).tolist())
+        self.assertIn(player.chooseCard(), player.hand)
+
+
+class ReferenceWindows(Game.WindowIndex):
+    """Finds the uncovered attributes by evaluating the rule sets on every
+    window of the board, like applyRejectedCard did before WindowIndex"""
+    def __init__(self, player):
+        super().__init__()
+        self.player = player
+
+    def uncoveredAttributes(self, rule_set, rule_sets):
+        board_state = self.player.board_state
+        attr_set = set()
+        for i in range(len(board_state) - 2):
+            c_seq = list(map(lambda c: c[0], board_state[i:i + 3]))
+            if not any([parse(
+                    combineRulesWithOperator(rs, 'and')).compile()(c_seq)
+                    for rs in rule_sets if rs != rule_set]):
+                attr_set.update(getRulesForSequence(c_seq))
+        return attr_set
+
+
+class TestWindowIndex(unittest.TestCase):
+
+    def test_reference(self):
+        rejections = 0
+        for seed in range(30):
+            random.seed(seed)
+            rule = parse(str(getRandomRule()))
+            evaluate = rule.compile()
+            cards = dealCards(rule)
+            player = Game.Player(cards, context=phase2.GameContext())
+            reference = Game.Player(cards, context=phase2.GameContext())
+            reference.windows = ReferenceWindows(reference)
+            for turn in range(20):
+                card = random.choice(ALL_CARDS)
+                board = [c for c, rejected in player.board_state[-2:]]
+                try:
+                    accepted = bool(evaluate(board + [card]))
+                except TypeError:
+                    continue
+                rejections += not accepted
+                player.update_card_to_boardstate(card, accepted)
+                reference.update_card_to_boardstate(card, accepted)
+                self.assertEqual(reference.hypothesis_set,
+                                 player.hypothesis_set, (seed, turn))
+        self.assertGreater(rejections, 100)
+
+
+class TestSubsumptionIndex(unittest.TestCase):
+
+    def test_prune(self):
+        red = ["equal(color(current), R)"]
+        hearts = ["equal(suit(current), H)"]
+        odd_hearts = ["equal(suit(current), H)", "odd(current)"]
+        not_black = ["not(equal(color(current), B))"]
+        clubs = ["equal(suit(current), C)"]
+        index = Game.SubsumptionIndex()
+        self.assertEqual([red, clubs],
+                         index.prune([hearts, red, odd_hearts, not_black,
+                                      clubs]))
+        self.assertEqual({tuple(red), tuple(clubs)}, set(index.tables))
+        self.assertEqual([odd_hearts, clubs], index.prune([odd_hearts, clubs]))
+
+    def test_player(self):
+        context = phase2.GameContext()
+        player = Game.Player(["10H", "2C", "4S"], context=context)
+        for card, accepted in [("5H", True), ("7C", False), ("8D", True),
+                               ("JS", False), ("3D", True), ("KH", True)]:
+            player.update_card_to_boardstate(card, accepted)
+            index = player.subsumption
+            for a in player.hypothesis_set:
+                for b in player.hypothesis_set:
+                    if a is not b:
+                        self.assertFalse(
+                            index.table(a).issubset(index.table(b)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,459 @@
+"""
+Symbolic evaluation of rules with reduced ordered binary decision diagrams
+
+Instead of evaluating a rule on all the 52 ** 3 lists of three cards like
+truth_table does, a rule is compiled into a BDD over the bits of the three
+cards: 2 bits for the suit and 4 bits for the value of each card, so 18
+variables. Since the diagrams are reduced and shared by a single manager,
+two rules are equivalent exactly when they compile to the same node, and
+the accepted lists of cards are counted from the diagram instead of being
+enumerated:
+
+    >>> equivalent("equal(color(current), R)",
+    ...            "not(equal(color(current), B))")
+    True
+    >>> countAccepted("equal(color(current), R)")
+    70304
+
+Like truth_table, an expression is evaluated into its possible values, each
+with the BDD of the cards on which the expression takes it.
+
+The manager never frees single nodes: clearCache drops them all, which
+equivalent, counterexample and countAccepted do by themselves once the
+manager holds more than MAX_NODES nodes.
+"""
+from functools import lru_cache
+
+from new_eleusis import *
+from cards import ALL_CARDS as DECK, NUM_CARDS, SUITS, VALUE_NAMES
+from truth_table import _Error, _call, _children
+
+# The positions of the cards in the lists of three cards
+SLOTS = ['previous2', 'previous', 'current']
+
+# The bits of a card, most significant first: its suit is the index in
+# cards.SUITS and its value is 1..13
+CARD_BITS = ['suit1', 'suit0', 'value3', 'value2', 'value1', 'value0']
+
+# The variables interleave the cards, so that comparing the same attribute
+# of different cards needs few nodes
+NUM_VARS = len(CARD_BITS) * len(SLOTS)
+
+FALSE = 0
+TRUE = 1
+
+
+def variable(bit, slot):
+    """Returns the index of the variable of a bit of the card in a slot"""
+    return CARD_BITS.index(bit) * len(SLOTS) + SLOTS.index(slot)
+
+
+def _cardBits(i):
+    """The values of the CARD_BITS of the card DECK[i]"""
+    code = (i // len(VALUE_NAMES)) << 4 | (i % len(VALUE_NAMES) + 1)
+    return [(code >> (len(CARD_BITS) - 1 - b)) & 1
+            for b in range(len(CARD_BITS))]
+
+
+class BDD:
+    """
+    A manager of reduced ordered binary decision diagrams sharing their
+    nodes, which are identified by integers; FALSE and TRUE are the two
+    terminal nodes
+
+    Parameters
+    ----------
+    num_vars: int
+        The number of variables, tested in increasing order from the root
+    """
+    def __init__(self, num_vars):
+        self.num_vars = num_vars
+        # the terminal nodes come after all the variables
+        self.var = [num_vars, num_vars]
+        self.low = [FALSE, TRUE]
+        self.high = [FALSE, TRUE]
+        self._unique = {}
+        self._cache = {}
+
+    def __len__(self):
+        """Returns the number of nodes"""
+        return len(self.var)
+
+    def node(self, var, low, high):
+        """Returns the node testing var, with the given children when it is
+        false and when it is true"""
+        if low == high:
+            return low
+        key = (var, low, high)
+        n = self._unique.get(key)
+        if n is None:
+            n = len(self.var)
+            self.var.append(var)
+            self.low.append(low)
+            self.high.append(high)
+            self._unique[key] = n
+        return n
+
+    def cube(self, literals):
+        """Returns the conjunction of literals, given as (variable, value)
+        pairs"""
+        n = TRUE
+        for var, bit in sorted(literals, reverse=True):
+            n = self.node(var, FALSE, n) if bit else self.node(var, n, FALSE)
+        return n
+
+    def apply(self, op, a, b):
+        """
+        Combines two diagrams
+
+        Parameters
+        ----------
+        op: str
+            'and', 'or' or 'xor'
+        a: int
+            A node
+        b: int
+            A node
+
+        Returns
+        -------
+        node: int
+            The node of the combination
+        """
+        if op == 'and':
+            if a == FALSE or b == FALSE:
+                return FALSE
+            if a == TRUE or a == b:
+                return b
+            if b == TRUE:
+                return a
+        elif op == 'or':
+            if a == TRUE or b == TRUE:
+                return TRUE
+            if a == FALSE or a == b:
+                return b
+            if b == FALSE:
+                return a
+        elif a == b:
+            return FALSE
+        elif a == FALSE:
+            return b
+        elif b == FALSE:
+            return a
+        if a > b:
+            a, b = b, a
+        key = (op, a, b)
+        n = self._cache.get(key)
+        if n is None:
+            var = min(self.var[a], self.var[b])
+            a0, a1 = (self.low[a], self.high[a]) if self.var[a] == var \
+                else (a, a)
+            b0, b1 = (self.low[b], self.high[b]) if self.var[b] == var \
+                else (b, b)
+            n = self.node(var, self.apply(op, a0, b0),
+                          self.apply(op, a1, b1))
+            self._cache[key] = n
+        return n
+
+    def negate(self, a):
+        return self.apply('xor', a, TRUE)
+
+    def disjunction(self, nodes):
+        n = FALSE
+        for m in nodes:
+            n = self.apply('or', n, m)
+        return n
+
+    def count(self, a):
+        """Returns the number of assignments of all the variables that
+        satisfy a diagram"""
+        counts = {FALSE: 0, TRUE: 1}
+
+        def below(n):
+            # the count over the variables from the one n tests on
+            if n not in counts:
+                counts[n] = sum(
+                    below(c) << (self.var[c] - self.var[n] - 1)
+                    for c in (self.low[n], self.high[n]))
+            return counts[n]
+        return below(a) << self.var[a]
+
+    def satisfy(self, a):
+        """Returns an assignment satisfying a diagram as a list of 0 and 1 by
+        variable, the ones it does not test being 0, or None if there is
+        none"""
+        if a == FALSE:
+            return None
+        bits = [0] * self.num_vars
+        while a != TRUE:
+            if self.high[a] != FALSE:
+                bits[self.var[a]] = 1
+                a = self.high[a]
+            else:
+                a = self.low[a]
+        return bits
+
+
+def _cards(slot):
+    """The BDD of every card in a slot"""
+    s = SLOTS.index(slot)
+    return [_manager.cube([(b * len(SLOTS) + s, bit)
+                           for b, bit in enumerate(_cardBits(i))])
+            for i in range(NUM_CARDS)]
+
+
+def _newManager():
+    """Makes a new shared manager, with the BDDs of the cards and VALID,
+    which are built first and so get the same nodes in every manager"""
+    global _manager, _slot_cards, VALID
+    _manager = BDD(NUM_VARS)
+    _slot_cards = {slot: _cards(slot) for slot in SLOTS}
+    # The assignments which stand for three actual cards
+    VALID = TRUE
+    for slot in SLOTS:
+        VALID = _manager.apply('and', VALID,
+                               _manager.disjunction(_slot_cards[slot]))
+
+
+_newManager()
+
+# Maximum number of nodes of the shared manager: equivalent, counterexample
+# and countAccepted start by clearing it (see clearCache) once it is larger
+MAX_NODES = 1 << 20
+
+
+class _Values:
+    """
+    The values of an expression, with the BDD of the lists of cards on which
+    it takes each of them; the BDDs are disjoint
+
+    Parameters
+    ----------
+    pairs: list
+        (value, node) pairs
+    """
+    def __init__(self, pairs):
+        # merge repeated values, keeping True and 1 apart like truth_table
+        index = {}
+        self.vocab = []
+        self.nodes = []
+        for v, n in pairs:
+            if n == FALSE:
+                continue
+            key = (_Error, None) if isinstance(v, _Error) else (type(v), v)
+            i = index.get(key)
+            if i is None:
+                index[key] = len(self.vocab)
+                self.vocab.append(v)
+                self.nodes.append(n)
+            else:
+                self.nodes[i] = _manager.apply('or', self.nodes[i], n)
+
+    def where(self, accepts):
+        """The disjunction of the nodes of the values accepted by a
+        predicate"""
+        return _manager.disjunction(
+            n for v, n in zip(self.vocab, self.nodes) if accepts(v))
+
+
+def _leaf(expr):
+    if isinstance(expr, str) and expr in _slot_cards:
+        return _Values(zip(DECK, _slot_cards[expr]))
+    if expr == "True":
+        expr = True
+    elif expr == "False":
+        expr = False
+    return _Values([(expr, TRUE)])
+
+
+def _unary(f, a):
+    return _Values([(_call(f, v), n) for v, n in zip(a.vocab, a.nodes)])
+
+
+def _binary(f, a, b):
+    return _Values([(_call(f, va, vb), _manager.apply('and', na, nb))
+                    for va, na in zip(a.vocab, a.nodes)
+                    for vb, nb in zip(b.vocab, b.nodes)])
+
+
+def _select(test, a, b):
+    """Takes the values of a where test is truthy and those of b elsewhere"""
+    error = _Error(None)
+    for v in test.vocab:
+        if isinstance(v, _Error):
+            error = v
+    truthy = test.where(lambda v: not isinstance(v, _Error) and bool(v))
+    falsy = test.where(lambda v: not isinstance(v, _Error) and not v)
+    failed = test.where(lambda v: isinstance(v, _Error))
+    return _Values(
+        [(v, _manager.apply('and', n, truthy))
+         for v, n in zip(a.vocab, a.nodes)] +
+        [(v, _manager.apply('and', n, falsy))
+         for v, n in zip(b.vocab, b.nodes)] + [(error, failed)])
+
+
+def _combine(expr, values):
+    """The _Values of a Tree from the _Values of its children (see
+    truth_table._children)"""
+    f = expr.root
+
+    if f in [suit, color, value, is_royal, minus1, plus1, even, odd]:
+        return _unary(f, values[0])
+
+    elif f in [equal, less, greater]:
+        return _binary(f, values[0], values[1])
+
+    elif f == andf:
+        # and(a, b, c) is and(a, and(b, c)), folded from the last argument
+        result = values[-1]
+        for arg in reversed(values[:-1]):
+            result = _select(arg, result, _Values([(False, TRUE)]))
+        return result
+
+    elif f == orf:
+        result = values[-1]
+        for arg in reversed(values[:-1]):
+            result = _select(arg, _Values([(True, TRUE)]), result)
+        return result
+
+    elif f == notf:
+        return _unary(lambda v: not v, values[0])
+
+    elif f == iff:
+        return _select(values[0], values[1], values[2])
+
+
+def _evaluate(expr, memo):
+    """Evaluates an expression symbolically, returning its _Values; memo
+    holds the values of the subtrees evaluated so far"""
+    # the Trees are combined in postfix order from an explicit stack, like
+    # truth_table._evaluate does, so that deeply nested rules do not hit the
+    # recursion limit
+    results = []
+    stack = [(expr, False)]
+    while stack:
+        expr, visited = stack.pop()
+        if not isinstance(expr, Tree):
+            results.append(_leaf(expr))
+            continue
+        if visited:
+            n = len(_children(expr))
+            values = _combine(expr, results[len(results) - n:])
+            del results[len(results) - n:]
+            memo[expr] = values
+            results.append(values)
+            continue
+        values = memo.get(expr)
+        if values is not None:
+            results.append(values)
+            continue
+        stack.append((expr, True))
+        for child in reversed(_children(expr)):
+            stack.append((child, False))
+    return results[0]
+
+
+def acceptanceBDD(rule, truthiness=False):
+    """
+    Compiles a rule into the BDD of the lists of three cards it accepts
+
+    Parameters
+    ----------
+    rule: Tree
+        The rule to compile
+    truthiness: bool
+        If True, a list of cards is accepted when the value of the rule is
+        truthy; otherwise a string value is only accepting when it is
+        "True" (see truth_table.acceptanceMask)
+
+    Returns
+    -------
+    node: int
+        The node of the BDD in the shared manager, valid until the manager
+        is cleared (see clearCache)
+    """
+    values = _evaluate(rule, {})
+    for v, n in zip(values.vocab, values.nodes):
+        if isinstance(v, _Error) and \
+                _manager.apply('and', n, VALID) != FALSE:
+            raise v.exception
+
+    def accepts(v):
+        if isinstance(v, _Error):
+            return False
+        if isinstance(v, str) and not truthiness:
+            return v == "True"
+        return bool(v)
+    return _manager.apply('and', values.where(accepts), VALID)
+
+
+# Maximum number of rule strings whose BDD is remembered by ruleBDD
+RULE_BDD_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=RULE_BDD_CACHE_SIZE)
+def ruleBDD(rule):
+    """Returns the BDD of a rule string (see acceptanceBDD), cached by the
+    string"""
+    return acceptanceBDD(parse(rule))
+
+
+def clearCache():
+    """
+    Forgets all the BDDs compiled so far to free their memory: the nodes
+    of the shared manager are dropped and the cache of ruleBDD cleared, so
+    the nodes returned by acceptanceBDD and ruleBDD before are no longer
+    valid, except FALSE, TRUE and VALID
+    """
+    ruleBDD.cache_clear()
+    _newManager()
+
+
+def _limitSize():
+    """Clears the shared manager if it holds more than MAX_NODES nodes; only
+    called before any node is computed, so that none is kept across"""
+    if len(_manager) > MAX_NODES:
+        clearCache()
+
+
+def equivalent(rule, other):
+    """Tells whether two rule strings accept the same lists of three cards"""
+    _limitSize()
+    return ruleBDD(rule) == ruleBDD(other)
+
+
+def counterexample(rule, other):
+    """
+    Finds a list of three cards on which two rules disagree
+
+    Parameters
+    ----------
+    rule: str
+        String representation of a rule
+    other: str
+        String representation of another rule
+
+    Returns
+    -------
+    cards: list
+        Three cards accepted by only one of the rules, or None if they are
+        equivalent
+    """
+    _limitSize()
+    bits = _manager.satisfy(
+        _manager.apply('xor', ruleBDD(rule), ruleBDD(other)))
+    if bits is None:
+        return None
+    cards = []
+    for s in range(len(SLOTS)):
+        code = 0
+        for b in range(len(CARD_BITS)):
+            code = code << 1 | bits[b * len(SLOTS) + s]
+        cards.append(DECK[(code >> 4) * len(VALUE_NAMES) + (code & 15) - 1])
+    return cards
+
+
+def countAccepted(rule):
+    """Returns the number of lists of three cards a rule string accepts"""
+    _limitSize()
+    return _manager.count(ruleBDD(rule))
@@ -0,0 +1,131 @@
+import random
+import unittest
+from bdd import *
+from rule_functions import getRandomRule
+from truth_table import acceptanceMask, ruleTruthTable, sequenceIndex
+import bdd
+import truth_table_test
+
+
+class TestBDD(unittest.TestCase):
+
+    # the rules of the other tests, random rules and rule sets of the Player
+    rules = truth_table_test.TestTruthTable.rules + [
+        "iff(odd(previous2), equal(color(current), R), "
+        "greater(value(current), value(previous)))",
+        "and(equal(suit(current), suit(previous)), "
+        "equal(suit(previous), suit(previous2)), "
+        "not(equal(value(current), value(previous))))",
+        "or(equal(current, previous), True)",
+    ]
+
+    def corpus(self):
+        random.seed(0)
+        rules = list(self.rules)
+        while len(rules) < len(self.rules) + 40:
+            rule = str(getRandomRule())
+            try:
+                acceptanceMask(parse(rule))
+            except TypeError:
+                # like less(value(current), 5), which always raises
+                continue
+            rules.append(rule)
+        return rules
+
+    def test_count(self):
+        for rule in self.corpus():
+            self.assertEqual(int(acceptanceMask(parse(rule)).sum()),
+                             countAccepted(rule), rule)
+
+    def test_equivalence(self):
+        corpus = self.corpus()
+        for rule in corpus[:20]:
+            for other in corpus:
+                table = ruleTruthTable(rule)
+                other_table = ruleTruthTable(other)
+                self.assertEqual(table == other_table,
+                                 equivalent(rule, other))
+                cards = counterexample(rule, other)
+                if table == other_table:
+                    self.assertIsNone(cards)
+                else:
+                    i = sequenceIndex(cards)
+                    self.assertNotEqual(table.lookup([i])[0],
+                                        other_table.lookup([i])[0])
+        self.assertTrue(equivalent("equal(color(current), R)",
+                                   "or(equal(suit(current), D), "
+                                   "equal(suit(current), H))"))
+
+    def test_three_children(self):
+        # negate_rule turns greater(value(current), ...) into
+        # less(alue(current), ...), whose test ("alue") is ignored
+        from itertools import product
+        from program import Program
+        from rule_functions import ALL_CARDS, negate_rule
+        for rule in [negate_rule("greater(value(current), value(previous))"),
+                     "equal(1, color(current), R)",
+                     "not(1, is_royal(current), 2)"]:
+            tree = parse(rule)
+            self.assertIsNotNone(tree.test)
+            compiled = tree.compile()
+            program = Program.fromTree(tree)
+            accepted = 0
+            for cards in product(ALL_CARDS, repeat=3):
+                value = compiled(cards)
+                if cards[0] == cards[1]:
+                    self.assertEqual(value, tree.evaluate(cards))
+                    self.assertEqual(value, program.evaluate(cards))
+                accepted += value is True or value == "True"
+            self.assertEqual(accepted, ruleTruthTable(rule).count(), rule)
+            self.assertEqual(accepted, countAccepted(rule), rule)
+
+    def test_deep_rules(self):
+        red = "equal(color(current), R)"
+        rule = red
+        for i in range(20001):
+            rule = "not(" + rule + ")"
+        self.assertTrue(equivalent("not(" + red + ")", rule))
+        self.assertEqual(70304, countAccepted(rule))
+        rule = "even(current)"
+        for i in range(2000):
+            rule = "and(" + rule + ", odd(previous))"
+        self.assertTrue(equivalent("and(even(current), odd(previous))",
+                                   rule))
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            acceptanceBDD(parse("less(value(current), 5)"))
+        # the error is never reached
+        self.assertEqual(0, countAccepted(
+            "and(False, less(value(current), 5))"))
+
+    def test_truthiness(self):
+        tree = parse("suit(current)")
+        self.assertEqual(FALSE, acceptanceBDD(tree))
+        self.assertEqual(VALID, acceptanceBDD(tree, truthiness=True))
+        self.assertEqual(52 ** 3, bdd._manager.count(VALID))
+
+    def test_clear_cache(self):
+        valid, slot_cards = VALID, bdd._slot_cards
+        max_nodes = bdd.MAX_NODES
+        bdd.MAX_NODES = len(bdd._manager) + 100
+        try:
+            rule = "equal(color(current), R)"
+            for v in range(1, 14):
+                other = "or({}, equal(value(current), {}))".format(rule, v)
+                self.assertFalse(equivalent(rule, other))
+                self.assertTrue(equivalent(other, "or(equal(value(current), "
+                                           "{}), {})".format(v, rule)))
+                self.assertLessEqual(len(bdd._manager), 2 * bdd.MAX_NODES)
+            self.assertEqual(70304, countAccepted(rule))
+        finally:
+            bdd.MAX_NODES = max_nodes
+        clearCache()
+        self.assertEqual(0, ruleBDD.cache_info().currsize)
+        self.assertEqual(valid, bdd.VALID)
+        self.assertEqual(slot_cards, bdd._slot_cards)
+        self.assertEqual(52 ** 3, bdd._manager.count(VALID))
+
+
+if __name__ == '__main__':
+    unittest.main()
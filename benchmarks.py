@@ -0,0 +1,446 @@
+"""
+Benchmarks of the hot paths of the game: scanning and parsing rules,
+evaluating them, generating rules for card sequences, enumerating valid
+sequences, scoring and playing full games.
+
+Each benchmark is warmed up and then timed over several repeated runs; the
+results are written as JSON and can be compared against a stored baseline:
+
+    $ python benchmarks.py --output baseline.json
+    $ python benchmarks.py --baseline baseline.json
+
+The strategies of the Player for choosing its cards are compared by playing
+the same games with each of them:
+
+    $ python benchmarks.py --convergence 100 --workers 4
+"""
+import argparse
+import functools
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+import Game
+import phase2
+import truth_table
+from rule_functions import *
+from bdd import acceptanceBDD
+from engine import GameEngine
+from simulate import runGame, simulate
+
+# name -> function returning the callable to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a function which sets up a benchmark and returns the
+    callable to time"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+CARDS = ["10H", "2C", "4S"]
+
+SHORT_RULE = "equal(color(current), R)"
+
+# a conjunction like the ones built by combineRulesWithOperator
+NESTED_RULE = combineRulesWithOperator(sorted(
+    getRulesForSequence(["3D", "7S", "AC"]) +
+    getRulesForSequence(["10H", "2C", "4S"])), "and")
+
+
+def huge_rule(length):
+    """A conjunction of the rules for consecutive cards of the deck, of at
+    least the given length, like the ones the Player accumulates"""
+    rules = []
+    # "and(" and ")", then every rule and the ", " before the next one
+    total = len("and()") - len(", ")
+    i = 0
+    while total < length:
+        cards = [ALL_CARDS[(i + k) % len(ALL_CARDS)] for k in range(3)]
+        for r in sorted(getRulesForSequence(cards)):
+            rules.append(r)
+            total += len(r) + len(", ")
+        i += 1
+    return combineRulesWithOperator(rules, "and")
+
+
+HUGE_RULE_LENGTHS = [10 ** 5, 10 ** 6]
+
+PRIMITIVE_RULES = {
+    'suit': "suit(current)",
+    'color': "color(current)",
+    'value': "value(current)",
+    'is_royal': "is_royal(current)",
+    'even': "even(current)",
+    'odd': "odd(current)",
+    'plus1': "plus1(value(current))",
+    'minus1': "minus1(value(current))",
+    'equal': "equal(suit(current), suit(previous))",
+    'less': "less(value(current), value(previous))",
+    'greater': "greater(value(current), value(previous))",
+    'and': "and(even(current), odd(previous))",
+    'or': "or(even(current), odd(previous))",
+    'not': "not(even(current))",
+    'if': "if(even(previous), odd(current), True)",
+}
+
+SCORED_RULE = \
+    "or(equal(color(current), R), less(value(current), value(previous)))"
+
+# number of rounds of the full game benchmark
+GAME_ROUNDS = 14
+
+# maximum number of rounds of the games played by --convergence, enough for
+# the Player alone to declare a rule in most of the games it can
+CONVERGENCE_ROUNDS = 30
+
+
+@benchmark('scan_short')
+def bench_scan_short():
+    return lambda: list(scan(SHORT_RULE))
+
+
+@benchmark('scan_nested')
+def bench_scan_nested():
+    return lambda: list(scan(NESTED_RULE))
+
+
+# parse is cached, so the uncached function underneath it is timed
+@benchmark('parse_short')
+def bench_parse_short():
+    return lambda: parse.__wrapped__(SHORT_RULE)
+
+
+@benchmark('parse_nested')
+def bench_parse_nested():
+    return lambda: parse.__wrapped__(NESTED_RULE)
+
+
+def _register_huge(length):
+    @benchmark('scan_huge_{}'.format(length))
+    def bench_scan_huge():
+        rule = huge_rule(length)
+        return lambda: list(scan(rule))
+
+    @benchmark('parse_huge_{}'.format(length))
+    def bench_parse_huge():
+        rule = huge_rule(length)
+        return lambda: parse.__wrapped__(rule)
+
+
+for length in HUGE_RULE_LENGTHS:
+    _register_huge(length)
+
+
+def _register_evaluate(name, rule):
+    @benchmark('evaluate_' + name)
+    def bench_evaluate():
+        tree = parse(rule)
+        return lambda: tree.evaluate(CARDS)
+
+    @benchmark('compiled_' + name)
+    def bench_compiled():
+        evaluate = parse(rule).compile()
+        return lambda: evaluate(CARDS)
+
+
+for name, rule in PRIMITIVE_RULES.items():
+    _register_evaluate(name, rule)
+
+# the same conjunction as a single and, and as nested binary ands
+_register_evaluate('conjunction', NESTED_RULE)
+_register_evaluate('binary_conjunction', functools.reduce(
+    lambda a, b: "and({}, {})".format(a, b), parse(NESTED_RULE).args))
+
+
+@benchmark('getRulesForSequence')
+def bench_rules_for_sequence():
+    return lambda: getRulesForSequence(CARDS)
+
+
+@benchmark('getRulesForThreeCards')
+def bench_rules_for_three_cards():
+    return lambda: getRulesForThreeCards(CARDS)
+
+
+@benchmark('getAllValidSequences')
+def bench_all_valid_sequences():
+    tree = parse(SCORED_RULE)
+    return lambda: getAllValidSequences(tree)
+
+
+@benchmark('acceptanceMask_nested')
+def bench_acceptance_mask():
+    tree = parse(NESTED_RULE)
+    return lambda: acceptanceMask(tree)
+
+
+@benchmark('acceptanceBDD_nested')
+def bench_acceptance_bdd():
+    tree = parse(NESTED_RULE)
+    return lambda: acceptanceBDD(tree)
+
+
+def _scoredPlayer():
+    """A player who played every card of the deck against SCORED_RULE"""
+    evaluate = parse(SCORED_RULE).compile()
+    board_state = [(c, []) for c in CARDS]
+    for card in ALL_CARDS:
+        cards = [board_state[-2][0], board_state[-1][0], card]
+        if evaluate(cards):
+            board_state.append((card, []))
+        else:
+            board_state[-1][1].append(card)
+    return Game.FinishedPlayer(board_state, "equal(color(current), R)")
+
+
+@benchmark('Scorer.score')
+def bench_score():
+    # the truth tables are cached after the first call
+    scorer = Game.Scorer(SCORED_RULE, phase2.GameContext())
+    player = _scoredPlayer()
+    return lambda: scorer.score(player, True)
+
+
+@benchmark('Scorer.score_cold')
+def bench_score_cold():
+    # a new Scorer which computes every truth table
+    player = _scoredPlayer()
+
+    def score():
+        truth_table.ruleTruthTable.cache_clear()
+        truth_table.ruleTruthTables.cache_clear()
+        Game.Scorer(SCORED_RULE, phase2.GameContext()).score(player, True)
+    return score
+
+
+@benchmark('chooseCard_information')
+def bench_choose_card():
+    # a full hand scored against hundreds of rule sets
+    player = Game.Player(list(CARDS), strategy='information')
+    player.hypothesis_set = [
+        sorted(getRulesForSequence(ALL_CARDS[i:i + 3]))[:4]
+        for i in range(0, len(ALL_CARDS) - 2)] * 4
+    return player.chooseCard
+
+
+@benchmark('engine')
+def bench_engine():
+    # the overhead of the game loop itself, with players that only play
+    def game():
+        players = [phase2.Adversary() for i in range(4)]
+        return GameEngine(SCORED_RULE, players, CARDS, GAME_ROUNDS).run()
+    return game
+
+
+@benchmark('game')
+def bench_game():
+    return lambda: runGame(SCORED_RULE, seed=0, rounds=GAME_ROUNDS)
+
+
+def run(names, repeat=5, min_time=0.2):
+    """
+    Runs the given benchmarks
+
+    Parameters
+    ----------
+    names: list
+        Names of the benchmarks to run
+    repeat: int
+        The number of timed runs of each benchmark
+    min_time: float
+        Each timed run loops the benchmark for at least this many seconds
+
+    Returns
+    -------
+    results: dict
+        For each benchmark, the median and minimum seconds per call, and the
+        number of loops and runs that were timed
+    """
+    results = {}
+    for name in names:
+        timer = timeit.Timer(BENCHMARKS[name]())
+        # warm-up, which also picks the number of loops per run
+        loops = 1
+        while True:
+            elapsed = timer.timeit(loops)
+            if elapsed >= min_time:
+                break
+            loops *= 10 if elapsed < min_time / 10 else 2
+        times = [t / loops for t in timer.repeat(repeat, loops)]
+        results[name] = {'median': statistics.median(times),
+                         'min': min(times), 'loops': loops, 'repeat': repeat}
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares benchmark results with a baseline
+
+    Parameters
+    ----------
+    results: dict
+        The current results, as returned by run
+    baseline: dict
+        The baseline results
+    tolerance: float
+        Relative slowdown of the median above which a benchmark regressed
+
+    Returns
+    -------
+    rows: list
+        Tuples of (name, baseline median, current median, ratio, regressed)
+    """
+    rows = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['median']
+        ratio = current['median'] / base if base > 0 else float('inf')
+        rows.append((name, base, current['median'], ratio,
+                     ratio > 1 + tolerance))
+    return rows
+
+
+def _correct(game):
+    """Tells whether the rule guessed in a game accepts the same cards as
+    the rule of the dealer"""
+    try:
+        return truth_table.ruleTruthTable(game['guess']) == \
+            truth_table.ruleTruthTable(game['rule'])
+    except Exception:
+        return False
+
+
+def convergence(num_games=20, seed=0, rules=None, workers=1,
+                num_adversaries=0, rounds=CONVERGENCE_ROUNDS, **options):
+    """
+    Plays the same games with each of the ways the Player can choose its
+    cards, to compare how fast they converge. The Player plays alone by
+    default: the adversaries end most games early with random guesses,
+    which hides the differences between the strategies.
+
+    Parameters
+    ----------
+    num_games: int
+        The number of games played with each strategy
+    seed: int
+        The seed of the first game; game i uses seed + i
+    rules: list
+        String representations of the rules to cycle through, or None to use
+        random rules
+    workers: int
+        The number of processes to play the games in
+    num_adversaries: int
+        The number of phase2.Adversary players in each game
+    rounds: int
+        The maximum number of rounds of a game
+    options: dict
+        Extra keyword arguments for simulate.runGame
+
+    Returns
+    -------
+    results: dict
+        For each strategy, the mean number of turns, final size of the
+        hypothesis set, score and wall time per game, the fractions of the
+        games the Player ended by declaring a rule and of the games whose
+        guessed rule accepts the same cards as the rule of the dealer, and
+        the number of games which ended with an error
+    """
+    results = {}
+    for strategy in Game.STRATEGIES:
+        games = [g for g in simulate(num_games, workers, seed, rules,
+                                     strategy=strategy,
+                                     num_adversaries=num_adversaries,
+                                     rounds=rounds, **options)]
+        played = [g for g in games if 'error' not in g]
+        n = max(1, len(played))
+        results[strategy] = {
+            'turns': sum(g['turns'] for g in played) / n,
+            'hypothesis_size': sum(g['hypothesis_sizes'][-1]
+                                   for g in played
+                                   if g['hypothesis_sizes']) / n,
+            'score': sum(g['score'] for g in played) / n,
+            'declared': sum(g['ended_by'] == 0 for g in played) / n,
+            'correct': sum(_correct(g) for g in played) / n,
+            'wall_time': sum(g['wall_time'] for g in played) / n,
+            'errors': len(games) - len(played)}
+    return results
+
+
+def main():
+    global GAME_ROUNDS
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run, or substrings of their '
+                             'names (default: all)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs of each benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum number of seconds per timed run')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--baseline',
+                        help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown counted as a regression')
+    parser.add_argument('--game-rounds', type=int, default=GAME_ROUNDS,
+                        help='number of rounds of the full game benchmark')
+    parser.add_argument('--list', action='store_true',
+                        help='list the benchmarks and exit')
+    parser.add_argument('--convergence', type=int, metavar='GAMES',
+                        help='instead of timing, play this many games with '
+                             'each card choosing strategy and compare them')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes for --convergence')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+
+    if args.convergence:
+        json.dump(convergence(args.convergence, workers=args.workers),
+                  sys.stdout, indent=2)
+        print()
+        return 0
+
+    GAME_ROUNDS = args.game_rounds
+
+    names = [name for name in BENCHMARKS
+             if not args.names or any(n in name for n in args.names)]
+    results = run(names, args.repeat, args.min_time)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'benchmarks': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+        regressed = False
+        for name, base, current, ratio, slower in compare(
+                results, baseline, args.tolerance):
+            print('{:<28} {:>12.3g}s {:>12.3g}s {:>7.2f}x{}'.format(
+                name, base, current, ratio, '  REGRESSION' if slower else ''),
+                file=sys.stderr)
+            regressed = regressed or slower
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
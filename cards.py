@@ -0,0 +1,51 @@
+"""
+Integer encoding of the 52 cards, with precomputed tables of their attributes
+
+Every card is encoded as an integer in 0..51, which is its position in
+ALL_CARDS. CARD_INDEX maps card strings to their encoding and ALL_CARDS maps
+them back.
+
+The primitives of new_eleusis still take and return card strings, and look
+their encoding up in CARD_INDEX to read the tables: in the rules, integers
+already stand for values (plus1(5) is "6" and less(5, 7) compares values),
+so an encoded card could not be told apart from a value. truth_table and
+bdd, which evaluate a rule on all the cards at once, index the cards by
+their encodings.
+"""
+
+SUITS = ["D", "H", "S", "C"]
+VALUE_NAMES = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10",
+               "J", "Q", "K"]
+
+ALL_CARDS = []
+for deck in SUITS:
+    for num in VALUE_NAMES:
+        ALL_CARDS.append(num + deck)
+
+NUM_CARDS = len(ALL_CARDS)
+
+CARD_INDEX = {card: i for i, card in enumerate(ALL_CARDS)}
+# generate_random_card names the aces "1" instead of "A"
+for i, deck in enumerate(SUITS):
+    CARD_INDEX["1" + deck] = i * len(VALUE_NAMES)
+
+# ----- Attributes of every card, indexed by its encoding
+
+CARD_SUIT = [card[-1] for card in ALL_CARDS]
+CARD_COLOR = [{'C': 'B', 'D': 'R', 'H': 'R', 'S': 'B'}[s] for s in CARD_SUIT]
+CARD_VALUE = [VALUE_NAMES.index(card[:-1]) + 1 for card in ALL_CARDS]
+CARD_IS_ROYAL = [v > 10 for v in CARD_VALUE]
+CARD_EVEN = [v % 2 == 0 for v in CARD_VALUE]
+CARD_ODD = [v % 2 != 0 for v in CARD_VALUE]
+
+# The next higher and lower card in the same suit, None when there is none
+CARD_PLUS1 = [ALL_CARDS[i + 1] if CARD_VALUE[i] < 13 else None
+              for i in range(NUM_CARDS)]
+CARD_MINUS1 = [ALL_CARDS[i - 1] if CARD_VALUE[i] > 1 else None
+               for i in range(NUM_CARDS)]
+
+# ----- Comparisons between two cards, indexed by both encodings
+
+# For cards, suits are considered first (C < D < H < S), then values
+CARD_LESS = [[(CARD_SUIT[a], CARD_VALUE[a]) < (CARD_SUIT[b], CARD_VALUE[b])
+              for b in range(NUM_CARDS)] for a in range(NUM_CARDS)]
@@ -0,0 +1,136 @@
+"""
+Runs games of New Eleusis between any number of players
+"""
+import phase2
+from rule_functions import parse, is_card
+
+
+class GameResult:
+    """
+    The outcome of a game played by a GameEngine
+
+    Parameters
+    ----------
+    ended_by: int
+        Index of the player that ended the game by returning a rule, or None
+        when the game ran out of rounds
+    rule: str
+        The rule returned by the player that ended the game, or None
+    turns: int
+        The number of cards played
+    accepted: int
+        The number of cards the dealer accepted
+    cards: list
+        The last three accepted cards, oldest first
+    """
+    def __init__(self, ended_by, rule, turns, accepted, cards):
+        self.ended_by = ended_by
+        self.rule = rule
+        self.turns = turns
+        self.accepted = accepted
+        self.cards = cards
+
+    def asDict(self):
+        """Returns the result as a dictionary, e.g. to write it as JSON"""
+        return {'ended_by': self.ended_by, 'rule': self.rule,
+                'turns': self.turns, 'accepted': self.accepted,
+                'cards': self.cards}
+
+    def __repr__(self):
+        return "GameResult({})".format(", ".join(
+            "{}={!r}".format(k, v) for k, v in self.asDict().items()))
+
+
+class GameEngine:
+    """
+    Plays the rounds of a game, where every player plays a card in turn and
+    the dealer accepts or rejects it, until a player returns a rule instead
+    of a card or the rounds run out
+
+    Parameters
+    ----------
+    rule: str or Tree
+        The rule of the dealer
+    players: list
+        The players, in the order they play. Each one implements play(),
+        which returns either a card or a rule; the ones which also implement
+        update_card_to_boardstate(card, result) are told the outcome of every
+        card played, including the cards of the other players
+    cards: list
+        The three cards the dealer starts the game with
+    rounds: int
+        The maximum number of rounds, where every player plays once per round
+    on_play: callable
+        Optional callback, called as on_play(player_index, card, accepted)
+        after every card played and after the players were updated
+    on_end: callable
+        Optional callback, called with the GameResult when the game ends
+    context: phase2.GameContext
+        The state of the game, shared with the players; by default the one of
+        the module-level phase2.game_ended flag
+    """
+    def __init__(self, rule, players, cards, rounds=14, on_play=None,
+                 on_end=None, context=None):
+        assert len(cards) == 3
+        self.context = phase2.legacy_context if context is None else context
+        self.rule = parse(rule) if isinstance(rule, str) else rule
+        self.evaluate = self.rule.compile()
+        self.players = list(players)
+        self.cards = list(cards)
+        self.rounds = rounds
+        self.on_play = on_play
+        self.on_end = on_end
+
+    def run(self):
+        """
+        Plays the game
+
+        Returns
+        -------
+        result: GameResult
+            The outcome of the game
+        """
+        self.context.game_ended = False
+        evaluate = self.evaluate
+        on_play = self.on_play
+        # the bound methods are looked up once, not on every turn
+        plays = [p.play for p in self.players]
+        updates = [getattr(p, 'update_card_to_boardstate', None)
+                   for p in self.players]
+        updates = [u for u in updates if u is not None]
+        # the cards the dealer judges; the last two accepted cards stay in
+        # place and the played card is written after them
+        window = [self.cards[-2], self.cards[-1], None]
+        oldest = self.cards[-3]
+
+        turns = 0
+        accepted = 0
+        ended_by = None
+        rule = None
+        for round_num in range(self.rounds):
+            for i, play in enumerate(plays):
+                card = play()
+                if not is_card(card):
+                    ended_by, rule = i, card
+                    break
+                turns += 1
+                window[2] = card
+                result = bool(evaluate(window))
+                if result:
+                    accepted += 1
+                    oldest = window[0]
+                    window[0] = window[1]
+                    window[1] = card
+                for update in updates:
+                    update(card, result)
+                if on_play is not None:
+                    on_play(i, card, result)
+            if ended_by is not None:
+                break
+
+        self.context.game_ended = True
+        result = GameResult(ended_by, rule, turns, accepted,
+                            [oldest, window[0], window[1]])
+        if self.on_end is not None:
+            self.on_end(result)
+        return result
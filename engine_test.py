@@ -0,0 +1,84 @@
+import unittest
+from engine import GameEngine
+from rule_functions import is_card
+import phase2
+import Game
+
+
+class ScriptedPlayer:
+    """Plays the given cards or rules in order and records its updates"""
+    def __init__(self, moves):
+        self.moves = list(moves)
+        self.updates = []
+
+    def play(self):
+        return self.moves.pop(0)
+
+    def update_card_to_boardstate(self, card, result):
+        self.updates.append((card, result))
+
+
+class SilentPlayer:
+    def __init__(self, moves):
+        self.moves = list(moves)
+
+    def play(self):
+        return self.moves.pop(0)
+
+
+class TestGameEngine(unittest.TestCase):
+
+    def test_run(self):
+        rule = "equal(color(current), R)"
+        player = ScriptedPlayer(["2H", "3S", "4D"])
+        other = SilentPlayer(["5C", "6H", "equal(color(current), R)"])
+        plays = []
+        ended = []
+        result = GameEngine(rule, [player, other], ["10H", "2C", "4S"],
+                            on_play=lambda *play: plays.append(play),
+                            on_end=ended.append).run()
+        self.assertEqual(1, result.ended_by)
+        self.assertEqual("equal(color(current), R)", result.rule)
+        self.assertEqual(5, result.turns)
+        self.assertEqual(3, result.accepted)
+        self.assertEqual(["2H", "6H", "4D"], result.cards)
+        self.assertEqual([("2H", True), ("5C", False), ("3S", False),
+                          ("6H", True), ("4D", True)], player.updates)
+        self.assertEqual([(0, "2H", True), (1, "5C", False),
+                          (0, "3S", False), (1, "6H", True),
+                          (0, "4D", True)], plays)
+        self.assertEqual([result], ended)
+        self.assertTrue(phase2.game_ended)
+
+    def test_rounds(self):
+        player = ScriptedPlayer(["JH", "QH", "KH"])
+        result = GameEngine("if(is_royal(current), False)", [player],
+                            ["10H", "2C", "4S"], rounds=2).run()
+        self.assertIsNone(result.ended_by)
+        self.assertEqual(2, result.turns)
+        self.assertEqual(0, result.accepted)
+        self.assertEqual(["10H", "2C", "4S"], result.cards)
+
+    def test_contexts(self):
+        phase2.game_ended = False
+        contexts = [phase2.GameContext(), phase2.GameContext()]
+        players = [Game.Player(["10H", "2C", "4S"], max_rule_constancy=1,
+                               context=c) for c in contexts]
+        GameEngine("equal(color(current), R)", [players[0]],
+                   ["10H", "2C", "4S"], rounds=3, context=contexts[0]).run()
+        self.assertTrue(contexts[0].game_ended)
+        self.assertFalse(contexts[1].game_ended)
+        self.assertFalse(phase2.game_ended)
+        self.assertFalse(is_card(players[0].play()))
+        self.assertTrue(is_card(players[1].play()))
+
+    def test_legacy_context(self):
+        phase2.game_ended = False
+        self.assertFalse(phase2.legacy_context.game_ended)
+        phase2.legacy_context.game_ended = True
+        self.assertTrue(phase2.game_ended)
+        phase2.game_ended = False
+
+
+if __name__ == '__main__':
+    unittest.main()
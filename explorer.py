@@ -0,0 +1,314 @@
+"""
+Enumerates the rules built from the new_eleusis primitives, up to a number of
+nodes, keeping one rule per class of logically equivalent rules
+
+The rules are built bottom-up, from the smallest: every expression is
+evaluated over all the 52 ** 3 lists of three cards (see truth_table), and
+an expression whose values are the same as those of a smaller one (or of an
+equally large one which comes first in alphabetical order) is dropped, so
+that larger expressions are only built from the canonical representatives
+of their subexpressions. Expressions which raise for some cards are dropped
+too. The resulting corpus of rules is written as one line of JSON per rule:
+
+    $ python explorer.py --max-size 6 --workers 4 --output corpus.jsonl
+"""
+import argparse
+import hashlib
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations_with_replacement, product
+
+import numpy as np
+
+from cards import SUITS
+from new_eleusis import parse
+from truth_table import NUM_SEQUENCES, TruthTable, _Error, _evaluate
+
+# The leaves of every type of expression
+LEAVES = {
+    'card': ['previous2', 'previous', 'current'],
+    'bool': ['True', 'False'],
+}
+
+# The constants an expression of the type can be compared with by equal
+CONSTANTS = {
+    'suit': list(SUITS),
+    'color': ['R', 'B'],
+    'value': [str(v) for v in range(1, 14)],
+}
+
+# (function, argument type, result type)
+UNARY = [
+    ('suit', 'card', 'suit'),
+    ('color', 'card', 'color'),
+    ('value', 'card', 'value'),
+    ('is_royal', 'card', 'bool'),
+    ('even', 'card', 'bool'),
+    ('odd', 'card', 'bool'),
+    ('plus1', 'value', 'value'),
+    ('minus1', 'value', 'value'),
+    ('not', 'bool', 'bool'),
+]
+
+# (function, argument type, commutative); all of them return a bool
+BINARY = [('equal', t, True)
+          for t in ['card', 'suit', 'color', 'value', 'bool']] + [
+    ('less', 'value', False),
+    ('greater', 'value', False),
+    ('less', 'card', False),
+    ('greater', 'card', False),
+    ('and', 'bool', True),
+    ('or', 'bool', True),
+]
+
+# number of candidate expressions evaluated per task of a worker process
+CHUNK_SIZE = 256
+
+
+class Expression:
+    """
+    A canonical representative of a class of equivalent expressions
+
+    Parameters
+    ----------
+    rule: str
+        String representation of the expression
+    kind: str
+        The type of its values: one of 'card', 'suit', 'color', 'value' or
+        'bool'
+    size: int
+        The number of nodes, leaves included
+    depth: int
+        The number of nodes on the longest path from the root to a leaf
+    accepted: int
+        For bool expressions, the number of lists of three cards accepted
+    fingerprint: str
+        For bool expressions, the fingerprint of their truth table
+    """
+    def __init__(self, rule, kind, size, depth, accepted=None,
+                 fingerprint=None):
+        self.rule = rule
+        self.kind = kind
+        self.size = size
+        self.depth = depth
+        self.accepted = accepted
+        self.fingerprint = fingerprint
+
+    def record(self):
+        """Returns the entry of this rule in the corpus"""
+        return {'rule': self.rule, 'size': self.size, 'depth': self.depth,
+                'accepted': self.accepted,
+                'ratio': self.accepted / NUM_SEQUENCES,
+                'fingerprint': self.fingerprint}
+
+
+def valueSignature(rule, is_bool=False):
+    """
+    Evaluates an expression over all the lists of three cards
+
+    Parameters
+    ----------
+    rule: str
+        String representation of the expression
+    is_bool: bool
+        Whether to also return the acceptance of a bool expression
+
+    Returns
+    -------
+    signature: bytes
+        A digest of the values of the expression, which is the same for
+        exactly the equivalent expressions, or None if it raises for some
+        cards
+    accepted: int
+        For bool expressions, the number of lists of three cards accepted
+    fingerprint: str
+        For bool expressions, the fingerprint of the truth table
+    """
+    column = _evaluate(parse(rule))
+    used = np.bincount(np.ravel(column.codes),
+                       minlength=len(column.vocab)) > 0
+    vocab = [(i, v) for i, v in enumerate(column.vocab) if used[i]]
+    if any(isinstance(v, _Error) for i, v in vocab):
+        return None, None, None
+    # number the values in a canonical order, so that the codes of two
+    # equivalent expressions are the same
+    vocab.sort(key=lambda iv: (type(iv[1]).__name__, repr(iv[1])))
+    remap = np.zeros(len(column.vocab), dtype=np.uint8)
+    for code, (i, v) in enumerate(vocab):
+        remap[i] = code
+    values = np.broadcast_to(remap[column.codes], (52, 52, 52))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([v for i, v in vocab]).encode())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    if not is_bool:
+        return digest.digest(), None, None
+    truthy = np.array([bool(v) for v in column.vocab])
+    mask = truthy[np.broadcast_to(column.codes, (52, 52, 52))].ravel()
+    table = TruthTable(np.packbits(mask))
+    return digest.digest(), int(mask.sum()), table.fingerprint()
+
+
+def _signatures(task):
+    return [valueSignature(rule, kind == 'bool') for kind, rule in task]
+
+
+def _call(f, *args):
+    return f + '(' + ', '.join(args) + ')'
+
+
+def candidates(size, expressions, max_depth=None):
+    """
+    Builds the expressions of a given size from smaller representatives
+
+    Parameters
+    ----------
+    size: int
+        The number of nodes of the expressions to build
+    expressions: dict
+        The representatives found so far, as lists of Expression by type
+    max_depth: int
+        The maximum depth of the expressions, or None
+
+    Returns
+    -------
+    candidates: list
+        Tuples of (rule, type, depth), in the order in which they are
+        considered as representatives
+    """
+    def sized(kind, n):
+        return [e for e in expressions.get(kind, [])
+                if e.size == n and (max_depth is None or e.depth < max_depth)]
+
+    found = []
+    for f, arg, result in UNARY:
+        for e in sized(arg, size - 1):
+            found.append((_call(f, e.rule), result, e.depth + 1))
+
+    for f, arg, commutative in BINARY:
+        if f == 'equal' and arg in CONSTANTS:
+            for e in sized(arg, size - 2):
+                for c in CONSTANTS[arg]:
+                    found.append((_call(f, e.rule, c), 'bool', e.depth + 1))
+        for left in range(1, size - 1):
+            right = size - 1 - left
+            if commutative and left > right:
+                continue
+            if commutative and left == right:
+                pairs = combinations_with_replacement(sized(arg, left), 2)
+            else:
+                pairs = product(sized(arg, left), sized(arg, right))
+            for a, b in pairs:
+                found.append((_call(f, a.rule, b.rule), 'bool',
+                              max(a.depth, b.depth) + 1))
+
+    for sizes in product(range(1, size - 2), repeat=2):
+        third = size - 1 - sum(sizes)
+        if third < 1:
+            continue
+        for a, b, c in product(sized('bool', sizes[0]),
+                               sized('bool', sizes[1]),
+                               sized('bool', third)):
+            found.append((_call('iff', a.rule, b.rule, c.rule), 'bool',
+                          max(a.depth, b.depth, c.depth) + 1))
+
+    found.sort(key=lambda c: c[0])
+    return found
+
+
+def explore(max_size, max_depth=None, workers=1, progress=None):
+    """
+    Enumerates the rules up to a number of nodes, one per equivalence class
+
+    Parameters
+    ----------
+    max_size: int
+        The maximum number of nodes of the rules, leaves included
+    max_depth: int
+        The maximum depth of the rules, or None
+    workers: int
+        The number of processes evaluating the expressions of each size
+    progress: callable
+        Optional callback, called as progress(size, candidates, new) after
+        the expressions of each size were deduplicated
+
+    Returns
+    -------
+    rules: list
+        The representatives of all the classes of rules (bool expressions),
+        as Expressions ordered by size and then alphabetically
+    """
+    expressions = {}
+    seen = {}
+    for kind, leaves in LEAVES.items():
+        for leaf in leaves:
+            signature, accepted, fingerprint = valueSignature(
+                leaf, kind == 'bool')
+            seen.setdefault(kind, set()).add(signature)
+            expressions.setdefault(kind, []).append(
+                Expression(leaf, kind, 1, 1, accepted, fingerprint))
+
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        for size in range(2, max_size + 1):
+            found = candidates(size, expressions, max_depth)
+            tasks = [[(kind, rule) for rule, kind, depth in
+                      found[i:i + CHUNK_SIZE]]
+                     for i in range(0, len(found), CHUNK_SIZE)]
+            if executor is None:
+                results = map(_signatures, tasks)
+            else:
+                results = executor.map(_signatures, tasks)
+            new = 0
+            signatures = (s for chunk in results for s in chunk)
+            for (rule, kind, depth), (signature, accepted, fingerprint) in \
+                    zip(found, signatures):
+                if signature is None or signature in seen.setdefault(
+                        kind, set()):
+                    continue
+                seen[kind].add(signature)
+                expressions.setdefault(kind, []).append(Expression(
+                    rule, kind, size, depth, accepted, fingerprint))
+                new += 1
+            if progress is not None:
+                progress(size, len(found), new)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return expressions.get('bool', [])
+
+
+def loadCorpus(path):
+    """Reads the records of a corpus written by explorer.py"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--max-size', type=int, default=5,
+                        help='maximum number of nodes of the rules')
+    parser.add_argument('--max-depth', type=int,
+                        help='maximum depth of the rules')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--output', help='JSONL output file (default stdout)')
+    args = parser.parse_args()
+
+    def progress(size, found, new):
+        print('size {}: {} candidates, {} new classes'.format(
+            size, found, new), file=sys.stderr)
+
+    rules = explore(args.max_size, args.max_depth, args.workers, progress)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for e in rules:
+            out.write(json.dumps(e.record()) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
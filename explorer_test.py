@@ -0,0 +1,38 @@
+import unittest
+from explorer import explore, valueSignature
+from truth_table import ruleTruthTable
+
+
+class TestExplorer(unittest.TestCase):
+
+    def test_signature(self):
+        same = ["equal(color(current), R)",
+                "not(equal(color(current), B))",
+                "or(equal(suit(current), D), equal(suit(current), H))"]
+        signatures = {valueSignature(rule)[0] for rule in same}
+        self.assertEqual(1, len(signatures))
+        self.assertNotEqual(valueSignature("suit(current)")[0],
+                            valueSignature("suit(previous)")[0])
+        self.assertEqual((None, None, None),
+                         valueSignature("less(value(current), 5)"))
+
+    def test_explore(self):
+        rules = explore(4)
+        names = [e.rule for e in rules]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(len(rules), len({e.fingerprint for e in rules}))
+        self.assertEqual(sorted(rules, key=lambda e: e.size), rules)
+        self.assertIn("equal(color(current), R)", names)
+        self.assertNotIn("not(equal(color(current), B))", names)
+        for e in rules:
+            self.assertLessEqual(e.size, 4)
+            table = ruleTruthTable(e.rule)
+            self.assertEqual(table.fingerprint(), e.fingerprint)
+            self.assertEqual(table.count(), e.accepted)
+        self.assertEqual([e.record() for e in rules],
+                         [e.record() for e in explore(4, workers=2)])
+        self.assertTrue(all(e.depth <= 2 for e in explore(4, max_depth=2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+"""
+Opt-in counters and histograms of the hot paths of the game
+
+Nothing is recorded until enable() is called, and disabling removes every
+hook again, so that the game runs at full speed when it is not instrumented:
+
+    >>> import instrumentation
+    >>> instrumentation.enable()
+    >>> ...  # play games
+    >>> print(instrumentation.exportPrometheus())
+
+The calls of parse and getRulesForSequence made while enabled are counted
+from the statistics of their caches. The evaluations of Trees and the turns
+of Game.Player are recorded by wrapping the methods of their classes: every
+Tree.evaluate call is counted once, its subtrees being evaluated within it,
+and compiled rules are counted once per call of the closure returned by
+Tree.compile.
+"""
+import bisect
+import json
+import time
+from functools import wraps
+
+import new_eleusis
+import rule_functions
+import Game
+
+# Upper bounds of the buckets of the histograms, in seconds for latencies
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+# Prefix of the names of the metrics
+PREFIX = 'eleusis_'
+
+
+class Histogram:
+    """
+    Counts observations in buckets of values
+
+    Parameters
+    ----------
+    buckets: list
+        The increasing upper bounds of the buckets; values above the last
+        one are only counted in the total
+    """
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """Returns the buckets and their cumulative counts, the sum and the
+        number of the observations"""
+        cumulative = []
+        total = 0
+        for c in self.counts[:-1]:
+            total += c
+            cumulative.append(total)
+        return {'buckets': list(self.buckets), 'counts': cumulative,
+                'sum': self.sum, 'count': self.count}
+
+
+def _cacheCounts():
+    parse = new_eleusis.parse.cache_info()
+    rules = rule_functions._rulesForSequence.cache_info()
+    return {'parse_calls': parse.hits + parse.misses,
+            'parse_cache_misses': parse.misses,
+            'get_rules_for_sequence_calls': rules.hits + rules.misses,
+            'get_rules_for_sequence_cache_misses': rules.misses}
+
+
+class _Metrics:
+    """The metrics recorded since the last reset"""
+
+    def __init__(self):
+        self.counters = {'tree_evaluate_calls': 0, 'compiled_rule_calls': 0}
+        self.histograms = {
+            'choose_card_seconds': Histogram(LATENCY_BUCKETS),
+            'apply_accepted_card_seconds': Histogram(LATENCY_BUCKETS),
+            'apply_rejected_card_seconds': Histogram(LATENCY_BUCKETS),
+            'hypothesis_rule_sets': Histogram(SIZE_BUCKETS),
+            'hypothesis_rules': Histogram(SIZE_BUCKETS),
+        }
+        self.gauges = {'hypothesis_rule_sets': 0, 'hypothesis_rules': 0}
+        # the cache calls counted while enabled, and the statistics of the
+        # caches when last enabled (None while disabled)
+        self.caches = dict.fromkeys(_cacheCounts(), 0)
+        self.baseline = None
+
+    def cacheCounts(self):
+        """The cache calls counted so far, including the ones since the
+        metrics were last enabled"""
+        counts = dict(self.caches)
+        if self.baseline is not None:
+            for name, value in _cacheCounts().items():
+                # a cleared cache starts counting from zero again
+                base = self.baseline[name]
+                counts[name] += value - base if value >= base else value
+        return counts
+
+
+_metrics = _Metrics()
+
+# the original methods replaced while enabled, by class and name
+_originals = {}
+
+
+def _countEvaluate(evaluate):
+    @wraps(evaluate)
+    def counted(self, cards):
+        _metrics.counters['tree_evaluate_calls'] += 1
+        return evaluate(self, cards)
+    return counted
+
+
+def _countCompiled(compile):
+    @wraps(compile)
+    def counted(self):
+        evaluate = compile(self)
+
+        def counted_evaluate(cards):
+            _metrics.counters['compiled_rule_calls'] += 1
+            return evaluate(cards)
+        return counted_evaluate
+    return counted
+
+
+def _timed(name):
+    def wrap(method):
+        @wraps(method)
+        def timed(self, *args):
+            start = time.perf_counter()
+            try:
+                return method(self, *args)
+            finally:
+                _metrics.histograms[name].observe(time.perf_counter() - start)
+        return timed
+    return wrap
+
+
+def _recordHypothesis(update):
+    @wraps(update)
+    def recorded(self, card, result):
+        update(self, card, result)
+        rule_sets = len(self.hypothesis_set)
+        rules = sum(len(rule_set) for rule_set in self.hypothesis_set)
+        _metrics.histograms['hypothesis_rule_sets'].observe(rule_sets)
+        _metrics.histograms['hypothesis_rules'].observe(rules)
+        _metrics.gauges['hypothesis_rule_sets'] = rule_sets
+        _metrics.gauges['hypothesis_rules'] = rules
+    return recorded
+
+
+_hooks = [
+    (new_eleusis.Tree, 'evaluate', _countEvaluate),
+    (new_eleusis.Tree, 'compile', _countCompiled),
+    (Game.Player, 'chooseCard', _timed('choose_card_seconds')),
+    (Game.Player, 'applyAcceptedCard', _timed('apply_accepted_card_seconds')),
+    (Game.Player, 'applyRejectedCard', _timed('apply_rejected_card_seconds')),
+    (Game.Player, 'update_card_to_boardstate', _recordHypothesis),
+]
+
+
+def enabled():
+    """Tells whether the metrics are being recorded"""
+    return bool(_originals)
+
+
+def enable():
+    """Starts recording the metrics, adding to the ones recorded so far"""
+    if enabled():
+        return
+    for cls, name, hook in _hooks:
+        original = cls.__dict__[name]
+        _originals[cls, name] = original
+        setattr(cls, name, hook(original))
+    _metrics.baseline = _cacheCounts()
+
+
+def disable():
+    """Stops recording the metrics, which keep their values"""
+    _metrics.caches = _metrics.cacheCounts()
+    _metrics.baseline = None
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+
+def reset():
+    """Forgets the metrics recorded so far"""
+    global _metrics
+    _metrics = _Metrics()
+    if enabled():
+        _metrics.baseline = _cacheCounts()
+
+
+def snapshot():
+    """
+    Returns the metrics recorded since the last reset
+
+    Returns
+    -------
+    metrics: dict
+        With 'counters', 'gauges' and 'histograms', each a dictionary by the
+        name of the metric
+    """
+    counters = dict(_metrics.counters)
+    counters.update(_metrics.cacheCounts())
+    return {'counters': counters, 'gauges': dict(_metrics.gauges),
+            'histograms': {name: h.snapshot()
+                           for name, h in _metrics.histograms.items()}}
+
+
+def merge(snapshots):
+    """
+    Adds up snapshots, e.g. of the games played in several processes
+
+    Parameters
+    ----------
+    snapshots: list
+        Snapshots as returned by snapshot
+
+    Returns
+    -------
+    metrics: dict
+        The sum of the counters and histograms, and the gauges of the last
+        snapshot
+    """
+    total = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for s in snapshots:
+        for name, value in s['counters'].items():
+            total['counters'][name] = total['counters'].get(name, 0) + value
+        total['gauges'].update(s['gauges'])
+        for name, h in s['histograms'].items():
+            t = total['histograms'].get(name)
+            if t is None:
+                total['histograms'][name] = dict(h, counts=list(h['counts']))
+                continue
+            assert t['buckets'] == h['buckets']
+            t['counts'] = [a + b for a, b in zip(t['counts'], h['counts'])]
+            t['sum'] += h['sum']
+            t['count'] += h['count']
+    return total
+
+
+def exportJSON(metrics=None):
+    """Returns a snapshot (by default the current one) as JSON text"""
+    return json.dumps(snapshot() if metrics is None else metrics, indent=2)
+
+
+def exportPrometheus(metrics=None):
+    """Returns a snapshot (by default the current one) in the text format of
+    Prometheus"""
+    if metrics is None:
+        metrics = snapshot()
+    lines = []
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append('# TYPE {}{}_total counter'.format(PREFIX, name))
+        lines.append('{}{}_total {}'.format(PREFIX, name, value))
+    for name, value in sorted(metrics['gauges'].items()):
+        lines.append('# TYPE {}{} gauge'.format(PREFIX, name))
+        lines.append('{}{} {}'.format(PREFIX, name, value))
+    for name, h in sorted(metrics['histograms'].items()):
+        lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+        for bound, count in zip(h['buckets'], h['counts']):
+            lines.append('{}{}_bucket{{le="{}"}} {}'.format(
+                PREFIX, name, bound, count))
+        lines.append('{}{}_bucket{{le="+Inf"}} {}'.format(
+            PREFIX, name, h['count']))
+        lines.append('{}{}_sum {}'.format(PREFIX, name, h['sum']))
+        lines.append('{}{}_count {}'.format(PREFIX, name, h['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path, metrics=None):
+    """Writes a snapshot (by default the current one) to a file, in the text
+    format of Prometheus when its name ends with .prom and as JSON
+    otherwise"""
+    if path.endswith('.prom'):
+        text = exportPrometheus(metrics)
+    else:
+        text = exportJSON(metrics) + '\n'
+    with open(path, 'w') as f:
+        f.write(text)
@@ -0,0 +1,80 @@
+import json
+import unittest
+
+import instrumentation
+import Game
+import phase2
+from rule_functions import *
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled(self):
+        evaluate = Tree.evaluate
+        instrumentation.enable()
+        self.assertIsNot(evaluate, Tree.evaluate)
+        instrumentation.disable()
+        self.assertIs(evaluate, Tree.evaluate)
+        instrumentation.reset()
+        parse("not(even(current))").evaluate(["2D", "3D", "4D"])
+        getRulesForSequence(["2D", "3D", "4D"])
+        counters = instrumentation.snapshot()['counters']
+        self.assertEqual(0, counters['tree_evaluate_calls'])
+        self.assertEqual(0, counters['parse_calls'])
+        self.assertEqual(0, counters['get_rules_for_sequence_calls'])
+        instrumentation.enable()
+        parse("not(even(current))")
+        instrumentation.disable()
+        parse("not(even(current))")
+        getRulesForSequence(["2D", "3D", "4D"])
+        counters = instrumentation.snapshot()['counters']
+        self.assertEqual(1, counters['parse_calls'])
+        self.assertEqual(0, counters['get_rules_for_sequence_calls'])
+
+    def test_counters(self):
+        instrumentation.reset()
+        instrumentation.enable()
+        tree = parse("and(even(current), odd(previous))")
+        tree.evaluate(["2D", "3D", "4D"])
+        tree.compile()(["2D", "3D", "4D"])
+        getRulesForSequence(["2D", "3D", "4D"])
+        counters = instrumentation.snapshot()['counters']
+        self.assertEqual(1, counters['tree_evaluate_calls'])
+        self.assertEqual(1, counters['compiled_rule_calls'])
+        self.assertEqual(1, counters['parse_calls'])
+        self.assertEqual(1, counters['get_rules_for_sequence_calls'])
+
+    def test_player(self):
+        instrumentation.reset()
+        instrumentation.enable()
+        player = Game.Player(["10H", "2C", "4S"],
+                             context=phase2.GameContext())
+        player.update_card_to_boardstate(player.play(), True)
+        player.update_card_to_boardstate(player.play(), False)
+        metrics = instrumentation.snapshot()
+        histograms = metrics['histograms']
+        self.assertEqual(2, histograms['choose_card_seconds']['count'])
+        self.assertEqual(2, histograms['apply_accepted_card_seconds']['count'])
+        self.assertEqual(1, histograms['apply_rejected_card_seconds']['count'])
+        self.assertEqual(2, histograms['hypothesis_rules']['count'])
+        self.assertEqual(
+            sum(len(rs) for rs in player.hypothesis_set),
+            metrics['gauges']['hypothesis_rules'])
+
+        self.assertEqual(metrics, json.loads(
+            instrumentation.exportJSON(metrics)))
+        text = instrumentation.exportPrometheus(metrics)
+        self.assertIn('# TYPE eleusis_choose_card_seconds histogram', text)
+        self.assertIn('eleusis_choose_card_seconds_bucket{le="+Inf"} 2', text)
+
+        merged = instrumentation.merge([metrics, metrics])
+        self.assertEqual(4, merged['histograms']['choose_card_seconds'][
+            'count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,104 +1,64 @@
 """
 This file tests the runnning of the game
 """
+import argparse
+
+import instrumentation
 import phase2
 import Game
-from rule_functions import parse, is_card
+from engine import GameEngine
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Plays a game of New Eleusis')
+    parser.add_argument('--metrics',
+                        help='file to write the metrics of the game to, in '
+                             'the Prometheus text format if it ends with '
+                             '.prom and as JSON otherwise')
+    args = parser.parse_args()
+    if args.metrics:
+        instrumentation.enable()
+
     # Set a rule for testing
     rule = "if(is_royal(current), False)"
-    judge = Game.Scorer(rule)
+    context = phase2.GameContext()
+    judge = Game.Scorer(rule, context)
 
     cards = ["10H", "2C", "4S"]
-    tree = parse(rule)
-
-    player = Game.Player(cards)
-    adversary1 = phase2.Adversary()
-    adversary2 = phase2.Adversary()
-    adversary3 = phase2.Adversary()
-
-    # The score function needs to know if this was the player that ended the
-    # game
-    ended_player = 0
-
-    for round_num in range(14):
-        try:
-            # Player 1 plays
-            player_card_rule = player.play()
-            print("The player played", player_card_rule)
-            if is_card(player_card_rule):
-                # checking whether card played is correct or wrong
-                temp_cards = [cards[-2], cards[-1], player_card_rule]
-                result = tree.evaluate(tuple(temp_cards))
-                if result:
-                    del cards[0]
-                    cards.append(player_card_rule)
-                # player updating board state based on card played and result
-                player.update_card_to_boardstate(player_card_rule, result)
-            else:
-                ended_player = 0
-                raise Exception('')
 
-            # Adversary 1 plays
-            ad1_card_rule = adversary1.play()
-            print("Adversary 1 played", ad1_card_rule)
-            if is_card(ad1_card_rule):
-                temp_cards = [cards[-2], cards[-1], ad1_card_rule]
-                result = tree.evaluate(tuple(temp_cards))
-                if result:
-                    del cards[0]
-                    cards.append(ad1_card_rule)
-                player.update_card_to_boardstate(ad1_card_rule, result)
-            else:
-                ended_player = 1
-                raise Exception('')
-
-            # Adversary 2 plays
-            ad2_card_rule = adversary2.play()
-            print("Adversary 2 played", ad2_card_rule)
-            if is_card(ad2_card_rule):
-                temp_cards = [cards[-2], cards[-1], ad2_card_rule]
-                result = tree.evaluate(tuple(temp_cards))
-                if result:
-                    del cards[0]
-                    cards.append(ad2_card_rule)
-                player.update_card_to_boardstate(ad2_card_rule, result)
-            else:
-                ended_player = 2
-                raise Exception('')
-
-            # Adversary 3 plays
-            ad3_card_rule = adversary3.play()
-            print("Adversary 3 played", ad3_card_rule)
-            if is_card(ad3_card_rule):
-                temp_cards = [cards[-2], cards[-1], ad3_card_rule]
-                result = tree.evaluate(tuple(temp_cards))
-                if result:
-                    del cards[0]
-                    cards.append(ad3_card_rule)
-                player.update_card_to_boardstate(ad3_card_rule, result)
-            else:
-                ended_player = 3
-                raise Exception('')
+    player = Game.Player(cards, context=context)
+    players = [player, phase2.Adversary(), phase2.Adversary(),
+               phase2.Adversary()]
+    names = ["The player"] + ["Adversary {}".format(i)
+                              for i in range(1, len(players))]
 
+    def on_play(i, card, accepted):
+        print(names[i], "played", card)
+        if i == len(players) - 1:
             print("The board state is:", player.boardState())
 
-        except Exception:
-            print("The game ends!")
-            phase2.game_ended = True
-            break
+    def on_end(result):
+        if result.ended_by is not None:
+            print(names[result.ended_by], "returned", result.rule)
+        print("The game ends!")
+
+    result = GameEngine(rule, players, cards, rounds=14, on_play=on_play,
+                        on_end=on_end, context=context).run()
 
     # Everyone has to guess a rule
     rule_player = player.play()
     print("The rule guessed by the player was", rule_player)
 
-    # Check if the guessed rule is correct and print the score
-    is_player = (ended_player == 0)
+    # Check if the guessed rule is correct and print the score. The score
+    # function needs to know if this was the player that ended the game; when
+    # nobody did, the player is counted as having ended it.
+    is_player = result.ended_by in (0, None)
     the_score = judge.score(player, is_player)
     print("The score for player was ", the_score)
 
+    if args.metrics:
+        instrumentation.dump(args.metrics)
+
 
 if __name__ == '__main__':
     main()
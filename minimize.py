@@ -0,0 +1,103 @@
+"""
+Minimization of the rules hypothesized by the Player
+
+The hypothesis of the Player is a disjunction of rule sets, each the
+conjunction of predicates (atoms) like the ones of getRulesForSequence. It
+is minimized like a sum of products in the Espresso heuristic, with the
+truth tables of the atoms standing for the truth assignments of boolean
+variables, so that the implications between atoms (e.g. a value implies a
+parity and a suit a color) are taken into account without listing them:
+
+    * every conjunction only keeps the atoms which are not implied by
+      another of its atoms (see truth_table.removeImpliedRules);
+    * expand: the atoms of every conjunction are dropped, the longest first,
+      as long as the conjunction still only accepts cards the whole
+      disjunction accepts, which merges the conjunctions that only differ
+      by complementary atoms like the Quine-McCluskey method does;
+    * irredundant: the conjunctions whose cards are all accepted by the
+      other ones are dropped, the longest first.
+
+None of the steps changes the cards accepted by the disjunction, so the
+minimized rule is equivalent to the original one.
+"""
+import numpy as np
+
+from rule_functions import combineListOfRules
+from truth_table import NUM_SEQUENCES, TruthTable, removeImpliedRules, \
+    ruleSetTruthTable
+
+
+def _length(rule_set):
+    return sum(len(r) for r in rule_set)
+
+
+def minimizeRuleSets(rule_sets):
+    """
+    Minimizes a disjunction of conjunctions of predicates
+
+    Parameters
+    ----------
+    rule_sets: list
+        Lists of string representations of predicates, each standing for
+        their conjunction
+
+    Returns
+    -------
+    minimized: list
+        New lists of predicates whose disjunction accepts the same lists of
+        three cards as the one of rule_sets
+    """
+    terms = []
+    for rule_set in rule_sets:
+        term = removeImpliedRules(rule_set)
+        if term and term not in terms:
+            terms.append(term)
+    tables = [ruleSetTruthTable(t) for t in terms]
+    union = np.zeros(NUM_SEQUENCES // 8, dtype=np.uint8)
+    for table in tables:
+        union |= table.bits
+    union = TruthTable(union)
+
+    # expand
+    for k, term in enumerate(terms):
+        for atom in sorted(term, key=len, reverse=True):
+            if len(term) == 1:
+                break
+            candidate = [r for r in term if r != atom]
+            table = ruleSetTruthTable(candidate)
+            if table.issubset(union):
+                term = candidate
+                tables[k] = table
+        terms[k] = term
+
+    # irredundant
+    kept = list(range(len(terms)))
+    for k in sorted(kept, key=lambda k: _length(terms[k]), reverse=True):
+        if len(kept) == 1:
+            # a rule accepting no cards at all still needs a conjunction
+            break
+        others = np.zeros(NUM_SEQUENCES // 8, dtype=np.uint8)
+        for j in kept:
+            if j != k:
+                others |= tables[j].bits
+        if tables[k].issubset(TruthTable(others)):
+            kept.remove(k)
+    return [terms[k] for k in kept]
+
+
+def minimizedRule(rule_sets):
+    """
+    Returns the rule of the minimized disjunction of conjunctions of
+    predicates (see minimizeRuleSets)
+
+    Parameters
+    ----------
+    rule_sets: list
+        Lists of string representations of predicates
+
+    Returns
+    -------
+    rule: str
+        String representation of the minimized rule
+    """
+    return combineListOfRules(minimizeRuleSets(rule_sets))
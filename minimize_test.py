@@ -0,0 +1,62 @@
+import random
+import unittest
+import Game
+import phase2
+from engine import GameEngine
+from minimize import minimizeRuleSets, minimizedRule
+from rule_functions import combineListOfRules, getRandomRule, parse
+from simulate import dealCards
+from truth_table import ruleSetTruthTable
+
+
+def disjunction_table(rule_sets):
+    """The truth table of the disjunction of conjunctions of predicates"""
+    table = ruleSetTruthTable(rule_sets[0])
+    for rule_set in rule_sets[1:]:
+        table = table | ruleSetTruthTable(rule_set)
+    return table
+
+
+class TestMinimize(unittest.TestCase):
+
+    def test_minimize(self):
+        red = "equal(color(current), R)"
+        hearts = "equal(suit(current), H)"
+        odd = "odd(previous)"
+        # complementary atoms, implied atoms and absorbed conjunctions
+        self.assertEqual([[red]], minimizeRuleSets(
+            [[red, odd], [red, "not(odd(previous))"]]))
+        self.assertEqual([[hearts]], minimizeRuleSets(
+            [[red, hearts], [hearts, odd]]))
+        self.assertEqual([[red]], minimizeRuleSets([[red], [hearts, odd]]))
+        self.assertEqual([["equal(value(current), 2)"], [odd, hearts]],
+                         minimizeRuleSets([["equal(value(current), 2)",
+                                            "even(current)"],
+                                           [odd, hearts], [odd, hearts]]))
+        nothing = [[red, "equal(color(current), B)"]]
+        self.assertEqual(1, len(minimizeRuleSets(nothing)))
+
+    def test_hypotheses(self):
+        random.seed(2)
+        for game in range(6):
+            rule = parse(str(getRandomRule()))
+            cards = dealCards(rule)
+            context = phase2.GameContext()
+            player = Game.Player(cards, context=context)
+            GameEngine(rule, [player], cards, context=context).run()
+            if not player.hypothesis_set:
+                continue
+            hypothesis = combineListOfRules(player.hypothesis_set)
+            minimized = minimizedRule(player.hypothesis_set)
+            # compared atom by atom: the atoms negate_rule makes from
+            # greater() rules, like less(alue(current), value(previous)),
+            # do not parse the same once combined into a single rule
+            self.assertEqual(
+                disjunction_table(player.hypothesis_set),
+                disjunction_table(minimizeRuleSets(player.hypothesis_set)))
+            self.assertLessEqual(len(minimized), len(hypothesis))
+            self.assertEqual(minimized, player.simplifyRules())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,9 @@
+import re
+import weakref
+from functools import lru_cache, partial
+from operator import itemgetter
+from cards import *
+
 # Trivial functions to be used in the important test functions
 # All require a nonempty string as the argument
 
@@ -20,37 +26,54 @@ def is_value(s):
 
 def is_card(s):
     """Test if parameter is a value followed by a suit"""
+    if s in CARD_INDEX:
+        return True
     return is_suit(s[-1]) and is_value(s[:len(s) - 1])
 
 
+_values = [None] + VALUE_NAMES
+_value_numbers = {name: number for number, name in enumerate(_values)}
+
+
 def value_to_number(name):
     """Given the "value" part of a card, returns its numeric value"""
-    values = [None, 'A', '2', '3', '4', '5', '6',
-              '7', '8', '9', '10', 'J', 'Q', 'K']
-    return values.index(name)
+    number = _value_numbers.get(name)
+    if number is None:
+        return _values.index(name)
+    return number
 
 
 def number_to_value(number):
     """Given the numeric value of a card, returns its "value" name"""
-    values = [None, 'A', '2', '3', '4', '5', '6',
-              '7', '8', '9', '10', 'J', 'Q', 'K']
-    return values[number]
+    return _values[number]
 
 # -------------------- Important functions
 
 
 def suit(card):
     """Returns the suit of a card"""
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_SUIT[i]
     return card[-1]
 
 
+_colors = {'C': 'B', 'D': 'R', 'H': 'R', 'S': 'B'}
+
+
 def color(card):
     """Returns the color of a card"""
-    return {'C': 'B', 'D': 'R', 'H': 'R', 'S': 'B'}.get(suit(card))
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_COLOR[i]
+    return _colors.get(suit(card))
 
 
 def value(card):
     """Returns the numeric value of a card or card value as an integer 1..13"""
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_VALUE[i]
     prefix = card[:len(card) - 1]
     names = {'A': 1, 'J': 11, 'Q': 12, 'K': 13}
     if prefix in names:
@@ -61,6 +84,9 @@ def value(card):
 
 def is_royal(card):
     """Tests if a card is royalty (Jack, Queen, or King)"""
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_IS_ROYAL[i]
     return value(card) > 10
 
 
@@ -76,22 +102,26 @@ def less(a, b):
        Values are compared numerically."""
     if isinstance(a, int):
         return a < b
+    i = CARD_INDEX.get(a)
+    j = CARD_INDEX.get(b)
+    if i is not None and j is not None:
+        return CARD_LESS[i][j]
     if is_card(a):
         if suit(a) != suit(b):
             return suit(a) < suit(b)
         else:
             return value(a) < value(b)
     elif is_value(a):
-        map = {'1': 'A', '11': 'J', '12': 'Q', '13': 'K'}
-        if a in map.keys():
-            a = map[a]
-        if b in map.keys():
-            b = map[b]
+        a = _value_aliases.get(a, a)
+        b = _value_aliases.get(b, b)
         return value_to_number(a) < value_to_number(b)
     else:
         return a < b
 
 
+_value_aliases = {'1': 'A', '11': 'J', '12': 'Q', '13': 'K'}
+
+
 def greater(a, b):
     """The opposite of less"""
     return less(b, a)
@@ -117,6 +147,9 @@ def plus1(x):
         assert x != 'S'
         return "CDHS"["CDHS".index(x) + 1]
     elif is_card(x):
+        i = CARD_INDEX.get(x)
+        if i is not None and CARD_PLUS1[i] is not None:
+            return CARD_PLUS1[i]
         return number_to_value(value(x) + 1) + suit(x)
     elif is_color(x):
         return "BR"["BR".index(x) - 1]
@@ -139,6 +172,9 @@ def minus1(x):
         assert x != 'C'
         return "CDHS"["CDHS".index(x) - 1]
     elif is_card(x):
+        i = CARD_INDEX.get(x)
+        if i is not None and CARD_MINUS1[i] is not None:
+            return CARD_MINUS1[i]
         return number_to_value(value(x) - 1) + suit(x)
     elif is_color(x):
         return "BR"["BR".index(x) - 1]
@@ -146,11 +182,17 @@ def minus1(x):
 
 def even(card):
     """Tells if the card's numeric value is even"""
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_EVEN[i]
     return value(card) % 2 == 0
 
 
 def odd(card):
     """Tells if the card's numeric value is odd"""
+    i = CARD_INDEX.get(card)
+    if i is not None:
+        return CARD_ODD[i]
     return value(card) % 2 != 0
 
 # -------------------- Lists of allowable functions
@@ -180,6 +222,11 @@ function_names = ['suit', 'color', 'value', 'is_royal',
                   'minus1', 'even', 'odd', 'andf', 'orf',
                   'notf', 'iff', 'and', 'or', 'not', 'if']
 
+_function_names = frozenset(function_names)
+
+# functions which take any number of arguments
+_variadic = (andf, orf)
+
 # ----- Functions for creating, printing, and evaluating Trees
 
 # Build a dictionary from function names to actual functions
@@ -194,81 +241,183 @@ def quote_if_needed(s):
     return s if s in function_names else "'" + s + "'"
 
 
+_whitespace = re.compile(r'\s+')
+_token = re.compile(r'[()]|[^(),]+')
+
+
 def scan(s):
     """This is an iterator for "tokens," where a token is a
        parenthesis or sequence of nonblank characters; commas
        and whitespace act as delimiters, and are discarded"""
-    token = ''
-    for ch in s:
-        if ch.isspace():
-            continue
-        if ch in '(),':
-            if token != '':
-                yield token
-                token = ''
-            if ch != ',':
-                yield ch
-        else:
-            token += ch
-    if token != '':
-        yield token
+    return iter(_token.findall(_whitespace.sub('', s)))
 
 
 def combine(f, args):
-    """Makes a Tree from a function and a list of arguments"""
-    if len(args) == 1:
-        return Tree(f, args[0])
-    elif len(args) == 2:
-        return Tree(f, args[0], args[1])
-    elif len(args) == 3:
-        return Tree(f, args[0], args[1], args[2])
+    """Makes a Tree from a function and a list of arguments; and and or take
+       any number of arguments"""
+    if 1 <= len(args) <= 3 or (f in _variadic and len(args) > 3):
+        return Tree(f, *args)
     else:
         raise Exception("Incorrect arguments: {} {}".format(f, str(args)))
 
 
+# Maximum number of rule strings whose parsed Tree is remembered by parse
+PARSE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
 def parse(s):
-    """Converts a string representation of a rule into a Tree"""
-    def parse2(s, i):
-        if s[i] in function_names:
-            f = to_function.get(s[i])
-            assert s[i + 1] == "(", "No open parenthesis after " + s[i]
-            (arg, i) = parse2(s, i + 2)
-            args = [arg]
-            while s[i] != ")":
-                (arg, i) = parse2(s, i)
-                args.append(arg)
-            subtree = combine(f, args)
-            return (subtree, i + 1)
-        else:
-            return (s[i], i + 1)
-    return parse2(list(scan(s)), 0)[0]
+    """Converts a string representation of a rule into a Tree; the result is
+       cached, which is safe since Trees are immutable"""
+    # The parser keeps its own stack of the functions whose arguments are
+    # being read, so that deeply nested rules do not hit the recursion limit
+    tokens = list(scan(s))
+    stack = []
+    i = 0
+    while True:
+        token = tokens[i]
+        if token in _function_names:
+            assert tokens[i + 1] == "(", "No open parenthesis after " + token
+            stack.append((to_function.get(token), []))
+            i += 2
+            # the first argument is read whatever the next token is
+            continue
+        expr = token
+        i += 1
+        # pass the finished expression up to the functions it completes
+        while True:
+            if not stack:
+                return expr
+            stack[-1][1].append(expr)
+            if tokens[i] != ")":
+                break
+            f, args = stack.pop()
+            expr = combine(f, args)
+            i += 1
+
+
+def parse_cache_info():
+    """Returns the hits and misses of the parse cache, its size, and the
+       number of distinct Tree nodes currently alive"""
+    info = parse.cache_info()
+    return {'hits': info.hits, 'misses': info.misses,
+            'maxsize': info.maxsize, 'currsize': info.currsize,
+            'nodes': len(Tree._nodes)}
+
+
+def _node_key(expr):
+    """Key under which a child of a Tree is hash-consed; the type of leaves
+       is part of it so that, e.g., True and 1 are kept apart"""
+    if isinstance(expr, Tree):
+        return expr
+    return (type(expr), expr)
 
 
 class Tree:
-
-    def __init__(self, root, first=None, second=None, third=None):
-        """Create a new Tree; default is no children"""
-        self.root = root
+    """
+    An immutable rule tree. Trees are hash-consed: building a Tree equal to
+    an existing one returns the existing node, so identical subexpressions
+    are shared and two Trees are equal exactly when they are the same object.
+    """
+    __slots__ = ('root', 'left', 'right', 'test', 'args', '_key', '_hash',
+                 '_str', '_compiled', '_depth', '__weakref__')
+
+    # all the live Trees, by their root and children
+    _nodes = weakref.WeakValueDictionary()
+
+    def __new__(cls, root, *args):
+        """Create a new Tree; default is no children. and and or take any
+           number of arguments; with more than two, the Tree keeps all of
+           them in args and has neither left nor right."""
         assert root in functions
-        if third == None:
-            self.test = None
-            self.left = first
-            self.right = second
-        else:  # rearrange parameters so test can be put first
-            self.test = first
-            self.left = second
-            self.right = third
+        if root in _variadic and len(args) > 2:
+            test = left = right = None
+            key = (root, tuple(map(_node_key, args)))
+        else:
+            assert len(args) <= 3, "Too many arguments for " + root.__name__
+            first, second, third = args + (None,) * (3 - len(args))
+            if third == None:
+                test, left, right = None, first, second
+                args = (left, right)
+            else:  # rearrange parameters so test can be put first
+                test, left, right = first, second, third
+                args = (test, left, right)
+            key = (root, _node_key(test), _node_key(left), _node_key(right))
+        node = cls._nodes.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            init = object.__setattr__
+            init(node, 'root', root)
+            init(node, 'test', test)
+            init(node, 'left', left)
+            init(node, 'right', right)
+            init(node, 'args', args)
+            init(node, '_key', key)
+            init(node, '_hash', hash(key))
+            init(node, '_str', None)
+            init(node, '_compiled', None)
+            init(node, '_depth', 1 + max(
+                [a._depth for a in args if isinstance(a, Tree)], default=0))
+            cls._nodes[key] = node
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Tree objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Tree objects are immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # pickle as a compact postfix program (see program.py), falling back
+        # to the children for constants that a program cannot hold
+        import program
+        try:
+            return (program.treeFromBytes, (program.treeToBytes(self),))
+        except ValueError:
+            pass
+        return (Tree, (self.root,) + self.args)
 
     def __str__(self):
         """Provide a printable representation of this Tree"""
-        if self.test != None:  # it's an iff Tree
-            return 'iff({}, {}, {})'.format(self.left, self.right, self.test)
-        if self.left == None and self.right == None:
-            return str(self.root)
-        elif self.right == None:
-            return '{}({})'.format(self.root.__name__, self.left)
-        else:
-            return '{}({}, {})'.format(self.root.__name__, self.left, self.right)
+        if self._str is None:
+            object.__setattr__(self, '_str', self._format())
+        return self._str
+
+    def _format(self):
+        # The pieces of the string are produced from an explicit stack, so
+        # that deeply nested Trees do not hit the recursion limit. On the
+        # stack, strings are written as they are and 1-tuples hold children.
+        parts = []
+        stack = [(self,)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+            expr = item[0]
+            if not isinstance(expr, Tree):
+                parts.append(str(expr))
+            elif expr is not self and expr._str is not None:
+                parts.append(expr._str)
+            elif expr.test != None:  # it's an iff Tree
+                stack += [')', (expr.test,), ', ', (expr.right,), ', ',
+                          (expr.left,), 'iff(']
+            elif len(expr.args) > 2:  # an and or or of many arguments
+                stack.append(')')
+                for arg in reversed(expr.args[1:]):
+                    stack += [(arg,), ', ']
+                stack += [(expr.args[0],), expr.root.__name__ + '(']
+            elif expr.left == None and expr.right == None:
+                parts.append(str(expr.root))
+            elif expr.right == None:
+                stack += [')', (expr.left,), expr.root.__name__ + '(']
+            else:
+                stack += [')', (expr.right,), ', ', (expr.left,),
+                          expr.root.__name__ + '(']
+        return ''.join(parts)
 
     def __repr__(self):
         s = "Tree("
@@ -276,6 +425,8 @@ class Tree:
             s += self.root.__name__
         else:
             str(self.root) + '!'
+        if len(self.args) > 2 and self.test == None:
+            return s + "".join(", " + repr(a) for a in self.args) + ")"
         if self.left != None:
             s += ", " + repr(self.left)
         if self.right != None:
@@ -284,6 +435,12 @@ class Tree:
             s += ", " + repr(self.test)
         return s + ")"
 
+    def compile(self):
+        """Compile this tree into a single callable which takes the list of
+           three cards and returns the same result as evaluate. The card
+           names and constants are resolved once, at compile time."""
+        return _compiled(self)
+
 #    debugging = True
 # def evaluate(self, cards):
 # """For debugging, uncomment these lines and change
@@ -295,54 +452,243 @@ class Tree:
 
     def evaluate(self, cards):
         """Evaluate this tree with the given card values"""
-        def subeval(expr):
-            if expr.__class__.__name__ == "Tree":
-                return expr.evaluate(cards)
-            else:
-                if expr == "current":
-                    return current
-                elif expr == "previous":
-                    return previous
-                elif expr == "previous2":
-                    return previous2
-                else:
-                    if expr == "True":
-                        expr = True
-                    elif expr == "False":
-                        expr = False
-                    return expr
         try:
-            (previous2, previous, current) = cards
-            f = self.root
-            if f not in functions:
-                return f
+            return _evaluate(self, cards)
+        except Exception as e:
+            print(e)
+            print("Expression = ", self)
+            print(" with cards =", cards)
+            raise
 
-            if f in [suit, color, value, is_royal, minus1, plus1, even, odd]:
-                return f(subeval(self.left))
 
-            elif f in [equal, less, greater]:
-                return f(subeval(self.left), subeval(self.right))
+# ----- Evaluating Trees
+
+_unary_functions = [suit, color, value, is_royal, minus1, plus1, even, odd]
+
+_binary_functions = [equal, less, greater]
+
+# returned by _step when a Tree has its value
+_DONE = object()
+
+
+def _leaf_value(expr, cards):
+    """The value of a leaf of a Tree"""
+    if expr == "current":
+        return cards[2]
+    elif expr == "previous":
+        return cards[1]
+    elif expr == "previous2":
+        return cards[0]
+    elif expr == "True":
+        return True
+    elif expr == "False":
+        return False
+    return expr
+
+
+def _step(tree, values):
+    """
+    Advances the evaluation of a Tree
+
+    Parameters
+    ----------
+    tree: Tree
+        The Tree being evaluated
+    values: list
+        The values of the children of tree evaluated so far, in order
+
+    Returns
+    -------
+    (child, None) with the next child to evaluate, or (_DONE, value) with
+    the value of tree. and, or and if only evaluate the children they need.
+    """
+    f = tree.root
+    n = len(values)
+
+    if f in _unary_functions:
+        return (tree.left, None) if n == 0 else (_DONE, f(values[0]))
+
+    elif f in _binary_functions:
+        if n == 0:
+            return (tree.left, None)
+        if n == 1:
+            return (tree.right, None)
+        return (_DONE, f(values[0], values[1]))
+
+    elif f == andf:
+        # and(a, b, c) is and(and(a, b), c), evaluated left to right
+        if 0 < n < len(tree.args) and not values[-1]:
+            return (_DONE, False)
+        return (tree.args[n], None) if n < len(tree.args) else \
+            (_DONE, values[-1])
+
+    elif f == orf:
+        if 0 < n < len(tree.args) and values[-1]:
+            return (_DONE, True)
+        return (tree.args[n], None) if n < len(tree.args) else \
+            (_DONE, values[-1])
+
+    elif f == notf:
+        return (tree.left, None) if n == 0 else (_DONE, not values[0])
+
+    elif f == iff:
+        if n == 0:
+            return (tree.test, None)
+        if n == 1:
+            return (tree.left if values[0] else tree.right, None)
+        return (_DONE, values[1])
+
+
+def _evaluate(tree, cards, compiled=False):
+    """
+    Evaluates a Tree with an explicit stack of the Trees being evaluated,
+    each with the values of its children so far, so that deeply nested
+    rules do not hit the recursion limit
+
+    Parameters
+    ----------
+    tree: Tree
+    cards: list
+        The three cards
+    compiled: bool
+        Whether to call the compiled closures of the subtrees shallow enough
+        to have one (see _compiled) instead of evaluating them step by step
+    """
+    stack = [(tree, [])]
+    while True:
+        expr, values = stack[-1]
+        child, result = _step(expr, values)
+        if child is not _DONE:
+            if not isinstance(child, Tree):
+                values.append(_leaf_value(child, cards))
+            elif compiled and child._depth <= COMPILE_DEPTH:
+                values.append(_compiled(child)(cards))
+            else:
+                stack.append((child, []))
+            continue
+        stack.pop()
+        if not stack:
+            return result
+        stack[-1][1].append(result)
 
-            elif f == andf:
-                if subeval(self.left):
-                    return subeval(self.right)
-                return False
 
-            elif f == orf:
-                if subeval(self.left):
-                    return True
-                return subeval(self.right)
+# ----- Compiling Trees into native Python closures
 
-            elif f == notf:
-                return not subeval(self.left)
+_card_positions = {'previous2': 0, 'previous': 1, 'current': 2}
 
-            elif f == iff:
-                if subeval(self.test):
-                    return subeval(self.left)
-                else:
-                    return subeval(self.right)
-        except Exception as e:
-            print(e)
-            print("Expression = ", self)
-            print(" with cards =", cards)
-            raise
+
+def _compile_leaf(expr):
+    """Resolves a leaf of a Tree, returning either ('card', position) or
+       ('const', value), mirroring what subeval does in evaluate"""
+    if isinstance(expr, str):
+        if expr in _card_positions:
+            return ('card', _card_positions[expr])
+        if expr == "True":
+            return ('const', True)
+        if expr == "False":
+            return ('const', False)
+    return ('const', expr)
+
+
+def _compile_operand(expr):
+    """Compiles a child of a Tree, returning ('card', position),
+       ('const', value) or ('call', callable)"""
+    if isinstance(expr, Tree):
+        return ('call', _compiled(expr))
+    return _compile_leaf(expr)
+
+
+def _as_callable(operand):
+    """Turns a compiled operand into a callable taking the cards"""
+    kind, x = operand
+    if kind == 'call':
+        return x
+    if kind == 'card':
+        return itemgetter(x)
+    return lambda cards: x
+
+
+# Maximum depth of the Trees compiled into nested closures, which recurse
+# once per level when compiled and when called; deeper Trees are evaluated
+# with _evaluate, which calls the closures of their shallow subtrees
+COMPILE_DEPTH = 100
+
+
+def _compiled(tree):
+    """Returns the closure of a Tree, compiling and caching it the first
+       time"""
+    if tree._compiled is None:
+        if tree._depth > COMPILE_DEPTH:
+            closure = partial(_evaluate, tree, compiled=True)
+        else:
+            closure = _compile(tree)
+        object.__setattr__(tree, '_compiled', closure)
+    return tree._compiled
+
+
+def _compile(tree):
+    """Builds the closure for a single Tree node; the children are compiled
+       (and cached) with _compiled"""
+    f = tree.root
+
+    if f in [suit, color, value, is_royal, minus1, plus1, even, odd]:
+        kind, x = _compile_operand(tree.left)
+        if kind == 'card':
+            return lambda cards: f(cards[x])
+        if kind == 'const':
+            return lambda cards: f(x)
+        return lambda cards: f(x(cards))
+
+    elif f in [equal, less, greater]:
+        left = _compile_operand(tree.left)
+        right = _compile_operand(tree.right)
+        if right[0] == 'const':
+            a, b = _as_callable(left), right[1]
+            return lambda cards: f(a(cards), b)
+        if left[0] == 'const':
+            a, b = left[1], _as_callable(right)
+            return lambda cards: f(a, b(cards))
+        a, b = _as_callable(left), _as_callable(right)
+        return lambda cards: f(a(cards), b(cards))
+
+    elif f in _variadic and len(tree.args) > 2:
+        args = [_as_callable(_compile_operand(arg)) for arg in tree.args]
+        return _compile_variadic(f, tuple(args[:-1]), args[-1])
+
+    elif f == andf:
+        a = _as_callable(_compile_operand(tree.left))
+        b = _as_callable(_compile_operand(tree.right))
+        return lambda cards: b(cards) if a(cards) else False
+
+    elif f == orf:
+        a = _as_callable(_compile_operand(tree.left))
+        b = _as_callable(_compile_operand(tree.right))
+        return lambda cards: True if a(cards) else b(cards)
+
+    elif f == notf:
+        a = _as_callable(_compile_operand(tree.left))
+        return lambda cards: not a(cards)
+
+    elif f == iff:
+        test = _as_callable(_compile_operand(tree.test))
+        a = _as_callable(_compile_operand(tree.left))
+        b = _as_callable(_compile_operand(tree.right))
+        return lambda cards: a(cards) if test(cards) else b(cards)
+
+
+def _compile_variadic(f, init, last):
+    """Builds the closure of an and or an or of many arguments, which loops
+       over them instead of nesting a closure per argument"""
+    if f == andf:
+        def evaluate(cards):
+            for a in init:
+                if not a(cards):
+                    return False
+            return last(cards)
+    else:
+        def evaluate(cards):
+            for a in init:
+                if a(cards):
+                    return True
+            return last(cards)
+    return evaluate
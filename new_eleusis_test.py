@@ -2,6 +2,41 @@ import unittest
 from new_eleusis import *
 
 
+def reference_scan(s):
+    """The scanner parse used before it was vectorized with regexes"""
+    token = ''
+    for ch in s:
+        if ch.isspace():
+            continue
+        if ch in '(),':
+            if token != '':
+                yield token
+                token = ''
+            if ch != ',':
+                yield ch
+        else:
+            token += ch
+    if token != '':
+        yield token
+
+
+def reference_parse(s):
+    """The recursive parser parse replaced"""
+    def parse2(s, i):
+        if s[i] in function_names:
+            f = to_function.get(s[i])
+            assert s[i + 1] == "(", "No open parenthesis after " + s[i]
+            (arg, i) = parse2(s, i + 2)
+            args = [arg]
+            while s[i] != ")":
+                (arg, i) = parse2(s, i)
+                args.append(arg)
+            return (combine(f, args), i + 1)
+        else:
+            return (s[i], i + 1)
+    return parse2(list(reference_scan(s)), 0)[0]
+
+
 class TestNewEleusis(unittest.TestCase):
 
     def test_is_suit(self):
@@ -42,6 +77,16 @@ class TestNewEleusis(unittest.TestCase):
         self.assertEqual("Q", number_to_value(12))
         self.assertEqual("K", number_to_value(13))
 
+    def test_card_encoding(self):
+        self.assertEqual(52, len(ALL_CARDS))
+        for i, card in enumerate(ALL_CARDS):
+            self.assertEqual(i, CARD_INDEX[card])
+        self.assertEqual(CARD_INDEX["AS"], CARD_INDEX["1S"])
+        self.assertEqual(1, value("1S"))
+        self.assertTrue(CARD_LESS[CARD_INDEX["10C"]][CARD_INDEX["2D"]])
+        self.assertFalse(CARD_LESS[CARD_INDEX["2D"]][CARD_INDEX["10C"]])
+        self.assertIsNone(CARD_PLUS1[CARD_INDEX["KH"]])
+
     def test_suit(self):
         self.assertEqual('S', suit("AS"))
         self.assertEqual('D', suit("10D"))
@@ -259,12 +304,123 @@ class TestNewEleusis(unittest.TestCase):
              'current', '(', 'R', ')', ')', 'False', ')'],
             list(scan("iff(equal(previous, B), equal(current(R)), False)")))
 
+    def test_scan_reference(self):
+        for s in ["equal(color(previous), R)",
+                  " iff ( equal(previous,B) ,\n\tequal( current ( R ) ),False)",
+                  "and(1 0H,, J D)", "False", "  ", "not(", "a,b)c(("]:
+            self.assertEqual(list(reference_scan(s)), list(scan(s)), s)
+
+    def test_parse_reference(self):
+        for s in ["equal(color(previous), R)",
+                  "iff(is_royal(current), even(current), True)",
+                  "if(is_royal(current), False)",
+                  "if(equals(1, 2), and(odd(previous2)), not(False))",
+                  " or ( less(value(current),\n value(previous)) , True )",
+                  "False", "QH"]:
+            self.assertEqual(reference_parse(s), parse.__wrapped__(s), s)
+        # if puts its test first whatever the number of its arguments
+        p = parse("iff(even(current), odd(previous), True)")
+        self.assertEqual(Tree(even, "current"), p.test)
+        self.assertEqual(Tree(odd, "previous"), p.left)
+        self.assertEqual("True", p.right)
+
+    def test_deep_rules(self):
+        rules = ["equal(color(current), R)", "even(current)"]
+        for i in range(20000):
+            rules[0] = "not(" + rules[0] + ")"
+        for i in range(2000):
+            rules[1] = "and(" + rules[1] + ", odd(previous))"
+        for rule in rules:
+            tree = parse(rule)
+            self.assertIs(tree, parse(str(tree)))
+            compiled = tree.compile()
+            for cards in [["2C", "3C", "4D"], ["2C", "4C", "4D"],
+                          ["KH", "AS", "7C"], ["10D", "QH", "JS"]]:
+                self.assertEqual(tree.evaluate(cards), compiled(cards))
+        self.assertTrue(parse(rules[0]).evaluate(["2C", "3C", "4D"]))
+        self.assertFalse(parse(rules[1]).compile()(["2C", "4C", "4D"]))
+
     def test_parse(self):
         self.assertEqual(str(Tree(equal, Tree(color, 'previous'), 'R')),
                          str(parse("equal(color(previous), R)")))
         self.assertEqual(repr(Tree(equal, Tree(color, 'previous'), 'R')),
                          repr(parse("equal(color(previous), R)")))
 
+    def test_compile(self):
+        cards1 = ("3D", "7D", "AH")
+        cards2 = ("3D", "7S", "AC")
+        p = parse(
+            "iff(equal(color(previous), B), equal(color(current), R), True)")
+        self.assertTrue(p.compile()(cards1))
+        self.assertFalse(p.compile()(cards2))
+        self.assertEqual("QD", Tree(plus1, "JD").compile()(cards1))
+        self.assertIs(p.compile(), p.compile())
+
+    def test_compile_all_triples(self):
+        from itertools import product
+        from rule_functions import ALL_CARDS
+        rules = [
+            """and(not(equal(suit(previous), suit(current))),
+                   or(greater(value(current), value(previous)),
+                      equal(plus1(plus1(value(previous2))), value(current))))""",
+            """iff(equal(color(previous), B), is_royal(current),
+                  and(even(current), odd(previous2)))""",
+            "if(is_royal(current), False)",
+            """or(is_royal(current), equal(color(previous), R),
+                  and(odd(current), odd(previous), odd(previous2)))"""]
+        for rule in rules:
+            tree = parse(rule)
+            compiled = tree.compile()
+            for cards in product(ALL_CARDS, repeat=3):
+                self.assertEqual(tree.evaluate(cards), compiled(cards))
+
+    def test_variadic(self):
+        from itertools import product
+        from rule_functions import ALL_CARDS
+        atoms = ["even(current)", "is_royal(previous)",
+                 "equal(color(previous2), R)", "odd(previous)"]
+        for op in ["and", "or"]:
+            flat = parse(op + "(" + ", ".join(atoms) + ")")
+            nested = atoms[0]
+            for atom in atoms[1:]:
+                nested = op + "(" + nested + ", " + atom + ")"
+            nested = parse(nested)
+            self.assertEqual(4, len(flat.args))
+            self.assertIs(flat, parse(str(flat)))
+            for cards in product(ALL_CARDS[::3], repeat=3):
+                self.assertEqual(nested.evaluate(cards), flat.evaluate(cards))
+                self.assertEqual(nested.evaluate(cards),
+                                 flat.compile()(cards))
+        self.assertEqual("5", parse("and(True, 1, 5)").evaluate(ALL_CARDS[:3]))
+        self.assertRaises(Exception, parse, "equal(1, 2, 3, 4)")
+
+    def test_hash_consing(self):
+        a = parse("and(equal(color(previous), R), equal(color(current), R))")
+        b = Tree(andf, Tree(equal, Tree(color, "previous"), "R"),
+                 Tree(equal, Tree(color, "current"), "R"))
+        self.assertIs(a, b)
+        self.assertIsNot(Tree(andf, True, True), Tree(andf, "True", "True"))
+        self.assertIs(Tree(iff, True, "5H", "AS"),
+                      Tree(iff, True, "5H", "AS"))
+        with self.assertRaises(AttributeError):
+            a.left = "R"
+
+    def test_pickle(self):
+        import pickle
+        for rule in ["equal(color(previous), R)",
+                     "iff(is_royal(current), even(current), True)",
+                     "if(is_royal(current), False)"]:
+            p = parse(rule)
+            self.assertIs(p, pickle.loads(pickle.dumps(p)))
+
+    def test_parse_cache(self):
+        rule = "not(equal(suit(previous2), suit(current)))"
+        before = parse_cache_info()
+        self.assertIs(parse(rule), parse(rule))
+        after = parse_cache_info()
+        self.assertEqual(before['hits'] + 1, after['hits'])
+        self.assertEqual(before['misses'] + 1, after['misses'])
+
 
 if __name__ == '__main__':
     unittest.main()
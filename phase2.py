@@ -5,6 +5,41 @@ global game_ended
 game_ended = False
 
 
+class GameContext(object):
+    """
+    The state of one game, shared by its engine, players and scorer, so
+    that several games can run in the same process
+
+    Parameters
+    ----------
+    game_ended: bool
+        Whether the game has ended, after which players return their rule
+        instead of playing a card
+    """
+    def __init__(self, game_ended=False):
+        self.game_ended = game_ended
+
+
+class _LegacyContext(GameContext):
+    """The context of the callers which do not pass one, which reads and
+    writes the module-level game_ended flag"""
+    def __init__(self):
+        pass
+
+    @property
+    def game_ended(self):
+        return game_ended
+
+    @game_ended.setter
+    def game_ended(self, value):
+        global game_ended
+        game_ended = value
+
+
+# the context used when none is given
+legacy_context = _LegacyContext()
+
+
 class Adversary(object):
     """
     This is a random player as adversary
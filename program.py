@@ -0,0 +1,291 @@
+"""
+Compact representation of rules as flat postfix programs
+
+A Program is the postfix (children first) list of the nodes of a rule Tree,
+where every instruction either pushes a card, pushes a constant from the
+constant pool, or calls one of the new_eleusis functions on the values pushed
+by its children. Programs serialize to a few bytes per node, convert to and
+from Trees without loss, and are evaluated with a stack machine, which makes
+them cheap to send to worker processes or to store.
+"""
+import struct
+
+from new_eleusis import *
+
+# opcodes of the serialized instructions
+OP_CARD = 0
+OP_CONST = 1
+OP_CALL = 2
+
+CARD_NAMES = ['previous2', 'previous', 'current']
+
+MAGIC = b'NEP1'
+
+_header = struct.Struct('<4sHI')
+_instruction = struct.Struct('<BBH')
+
+# The largest number of constants, and of arguments of a call, which fit in
+# the 16-bit fields of a serialized Program
+MAX_FIELD = 0xFFFF
+
+# opcodes of the executable code a Program is assembled into
+_PUSH_CARD = 0
+_PUSH = 1
+_UNARY = 2
+_BINARY = 3
+_NOT = 4
+_AND = 5       # pops a value; if falsy, pushes False and jumps
+_OR = 6        # pops a value; if truthy, pushes True and jumps
+_JUMP_IF_FALSE = 7
+_JUMP = 8
+
+_unary = [suit, color, value, is_royal, minus1, plus1, even, odd]
+_binary = [equal, less, greater]
+
+
+def _const_key(c):
+    return (type(c), c)
+
+
+class Program:
+    """
+    A rule as a flat postfix program
+
+    Parameters
+    ----------
+    instructions: list
+        Tuples of (opcode, a, b): (OP_CARD, position, 0) pushes the card at
+        the given position of the cards, (OP_CONST, 0, index) pushes a
+        constant, and (OP_CALL, function index, number of arguments) calls
+        new_eleusis.functions[function index]
+    consts: list
+        The constant pool, holding the leaves of the rule other than cards
+    """
+    def __init__(self, instructions, consts):
+        self.instructions = instructions
+        self.consts = consts
+        self._code = None
+
+    @classmethod
+    def fromTree(cls, tree):
+        """Converts a Tree (or a single leaf) into a Program"""
+        instructions = []
+        consts = []
+        const_index = {}
+        # iterative post-order traversal, so that deep rules do not hit the
+        # recursion limit
+        stack = [(tree, False)]
+        while stack:
+            expr, visited = stack.pop()
+            if not isinstance(expr, Tree):
+                if isinstance(expr, str) and expr in CARD_NAMES:
+                    instructions.append(
+                        (OP_CARD, CARD_NAMES.index(expr), 0))
+                else:
+                    key = _const_key(expr)
+                    if key not in const_index:
+                        const_index[key] = len(consts)
+                        consts.append(expr)
+                    instructions.append((OP_CONST, 0, const_index[key]))
+                continue
+            children = _children(expr)
+            if visited:
+                instructions.append(
+                    (OP_CALL, functions.index(expr.root), len(children)))
+                continue
+            stack.append((expr, True))
+            for child in reversed(children):
+                stack.append((child, False))
+        return cls(instructions, consts)
+
+    def toTree(self):
+        """Converts this Program back into the Tree it was made from"""
+        stack = []
+        for op, a, b in self.instructions:
+            if op == OP_CARD:
+                stack.append(CARD_NAMES[a])
+            elif op == OP_CONST:
+                stack.append(self.consts[b])
+            else:
+                args = stack[len(stack) - b:]
+                del stack[len(stack) - b:]
+                stack.append(Tree(functions[a], *args))
+        assert len(stack) == 1, "Malformed program"
+        return stack[0]
+
+    def toBytes(self):
+        """Serializes this Program; raises ValueError if it has more than
+        MAX_FIELD constants or a call with more than MAX_FIELD arguments"""
+        if len(self.consts) > MAX_FIELD or \
+                any(b > MAX_FIELD for op, a, b in self.instructions):
+            raise ValueError("Too many constants or arguments to serialize")
+        parts = [_header.pack(MAGIC, len(self.consts),
+                              len(self.instructions))]
+        for c in self.consts:
+            parts.append(_encode_const(c))
+        for instruction in self.instructions:
+            parts.append(_instruction.pack(*instruction))
+        return b''.join(parts)
+
+    @classmethod
+    def fromBytes(cls, data):
+        """Deserializes a Program serialized with toBytes"""
+        magic, num_consts, num_instructions = _header.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized rule program")
+        offset = _header.size
+        consts = []
+        for i in range(num_consts):
+            c, offset = _decode_const(data, offset)
+            consts.append(c)
+        instructions = list(_instruction.iter_unpack(
+            data[offset:offset + num_instructions * _instruction.size]))
+        return cls(instructions, consts)
+
+    def __reduce__(self):
+        return (Program.fromBytes, (self.toBytes(),))
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def evaluate(self, cards):
+        """Evaluates this Program with the given card values, returning the
+        same result as Tree.evaluate"""
+        if self._code is None:
+            self._code = self._assemble()
+        code = self._code
+        stack = []
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op, arg = code[pc]
+            pc += 1
+            if op == _PUSH_CARD:
+                stack.append(cards[arg])
+            elif op == _PUSH:
+                stack.append(arg)
+            elif op == _UNARY:
+                stack[-1] = arg(stack[-1])
+            elif op == _BINARY:
+                b = stack.pop()
+                stack[-1] = arg(stack[-1], b)
+            elif op == _NOT:
+                stack[-1] = not stack[-1]
+            elif op == _AND:
+                if not stack.pop():
+                    stack.append(False)
+                    pc += arg
+            elif op == _OR:
+                if stack.pop():
+                    stack.append(True)
+                    pc += arg
+            elif op == _JUMP_IF_FALSE:
+                if not stack.pop():
+                    pc += arg
+            else:
+                pc += arg
+        return stack[-1]
+
+    def _assemble(self):
+        """Turns the postfix instructions into executable code, where the
+        logical operators jump over the operands they do not evaluate, like
+        Tree.evaluate does. Jumps are relative to the next instruction."""
+        stack = []
+        for op, a, b in self.instructions:
+            if op == OP_CARD:
+                stack.append([(_PUSH_CARD, a)])
+                continue
+            if op == OP_CONST:
+                c = self.consts[b]
+                if c == "True":
+                    c = True
+                elif c == "False":
+                    c = False
+                stack.append([(_PUSH, c)])
+                continue
+            f = functions[a]
+            args = stack[len(stack) - b:]
+            del stack[len(stack) - b:]
+            if b == 3 and f not in (iff, andf, orf):
+                # only if uses a test; the others take their left and right
+                # children, like Tree.evaluate
+                args = args[1:]
+            if f in _unary:
+                code = _operand(args, 0) + [(_UNARY, f)]
+            elif f in _binary:
+                code = _operand(args, 0) + _operand(args, 1) + \
+                    [(_BINARY, f)]
+            elif f == notf:
+                code = _operand(args, 0) + [(_NOT, None)]
+            elif f == andf or f == orf:
+                # every argument but the last jumps to the end of the code
+                # when it decides the result
+                jump = _AND if f == andf else _OR
+                code = _operand(args, max(b, 2) - 1)
+                for i in range(max(b, 2) - 2, -1, -1):
+                    code = _operand(args, i) + [(jump, len(code))] + code
+            elif f == iff and b == 3:
+                test, left, right = args
+                code = test + [(_JUMP_IF_FALSE, len(left) + 1)] + left + \
+                    [(_JUMP, len(right))] + right
+            elif f == iff:
+                # without a test, evaluate always takes the second branch
+                code = _operand(args, 1)
+            stack.append(code)
+        return stack[0]
+
+
+def _operand(args, i):
+    """The code of the i-th operand, or of a missing (None) operand"""
+    return args[i] if i < len(args) else [(_PUSH, None)]
+
+
+def _children(tree):
+    """The children of a Tree in evaluation order, without trailing None"""
+    children = list(tree.args)
+    while children and children[-1] is None:
+        children.pop()
+    return children
+
+
+def _encode_const(c):
+    if c is None:
+        return b'N'
+    if c is True:
+        return b'T'
+    if c is False:
+        return b'F'
+    if isinstance(c, int):
+        return b'i' + struct.pack('<q', c)
+    if isinstance(c, str):
+        data = c.encode()
+        return b's' + struct.pack('<I', len(data)) + data
+    raise ValueError("Cannot serialize the constant {!r}".format(c))
+
+
+def _decode_const(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return struct.unpack_from('<q', data, offset)[0], offset + 8
+    if tag == b's':
+        (length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        return data[offset:offset + length].decode(), offset + length
+    raise ValueError("Unknown constant tag {!r}".format(tag))
+
+
+def treeToBytes(tree):
+    """Serializes a Tree as a Program"""
+    return Program.fromTree(tree).toBytes()
+
+
+def treeFromBytes(data):
+    """Deserializes a Tree serialized with treeToBytes"""
+    return Program.fromBytes(data).toTree()
@@ -0,0 +1,79 @@
+import pickle
+import random
+import unittest
+from itertools import product
+from program import *
+from rule_functions import ALL_CARDS, getRulesForSequence, \
+    combineRulesWithOperator
+
+
+class TestProgram(unittest.TestCase):
+
+    rules = [
+        "equal(color(current), R)",
+        "if(is_royal(current), False)",
+        "and(greater(value(current), value(previous)), odd(previous2))",
+        "or(less(suit(current), suit(previous)), equal(current, AS))",
+        "equal(plus1(plus1(value(previous))), value(current))",
+        """iff(equal(suit(previous), suit(previous2)),
+               is_royal(current),
+               not(is_royal(current)))""",
+        "iff(even(current), suit(current), True)",
+        # the right operand raises whenever the left one is true
+        "or(even(current), less(value(current), 5))",
+    ]
+
+    def test_round_trip(self):
+        trees = [parse(r) for r in self.rules]
+        trees += [Tree(andf, True, True), Tree(iff, True, "5H", "AS"),
+                  Tree(plus1, "JD"), Tree(notf, None), Tree(equal, None, 1)]
+        for tree in trees:
+            program = Program.fromTree(tree)
+            self.assertIs(tree, program.toTree())
+            data = program.toBytes()
+            self.assertIs(tree, Program.fromBytes(data).toTree())
+            self.assertIs(tree, pickle.loads(pickle.dumps(program)).toTree())
+            self.assertIs(tree, pickle.loads(pickle.dumps(tree)))
+        consts = [str(i) for i in range(MAX_FIELD + 1)]
+        program = Program([(OP_CONST, 0, 0)], consts)
+        self.assertRaises(ValueError, program.toBytes)
+
+    def test_size(self):
+        rule = combineRulesWithOperator(
+            getRulesForSequence(["10H", "2C", "4S"]), "and")
+        program = Program.fromTree(parse(rule))
+        self.assertLess(len(program.toBytes()), 6 * len(program))
+
+    def test_too_large(self):
+        tree = parse("or(" + ", ".join(["even(current)"] * 70000) + ")")
+        self.assertRaises(ValueError, Program.fromTree(tree).toBytes)
+        # Trees fall back to pickling their children
+        self.assertIs(tree, pickle.loads(pickle.dumps(tree)))
+        consts = [str(i) for i in range(MAX_FIELD + 1)]
+        program = Program([(OP_CONST, 0, 0)], consts)
+        self.assertRaises(ValueError, program.toBytes)
+
+    def test_evaluate(self):
+        random.seed(0)
+        sequences = [random.sample(ALL_CARDS, 3) for i in range(500)]
+        for rule in self.rules:
+            tree = parse(rule)
+            program = Program.fromBytes(Program.fromTree(tree).toBytes())
+            for cards in sequences:
+                try:
+                    expected = tree.evaluate(cards)
+                except TypeError:
+                    with self.assertRaises(TypeError):
+                        program.evaluate(cards)
+                    continue
+                self.assertEqual(expected, program.evaluate(cards))
+
+    def test_evaluate_all_triples(self):
+        tree = parse(self.rules[5])
+        program = Program.fromTree(tree)
+        for cards in product(ALL_CARDS, repeat=3):
+            self.assertEqual(tree.evaluate(cards), program.evaluate(cards))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,18 @@
 """
 This file contains helper functions for rules
 """
+import os
 import random
+import numpy as np
+from functools import lru_cache
+from sys import intern
 from new_eleusis import *
 from itertools import combinations, product
+from cards import ALL_CARDS, CARD_INDEX, NUM_CARDS
+from truth_table import acceptanceMask
 
-ALL_CARDS = []
-for deck in ["D", "H", "S", "C"]:
-    for num in ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10",
-                "J", "Q", "K"]:
-        ALL_CARDS.append(num + deck)
+# Maximum number of sequences of three cards whose rules are kept in memory
+SEQUENCE_CACHE_SIZE = 16384
 
 
 def generate_random_card():
@@ -51,8 +54,11 @@ def negate_rule(rule):
 
 def getAllValidSequences(rule):
     """
-    Loops over all possible lists of three cards and returns the list of three
-    cards that are accepted by the given rule.
+    Evaluates the given rule on all possible lists of three cards at once and
+    returns the list of three cards that are accepted by it.
+
+    This builds a string for every accepted list of cards: to test or count
+    the accepted lists, use truth_table.acceptanceMask or a TruthTable.
 
     Parameters
     ----------
@@ -64,17 +70,103 @@ def getAllValidSequences(rule):
     goodList: list
         List of three-cards that are accepted by the rule
     """
+    n = len(ALL_CARDS)
     goodList = []
-    for card1, card2, card3 in product(ALL_CARDS, repeat=3):
-        good = rule.evaluate([card1, card2, card3])
-        if isinstance(good, str):
-            if good == "True":
-                goodList.append(card1 + card2 + card3)
-        elif good:
-            goodList.append(card1 + card2 + card3)
+    for i in np.flatnonzero(acceptanceMask(rule)).tolist():
+        goodList.append(
+            ALL_CARDS[i // (n * n)] + ALL_CARDS[i // n % n] + ALL_CARDS[i % n])
     return goodList
 
 
+class SequenceTable:
+    """
+    The rules returned by getRulesForSequence for every one of the 52 ** 3
+    sequences of three cards, stored compactly as indices into a list of
+    distinct rules
+
+    Parameters
+    ----------
+    atoms: list
+        The distinct rule strings
+    offsets: numpy.ndarray
+        The rules of the sequence at index i (see truth_table.acceptanceMask)
+        are atoms[ids[offsets[i]:offsets[i + 1]]]
+    ids: numpy.ndarray
+        Indices into atoms
+    """
+    def __init__(self, atoms, offsets, ids):
+        self.atoms = [intern(a) for a in atoms]
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def build(cls):
+        """Computes the rules for all sequences of three cards"""
+        atom_ids = {}
+        offsets = [0]
+        ids = []
+        for cards in product(ALL_CARDS, repeat=3):
+            for r in _computeRulesForSequence(cards):
+                ids.append(atom_ids.setdefault(r, len(atom_ids)))
+            offsets.append(len(ids))
+        return cls(list(atom_ids), np.array(offsets, dtype=np.int64),
+                   np.array(ids, dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a table saved with save"""
+        with np.load(path) as data:
+            atoms = data['atoms'].tobytes().decode().split('\n')
+            return cls(atoms, data['offsets'], data['ids'])
+
+    def save(self, path):
+        """Saves the table to a .npz file"""
+        atoms = np.frombuffer('\n'.join(self.atoms).encode(), dtype=np.uint8)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, atoms=atoms, offsets=self.offsets,
+                                ids=self.ids)
+
+    def rules(self, cards):
+        """Returns the rules for a sequence of three cards, as a tuple"""
+        a, b, c = [CARD_INDEX[card] for card in cards]
+        i = (a * NUM_CARDS + b) * NUM_CARDS + c
+        atoms = self.atoms
+        return tuple(atoms[j] for j in
+                     self.ids[self.offsets[i]:self.offsets[i + 1]].tolist())
+
+
+_sequence_table = None
+_sequence_table_path = None
+
+
+def useSequenceTable(path):
+    """
+    Makes getRulesForSequence look up the rules of sequences in the table
+    saved at path (see buildSequenceTable), which is loaded the first time
+    it is needed. The rules are computed as usual while the file does not
+    exist. Passing None stops using the table.
+    """
+    global _sequence_table, _sequence_table_path
+    _sequence_table = None
+    _sequence_table_path = path
+    _rulesForSequence.cache_clear()
+
+
+def buildSequenceTable(path):
+    """Computes the rules for all sequences of three cards and saves them to
+    path, to be used with useSequenceTable"""
+    SequenceTable.build().save(path)
+    useSequenceTable(path)
+
+
+def _sequenceTable():
+    global _sequence_table
+    if _sequence_table is None and _sequence_table_path is not None \
+            and os.path.exists(_sequence_table_path):
+        _sequence_table = SequenceTable.load(_sequence_table_path)
+    return _sequence_table
+
+
 def getRulesForSequence(cards):
     """
     Takes in a sequence of three cards and returns all possible rules for that
@@ -92,7 +184,18 @@ def getRulesForSequence(cards):
         A list of rule strings that accept the given sequence of three cards
     """
     assert len(cards) == 3, 'Three cards should be provided'
+    return list(_rulesForSequence(tuple(cards)))
+
+
+@lru_cache(maxsize=SEQUENCE_CACHE_SIZE)
+def _rulesForSequence(cards):
+    table = _sequenceTable()
+    if table is not None and all(c in CARD_INDEX for c in cards):
+        return table.rules(cards)
+    return _computeRulesForSequence(cards)
+
 
+def _computeRulesForSequence(cards):
     cur = cards[-1]
     prev = cards[-2]
     prev2 = cards[-3]
@@ -118,7 +221,7 @@ def getRulesForSequence(cards):
 
     all_rules = all_one_card_rules + all_two_card_rules + all_three_card_rules
 
-    return all_rules
+    return tuple(all_rules)
 
 
 def getRulesForThreeCards(cards):
@@ -138,7 +241,11 @@ def getRulesForThreeCards(cards):
         given three cards
     """
     assert len(cards) == 3, 'Three cards should be provided'
+    return list(_rulesForThreeCards(tuple(cards)))
 
+
+@lru_cache(maxsize=SEQUENCE_CACHE_SIZE)
+def _rulesForThreeCards(cards):
     cur = cards[-1]
     prev = cards[-2]
     prev2 = cards[-3]
@@ -181,8 +288,9 @@ def getRulesForThreeCards(cards):
 
             # append the rule that matched
             if use:
-                three_rules.append("and(" + r_prev + ", " + r_cur + ")")
-    return three_rules
+                three_rules.append(
+                    intern("and(" + r_prev + ", " + r_cur + ")"))
+    return tuple(three_rules)
 
 
 def getRulesForOneCard(card, cur_name="current"):
@@ -201,16 +309,21 @@ def getRulesForOneCard(card, cur_name="current"):
     list_of_rules: list
         A list of strings that describe the rules that accept the given card
     """
+    return list(_rulesForOneCard(card, cur_name))
+
+
+@lru_cache(maxsize=None)
+def _rulesForOneCard(card, cur_name):
     possible_values = {"suit": suit, "color": color, "is_royal": is_royal,
                        "even": even, "value": value}
 
     list_of_rules = []
     for name, func in possible_values.items():
         card_value = func(card)
-        list_of_rules.append(
-            "equal(" + name + "(" + cur_name + "), " + str(card_value) + ")")
+        list_of_rules.append(intern(
+            "equal(" + name + "(" + cur_name + "), " + str(card_value) + ")"))
 
-    return list_of_rules
+    return tuple(list_of_rules)
 
 
 def getRulesForTwoCards(cards, cur_name="current", prev_name="previous"):
@@ -233,6 +346,11 @@ def getRulesForTwoCards(cards, cur_name="current", prev_name="previous"):
         cards
     """
     assert len(cards) == 2, 'Only two cards should be provided'
+    return list(_rulesForTwoCards(tuple(cards), cur_name, prev_name))
+
+
+@lru_cache(maxsize=None)
+def _rulesForTwoCards(cards, cur_name, prev_name):
 
     cur = cards[-1]
     prev = cards[-2]
@@ -289,13 +407,14 @@ def getRulesForTwoCards(cards, cur_name="current", prev_name="previous"):
         if rp.replace(prev_name, '') != rc.replace(cur_name, ''):
             all_pair_rules.append("and(" + rp + ", " + rc + ")")
 
-    return all_pair_rules
+    return tuple(intern(r) for r in all_pair_rules)
 
 
 def combineRulesWithOperator(listOfRules, operator):
     """
     Takes a list of rules and makes an overall rule that ties them together
-    with the AND or the OR operator
+    with the AND or the OR operator, as a single call of the operator with all
+    the rules as its arguments
 
     Parameters
     ----------
@@ -317,10 +436,7 @@ def combineRulesWithOperator(listOfRules, operator):
         return listOfRules[0]
 
     operator = operator.lower()
-    total = listOfRules[0]
-    for i in range(1, len(listOfRules)):
-        total = operator + "(" + total + ", " + listOfRules[i] + ")"
-    return total
+    return operator + "(" + ", ".join(listOfRules) + ")"
 
 
 def combineListOfRules(ruleList):
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+import rule_functions
+from rule_functions import *
+
+
+class TestRuleFunctions(unittest.TestCase):
+
+    def test_rules_are_memoized(self):
+        cards = ["10H", "2C", "4S"]
+        first = getRulesForSequence(cards)
+        second = getRulesForSequence(cards)
+        self.assertEqual(first, second)
+        # every call returns a new list, which the Player is free to change,
+        # of the same shared strings
+        self.assertIsNot(first, second)
+        for a, b in zip(first, second):
+            self.assertIs(a, b)
+        self.assertIn("equal(suit(current), H)", getRulesForOneCard("10H"))
+        self.assertIn("greater(value(current), value(previous))",
+                      getRulesForTwoCards(["2C", "4S"]))
+
+    def test_all_valid_sequences(self):
+        sequences = getAllValidSequences(parse("equal(current, AS)"))
+        self.assertEqual(52 * 52, len(sequences))
+        self.assertEqual("ADADAS", sequences[0])
+        self.assertTrue(all(s.endswith("AS") for s in sequences))
+
+    def test_sequence_table(self):
+        atoms = ["equal(color(current), R)", "equal(even(current), True)"]
+        n = len(ALL_CARDS) ** 3
+        offsets = np.arange(n + 1, dtype=np.int64)
+        ids = np.arange(n, dtype=np.int32) % 2
+        path = os.path.join(tempfile.mkdtemp(), 'sequences.npz')
+        SequenceTable(atoms, offsets, ids).save(path)
+        try:
+            useSequenceTable(path)
+            self.assertIsNone(rule_functions._sequence_table)
+            self.assertEqual([atoms[0]], getRulesForSequence(ALL_CARDS[:3]))
+            self.assertEqual([atoms[1]], getRulesForSequence(ALL_CARDS[1:4]))
+        finally:
+            useSequenceTable(None)
+        self.assertIn("equal(suit(current), D)",
+                      getRulesForSequence(ALL_CARDS[:3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
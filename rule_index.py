@@ -0,0 +1,463 @@
+"""
+A persistent index of the truth tables of rules, which maps every rule it
+knows to its truth table and every truth table to the shortest known rule
+having it (its canonical rule)
+
+The index is a single append-only file of records, read through a memory
+map, so that the truth tables are never recomputed and many processes can
+open the same file read-only while one of them adds rules to it:
+
+    >>> index = RuleIndex('rules.idx')
+    >>> fingerprint = index.add('not(equal(color(current), B))')
+    >>> fingerprint = index.add('equal(color(current), R)')
+    >>> index.canonicalRule('not(equal(color(current), B))')
+    'equal(color(current), R)'
+
+Once passed to truth_table.useRuleIndex, ruleTruthTable looks the rules up
+in the index and adds the ones it computes, so that the Player and the
+Scorer reuse the truth tables of earlier games.
+
+The file starts with MAGIC, then every record is laid out as
+
+    kind: 1 byte, b'T' for a new truth table or b'A' for another rule of a
+          truth table already recorded
+    fingerprint: 16 bytes, the digest of the truth table
+    length: 4 bytes, the length of the rule, little-endian
+    rule: the rule string, encoded in UTF-8
+    bits: the 17,576 bytes of the truth table, in b'T' records only
+
+So that opening a large index does not read all of it, the records are also
+indexed by a sidecar file, the path of the index followed by KEYS_SUFFIX,
+with sorted tables of keys that are searched through a memory map:
+
+    KEYS_MAGIC
+    header: the offset in the index up to which the records are indexed, the
+            number of truth tables and the number of rules, 8 bytes each
+    truth tables: for each, its fingerprint (16 bytes), the offset of its
+                  bits (8 bytes) and the offset and length of the rule
+                  record of its canonical rule (8 and 4 bytes), sorted by
+                  fingerprint
+    rules: for each, the digest of the rule (16 bytes), the fingerprint of
+           its truth table (16 bytes) and the offset and length of the rule
+           string (8 and 4 bytes), sorted by digest
+
+Only the records appended after the indexed offset are read when opening
+the index. A writer rewrites the sidecar every KEYS_INTERVAL records it
+appends and when it is closed.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+import numpy as np
+
+from new_eleusis import parse
+from truth_table import NUM_SEQUENCES, TruthTable
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where there is a single writer
+    fcntl = None
+
+MAGIC = b'ELEUSIS RULE INDEX 1\n'
+KEYS_MAGIC = b'ELEUSIS RULE KEYS 1\n'
+KEYS_SUFFIX = '.keys'
+# the number of records a writer appends before rewriting the sidecar
+KEYS_INTERVAL = 1024
+
+_header = struct.Struct('<c16sI')
+_TABLE_SIZE = NUM_SEQUENCES // 8
+_keysHeader = struct.Struct('<QQQ')
+_tableKey = struct.Struct('<16sQQI')
+_ruleKey = struct.Struct('<16s16sQI')
+
+
+def _shorter(a, b):
+    """Tells whether rule a comes before rule b as a canonical rule"""
+    return (len(a), a) < (len(b), b)
+
+
+def _ruleDigest(encoded):
+    """The key of a rule string in the sidecar"""
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+def _search(data, start, count, key_size, key):
+    """Returns the index of the first of count sorted keys of data, each
+    key_size bytes from start, whose first 16 bytes are not less than key"""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        offset = start + middle * key_size
+        if data[offset:offset + 16] < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class RuleIndex:
+    """
+    A persistent index from rules to truth tables and back
+
+    Parameters
+    ----------
+    path: str
+        The file of the index, created if it does not exist and the index is
+        not read-only
+    readonly: bool
+        Whether to only look rules up; any number of processes can read the
+        index while another one writes to it
+    """
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if not readonly and not os.path.exists(path):
+            with open(path, 'xb') as f:
+                f.write(MAGIC)
+        self._file = open(path, 'rb' if readonly else 'r+b')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError("Not a rule index: " + path)
+        self._map = None
+        self._scanned = len(MAGIC)
+        # the sidecar: its memory map, the stat of its file, the offset up to
+        # which it indexes the records, and its numbers of truth tables and
+        # rules
+        self._keys = None
+        self._keys_stat = None
+        self._covered = len(MAGIC)
+        self._num_tables = 0
+        self._num_rules = 0
+        # of the records after the ones in the sidecar:
+        # fingerprint digest -> offset of the bits of its truth table
+        self._tables = {}
+        # fingerprint digest -> canonical rule and the offset of its string
+        self._canonical = {}
+        # rule -> fingerprint digest and the offset of the rule string
+        self._rules = {}
+        self.refresh()
+
+    def refresh(self):
+        """Reads the records added since the index was opened or last
+        refreshed, e.g. by another process"""
+        self._loadKeys()
+        size = os.fstat(self._file.fileno()).st_size
+        if size > len(MAGIC) and (self._map is None or len(self._map) < size):
+            # the views of the tables returned so far keep the previous map
+            # alive
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        if size <= self._scanned:
+            return
+        data = self._map
+        offset = self._scanned
+        while offset + _header.size <= size:
+            kind, digest, length = _header.unpack_from(data, offset)
+            start = offset + _header.size
+            end = start + length + (_TABLE_SIZE if kind == b'T' else 0)
+            if end > size:
+                # a record being written by another process
+                break
+            rule = data[start:start + length].decode()
+            if kind == b'T':
+                self._tables[digest] = start + length
+            self._rules[rule] = digest, start
+            canonical = self._canonical.get(digest)
+            if canonical is None or _shorter(rule, canonical[0]):
+                self._canonical[digest] = rule, start
+            offset = end
+        self._scanned = offset
+
+    def _loadKeys(self):
+        """Maps the sidecar if it indexes more records than the one mapped so
+        far, e.g. after another process rewrote it"""
+        try:
+            stat = os.stat(self.path + KEYS_SUFFIX)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._keys_stat:
+            return
+        self._keys_stat = stat.st_ino, stat.st_mtime_ns, stat.st_size
+        start = len(KEYS_MAGIC) + _keysHeader.size
+        if stat.st_size < start:
+            return
+        with open(self.path + KEYS_SUFFIX, 'rb') as f:
+            keys = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if keys[:len(KEYS_MAGIC)] != KEYS_MAGIC:
+            return
+        covered, num_tables, num_rules = _keysHeader.unpack_from(
+            keys, len(KEYS_MAGIC))
+        if covered <= self._covered or \
+                covered > os.fstat(self._file.fileno()).st_size:
+            return
+        self._keys = keys
+        self._covered = covered
+        self._num_tables = num_tables
+        self._num_rules = num_rules
+        # the records up to covered are in the sidecar now
+        self._scanned = covered
+        self._tables = {}
+        self._canonical = {}
+        self._rules = {}
+
+    def _lookupTable(self, digest):
+        """Returns the offset of the bits of a truth table and its canonical
+        rule, or None if the index does not have it"""
+        offset = self._tables.get(digest)
+        canonical = self._canonical.get(digest)
+        rule = None if canonical is None else canonical[0]
+        start = len(KEYS_MAGIC) + _keysHeader.size
+        i = _search(self._keys, start, self._num_tables, _tableKey.size,
+                    digest)
+        if i < self._num_tables:
+            key, bits, rule_start, length = _tableKey.unpack_from(
+                self._keys, start + i * _tableKey.size)
+            if key == digest:
+                offset = bits
+                indexed = self._map[rule_start:rule_start + length].decode()
+                if rule is None or _shorter(indexed, rule):
+                    rule = indexed
+        return None if offset is None else (offset, rule)
+
+    def _lookupRule(self, rule):
+        """Returns the fingerprint digest of a rule string, or None if the
+        index does not have the rule"""
+        known = self._rules.get(rule)
+        if known is not None:
+            return known[0]
+        if self._keys is None:
+            return None
+        encoded = rule.encode()
+        key = _ruleDigest(encoded)
+        start = len(KEYS_MAGIC) + _keysHeader.size + \
+            self._num_tables * _tableKey.size
+        i = _search(self._keys, start, self._num_rules, _ruleKey.size, key)
+        while i < self._num_rules:
+            other, digest, rule_start, length = _ruleKey.unpack_from(
+                self._keys, start + i * _ruleKey.size)
+            if other != key:
+                break
+            if self._map[rule_start:rule_start + length] == encoded:
+                return digest
+            i += 1
+        return None
+
+    def __len__(self):
+        """Returns the number of distinct truth tables"""
+        return self._num_tables + len(self._tables)
+
+    def __contains__(self, rule):
+        return self._lookupRule(rule) is not None
+
+    def fingerprint(self, rule):
+        """Returns the fingerprint of the truth table of a rule string, or
+        None if the rule is not in the index"""
+        digest = self._lookupRule(rule)
+        return None if digest is None else digest.hex()
+
+    def table(self, fingerprint):
+        """
+        Returns a truth table from the index
+
+        Parameters
+        ----------
+        fingerprint: str
+            The fingerprint of the truth table
+
+        Returns
+        -------
+        table: TruthTable
+            The truth table, a read-only view of the file, or None if the
+            index does not have it
+        """
+        key = self._lookupTable(bytes.fromhex(fingerprint))
+        if key is None:
+            return None
+        offset = key[0]
+        if offset + _TABLE_SIZE > len(self._map):
+            self.refresh()
+        bits = np.frombuffer(self._map, dtype=np.uint8, count=_TABLE_SIZE,
+                             offset=offset)
+        table = TruthTable(bits)
+        table._fingerprint = fingerprint
+        return table
+
+    def canonical(self, fingerprint):
+        """Returns the shortest rule of the index having the truth table of
+        the given fingerprint, or None"""
+        key = self._lookupTable(bytes.fromhex(fingerprint))
+        return None if key is None else key[1]
+
+    def ruleTable(self, rule):
+        """Returns the truth table of a rule string, from the index if it has
+        the rule and computed otherwise"""
+        fingerprint = self.fingerprint(rule)
+        if fingerprint is not None:
+            return self.table(fingerprint)
+        return TruthTable.fromRule(parse(rule))
+
+    def canonicalRule(self, rule):
+        """
+        Returns the canonical rule equivalent to a rule, adding the rule to
+        the index first unless it is read-only
+
+        Parameters
+        ----------
+        rule: str
+            String representation of a rule
+
+        Returns
+        -------
+        canonical: str
+            The shortest rule of the index with the same truth table, or rule
+            itself if there is none
+        """
+        if not self.readonly:
+            fingerprint = self.add(rule)
+        else:
+            fingerprint = self.ruleTable(rule).fingerprint()
+        canonical = self.canonical(fingerprint)
+        return rule if canonical is None or _shorter(rule, canonical) \
+            else canonical
+
+    def add(self, rule, table=None):
+        """
+        Adds a rule to the index, unless it is already there
+
+        Parameters
+        ----------
+        rule: str
+            String representation of a rule
+        table: TruthTable
+            Its truth table, computed when not given
+
+        Returns
+        -------
+        fingerprint: str
+            The fingerprint of the truth table of the rule
+        """
+        if self.readonly:
+            raise ValueError("The rule index is read-only")
+        fingerprint = self.fingerprint(rule)
+        if fingerprint is not None:
+            return fingerprint
+        if table is None:
+            table = TruthTable.fromRule(parse(rule))
+        fingerprint = table.fingerprint()
+        digest = bytes.fromhex(fingerprint)
+        encoded = rule.encode()
+
+        with self._lock():
+            # another process may have added the truth table meanwhile
+            self.refresh()
+            kind = b'A' if self._lookupTable(digest) is not None else b'T'
+            record = _header.pack(kind, digest, len(encoded)) + encoded
+            if kind == b'T':
+                record += table.bits.tobytes()
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(record)
+            self._file.flush()
+            self.refresh()
+            if len(self._rules) >= KEYS_INTERVAL:
+                self._writeKeys()
+        return fingerprint
+
+    @contextmanager
+    def _lock(self):
+        """Keeps the other writers from appending to the index"""
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _writeKeys(self):
+        """Rewrites the sidecar to index all the records read so far, with
+        the lock held"""
+        start = len(KEYS_MAGIC) + _keysHeader.size
+        # fingerprint digest -> offset of its bits, and offset and length of
+        # the string of its canonical rule
+        tables = {}
+        for i in range(self._num_tables):
+            digest, *key = _tableKey.unpack_from(
+                self._keys, start + i * _tableKey.size)
+            tables[digest] = key
+        for digest, offset in self._tables.items():
+            tables[digest] = [offset, None, None]
+        for digest, (rule, rule_start) in self._canonical.items():
+            key = tables[digest]
+            if key[1] is None or _shorter(
+                    rule, self._map[key[1]:key[1] + key[2]].decode()):
+                key[1:] = rule_start, len(rule.encode())
+
+        rules = []
+        rules_start = start + self._num_tables * _tableKey.size
+        for i in range(self._num_rules):
+            offset = rules_start + i * _ruleKey.size
+            rules.append(self._keys[offset:offset + _ruleKey.size])
+        for rule, (digest, rule_start) in self._rules.items():
+            encoded = rule.encode()
+            rules.append(_ruleKey.pack(_ruleDigest(encoded), digest,
+                                       rule_start, len(encoded)))
+
+        path = self.path + KEYS_SUFFIX
+        with open(path + '.tmp', 'wb') as f:
+            f.write(KEYS_MAGIC)
+            f.write(_keysHeader.pack(self._scanned, len(tables), len(rules)))
+            for digest in sorted(tables):
+                f.write(_tableKey.pack(digest, *tables[digest]))
+            f.write(b''.join(sorted(rules)))
+        os.replace(path + '.tmp', path)
+        self.refresh()
+
+    def addCorpus(self, records):
+        """Adds the rules of a corpus written by explorer.py, as loaded by
+        explorer.loadCorpus"""
+        for record in records:
+            self.add(record['rule'])
+
+    def close(self):
+        if not self.readonly and self._rules:
+            with self._lock():
+                self.refresh()
+                self._writeKeys()
+        self._file.close()
+        self._map = None
+        self._keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Adds rules to a rule index and prints their canonical "
+                    "rules")
+    parser.add_argument('index', help='the file of the index')
+    parser.add_argument('rules', nargs='*', help='rules to add')
+    parser.add_argument('--corpus',
+                        help='a JSONL corpus of rules written by explorer.py')
+    args = parser.parse_intermixed_args()
+
+    with RuleIndex(args.index) as index:
+        if args.corpus:
+            with open(args.corpus) as f:
+                index.addCorpus(json.loads(line) for line in f
+                                if line.strip())
+        for rule in args.rules:
+            print(index.canonicalRule(rule))
+        print('{} truth tables'.format(len(index)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import Game
+import phase2
+import rule_index
+import truth_table
+from rule_index import KEYS_SUFFIX, RuleIndex
+from truth_table import TruthTable, canonicalRule, ruleTruthTable, \
+    useRuleIndex
+from new_eleusis import parse
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rules.idx')
+
+    def test_index(self):
+        red = "equal(color(current), R)"
+        not_black = "not(equal(color(current), B))"
+        with RuleIndex(self.path) as index:
+            fingerprint = index.add(not_black)
+            self.assertEqual(fingerprint, index.add(red))
+            self.assertEqual(1, len(index))
+            self.assertIn(not_black, index)
+            self.assertEqual(red, index.canonical(fingerprint))
+            self.assertEqual(red, index.canonicalRule(not_black))
+            self.assertEqual(TruthTable.fromRule(parse(red)),
+                             index.table(fingerprint))
+            self.assertIsNone(index.fingerprint("odd(current)"))
+
+            reader = RuleIndex(self.path, readonly=True)
+            self.assertEqual(red, reader.canonical(fingerprint))
+            index.add("odd(current)")
+            self.assertIsNone(reader.fingerprint("odd(current)"))
+            reader.refresh()
+            self.assertEqual(2, len(reader))
+            self.assertEqual(ruleTruthTable("odd(current)"),
+                             reader.ruleTable("odd(current)"))
+            self.assertEqual("odd(current)",
+                             reader.canonicalRule("not(even(current))"))
+            self.assertRaises(ValueError, reader.add, "even(current)")
+            reader.close()
+
+        with open(self.path, 'ab') as f:
+            f.write(b'T' + bytes(20))  # a record being written
+        with RuleIndex(self.path, readonly=True) as index:
+            self.assertEqual(2, len(index))
+            self.assertEqual(red, index.canonicalRule(red))
+
+    def test_keys(self):
+        red = "equal(color(current), R)"
+        not_black = "not(equal(color(current), B))"
+        with RuleIndex(self.path) as index:
+            fingerprint = index.add(not_black)
+            index.add("odd(current)")
+        self.assertTrue(os.path.exists(self.path + KEYS_SUFFIX))
+
+        with RuleIndex(self.path) as index:
+            # nothing to read but the sidecar
+            self.assertEqual({}, index._rules)
+            self.assertEqual(2, len(index))
+            self.assertIn(not_black, index)
+            self.assertNotIn(red, index)
+            self.assertEqual(fingerprint, index.fingerprint(not_black))
+            self.assertEqual(not_black, index.canonical(fingerprint))
+            self.assertEqual(ruleTruthTable(red), index.table(fingerprint))
+            # a shorter rule of a truth table in the sidecar
+            self.assertEqual(fingerprint, index.add(red))
+            self.assertEqual(red, index.canonical(fingerprint))
+            self.assertEqual(2, len(index))
+
+        reader = RuleIndex(self.path, readonly=True)
+        self.addCleanup(reader.close)
+        self.assertEqual({}, reader._rules)
+        self.assertEqual(red, reader.canonical(fingerprint))
+        self.assertEqual(fingerprint, reader.fingerprint(red))
+        with mock.patch.object(rule_index, 'KEYS_INTERVAL', 2), \
+                RuleIndex(self.path) as index:
+            index.add("even(current)")
+            self.assertEqual(1, len(index._rules))
+            index.add("False")
+            # the sidecar was rewritten
+            self.assertEqual({}, index._rules)
+            self.assertEqual(4, len(index))
+        reader.refresh()
+        self.assertEqual({}, reader._rules)
+        self.assertEqual(4, len(reader))
+        self.assertIn("even(current)", reader)
+        self.assertEqual(ruleTruthTable("False"),
+                         reader.ruleTable("False"))
+
+        # a sidecar that indexes fewer records is still used
+        with open(self.path + KEYS_SUFFIX, 'rb') as f:
+            keys = f.read()
+        with RuleIndex(self.path) as index:
+            index.add("True")
+        with open(self.path + KEYS_SUFFIX, 'wb') as f:
+            f.write(keys)
+        with RuleIndex(self.path, readonly=True) as index:
+            self.assertEqual(["True"], list(index._rules))
+            self.assertEqual(5, len(index))
+            self.assertIn(not_black, index)
+        os.remove(self.path + KEYS_SUFFIX)
+        with RuleIndex(self.path, readonly=True) as index:
+            self.assertEqual(6, len(index._rules))
+            self.assertEqual(red, index.canonicalRule(not_black))
+
+    def test_use_rule_index(self):
+        with RuleIndex(self.path) as index:
+            index.add("odd(current)")
+            useRuleIndex(index)
+            try:
+                self.assertEqual("odd(current)",
+                                 canonicalRule("not(even(current))"))
+                index.add("False")
+                self.assertEqual("and(odd(current), even(current))",
+                                 canonicalRule(
+                                     "and(odd(current), even(current))"))
+                self.assertIn("not(even(current))", index)
+                scorer = Game.Scorer("even(current)",
+                                     context=phase2.GameContext())
+                player = Game.FinishedPlayer(
+                    [("2H", []), ("4S", []), ("6D", ["3C"])],
+                    "not(odd(current))")
+                self.assertEqual(2 - 100, scorer.score(player, True))
+                self.assertIn("even(current)", index)
+                self.assertIn("not(odd(current))", index)
+            finally:
+                useRuleIndex(None)
+        self.assertIsNone(truth_table._rule_index)
+        self.assertEqual("not(even(current))",
+                         canonicalRule("not(even(current))"))
+
+
+if __name__ == '__main__':
+    unittest.main()
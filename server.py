@@ -0,0 +1,738 @@
+"""
+A dealer server hosting many games of New Eleusis at once for player agents
+which connect over TCP or Unix sockets
+
+Agents keep one connection open for all the games they take part in, and
+talk to the server with one JSON object per line. An agent starts with
+
+    {"type": "hello", "name": "..."}
+
+and is then sent, for every game it plays in (all messages of a game carry
+its "game" number):
+
+    {"type": "start", "seat": i, "players": n, "cards": [c1, c2, c3]}
+    {"type": "play", "id": k}       answered with {"id": k, "move": card}
+                                    or with {"id": k, "move": rule} to end
+                                    the game
+    {"type": "result", "seat": i, "card": c, "accepted": true or false}
+    {"type": "end", "ended_by": i or null, "rule": rule or null}
+    {"type": "guess", "id": k}      answered with {"id": k, "move": rule}
+    {"type": "score", "score": s or null}
+
+A move which is not answered within the move timeout is skipped. The cards
+of all the games are judged together by a DealerBatcher, once per turn of
+the event loop. Game.Player and phase2.Adversary can play as agents, either
+in-process (LocalAgent) or over a socket (runAgent), so that the server can
+be load-tested on one machine:
+
+    $ python server.py loadtest --games 1000 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import phase2
+import Game
+from cards import CARD_INDEX
+from rule_functions import *
+from simulate import dealCards
+from truth_table import TruthTable, sequenceIndex
+
+# Number of cards judged with a rule after which the truth table of the rule
+# is built, so that its cards are looked up instead of evaluated
+TABLE_THRESHOLD = 256
+
+# Maximum number of truth tables kept by a DealerBatcher
+TABLE_CACHE_SIZE = 1024
+
+# The in-process players which can act as agents, by the name of their kind;
+# each one is made from the three cards starting a game and its GameContext
+AGENT_KINDS = {
+    'player': lambda cards, context: Game.Player(list(cards),
+                                                 context=context),
+    'information': lambda cards, context: Game.Player(
+        list(cards), context=context, strategy='information'),
+    'adversary': lambda cards, context: phase2.Adversary(),
+}
+
+
+class DealerBatcher:
+    """
+    Judges the cards played in all the games of a server together. The
+    requests made during one turn of the event loop are grouped by rule;
+    the rules which judged many cards get a truth table, in which a whole
+    group is looked up at once, and the other groups are evaluated with the
+    compiled rule.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.scheduled = False
+        self.counts = {}
+        self.tables = {}
+        self.batches = 0
+        self.evaluations = 0
+
+    def accepts(self, rule, cards):
+        """
+        Judges a card
+
+        Parameters
+        ----------
+        rule: Tree
+            The rule of the dealer
+        cards: list
+            The last two accepted cards and the card played
+
+        Returns
+        -------
+        accepted: asyncio.Future
+            Resolves to whether the rule accepts the card
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(rule, []).append((list(cards), future))
+        if not self.scheduled:
+            self.scheduled = True
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        """Judges all the pending cards"""
+        pending, self.pending = self.pending, {}
+        self.scheduled = False
+        self.batches += 1
+        for rule, requests in pending.items():
+            self.evaluations += len(requests)
+            table = self.table(rule, len(requests))
+            if table is not None:
+                try:
+                    accepted = table.lookup(
+                        [sequenceIndex(cards) for cards, future in requests])
+                except Exception as e:
+                    # this runs in a callback of the event loop, where an
+                    # exception would leave the futures pending forever
+                    for cards, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (cards, future), a in zip(requests, accepted.tolist()):
+                    if not future.done():
+                        future.set_result(a)
+                continue
+            evaluate = rule.compile()
+            for cards, future in requests:
+                if future.done():
+                    continue
+                try:
+                    future.set_result(bool(evaluate(cards)))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def table(self, rule, count):
+        """Returns the truth table of a rule once it judged enough cards, or
+        None; rules which raise on some cards never get one"""
+        if rule in self.tables:
+            return self.tables[rule]
+        self.counts[rule] = self.counts.get(rule, 0) + count
+        if self.counts[rule] < TABLE_THRESHOLD:
+            return None
+        del self.counts[rule]
+        if len(self.tables) >= TABLE_CACHE_SIZE:
+            del self.tables[next(iter(self.tables))]
+        try:
+            table = TruthTable.fromRule(rule, truthiness=True)
+        except Exception:
+            table = None
+        self.tables[rule] = table
+        return table
+
+
+class AgentHandler:
+    """
+    Plays the games of an agent with in-process players
+
+    Parameters
+    ----------
+    factory: callable
+        Makes the player of a game, called with the three starting cards
+        and the GameContext of the game (see AGENT_KINDS)
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.games = {}
+
+    def reply(self, message):
+        """Handles a message like handle, but answers with no move when the
+        player fails, like an agent which does not answer"""
+        try:
+            return self.handle(message)
+        except Exception:
+            return None
+
+    def handle(self, message):
+        """Handles a message of the server, returning the move to answer
+        with, or None"""
+        kind = message['type']
+        game = message.get('game')
+        if kind == 'start':
+            context = phase2.GameContext()
+            self.games[game] = (self.factory(message['cards'], context),
+                                context)
+            return None
+        if game not in self.games:
+            return None
+        player, context = self.games[game]
+        if kind == 'play':
+            return player.play()
+        if kind == 'result':
+            update = getattr(player, 'update_card_to_boardstate', None)
+            if update is not None:
+                update(message['card'], message['accepted'])
+        elif kind == 'end':
+            context.game_ended = True
+        elif kind == 'guess':
+            context.game_ended = True
+            return player.play()
+        elif kind == 'score':
+            self.games.pop(game, None)
+        return None
+
+
+class LocalAgent:
+    """
+    An agent playing in the same process as the server
+
+    Parameters
+    ----------
+    name: str
+        The name of the agent
+    factory: callable
+        See AgentHandler
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.handler = AgentHandler(factory)
+
+    def send(self, message):
+        self.handler.reply(message)
+
+    async def request(self, message):
+        return self.handler.reply(message)
+
+
+class AgentConnection:
+    """
+    The connection of an agent to the server, over which the requests of
+    all its games are multiplexed
+
+    Parameters
+    ----------
+    name: str
+        The name of the agent
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    """
+
+    def __init__(self, name, reader, writer):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.next_id = 0
+        self.closed = False
+
+    def send(self, message):
+        """Sends a message which needs no answer"""
+        if not self.closed:
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+    async def request(self, message):
+        """Sends a message and returns the move the agent answers with"""
+        if self.closed:
+            raise ConnectionError("Agent {} disconnected".format(self.name))
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.send(dict(message, id=request_id))
+            await self.writer.drain()
+            return await future
+        finally:
+            del self.pending[request_id]
+
+    async def serve(self):
+        """Reads the answers of the agent until it disconnects"""
+        try:
+            async for line in self.reader:
+                try:
+                    message = json.loads(line)
+                    future = self.pending.get(message.get('id'))
+                except (ValueError, AttributeError, TypeError):
+                    continue
+                if future is not None and not future.done():
+                    future.set_result(message.get('move'))
+        finally:
+            self.closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(
+                        "Agent {} disconnected".format(self.name)))
+            self.writer.close()
+
+
+class DealerServer:
+    """
+    Hosts games between the agents connected to it
+
+    Parameters
+    ----------
+    rounds: int
+        The maximum number of rounds of a game, where every agent plays once
+        per round
+    move_timeout: float
+        The number of seconds an agent has to answer with a move
+    """
+
+    def __init__(self, rounds=14, move_timeout=1.0):
+        self.rounds = rounds
+        self.move_timeout = move_timeout
+        self.agents = []
+        self.dealer = DealerBatcher()
+        self.move_times = []
+        self._joined = None
+        self._connections = set()
+
+    def addAgent(self, agent):
+        """Adds an agent, either a LocalAgent or an AgentConnection"""
+        self.agents.append(agent)
+        if self._joined is not None:
+            # wakes up all the waiters, which check the count again
+            self._joined.set()
+            self._joined = None
+
+    async def waitForAgents(self, count):
+        """Waits until at least count agents are connected"""
+        while len(self.agents) < count:
+            if self._joined is None:
+                self._joined = asyncio.Event()
+            await self._joined.wait()
+
+    async def listen(self, host=None, port=None, path=None):
+        """
+        Starts accepting agents on a TCP port, or on a Unix socket when path
+        is given
+
+        Returns
+        -------
+        server: asyncio.Server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self._connected, path)
+        return await asyncio.start_server(self._connected, host, port)
+
+    async def close(self):
+        """Disconnects the agents connected through sockets"""
+        for agent in self.agents:
+            if isinstance(agent, AgentConnection):
+                agent.writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _connected(self, reader, writer):
+        self._connections.add(asyncio.current_task())
+        try:
+            await self._connection(reader, writer)
+        finally:
+            self._connections.discard(asyncio.current_task())
+
+    async def _connection(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            name = str(hello.get('name', len(self.agents)))
+        except (ValueError, AttributeError):
+            writer.close()
+            return
+        agent = AgentConnection(name, reader, writer)
+        agent.send({'type': 'welcome', 'name': name})
+        self.addAgent(agent)
+        try:
+            await agent.serve()
+        finally:
+            self.agents.remove(agent)
+
+    async def _move(self, agent, message):
+        """Asks an agent for a move, returning None when it did not answer
+        in time, disconnected or answered with something looking like a card
+        which is not one (e.g. "14H")"""
+        start = time.perf_counter()
+        try:
+            move = await asyncio.wait_for(agent.request(message),
+                                          self.move_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            return None
+        self.move_times.append(time.perf_counter() - start)
+        if not isinstance(move, str) or \
+                (is_card(move) and move not in CARD_INDEX):
+            return None
+        return move
+
+    async def playGame(self, game, rule, agents):
+        """
+        Plays one game
+
+        Parameters
+        ----------
+        game: int
+            The number of the game
+        rule: str
+            String representation of the rule of the dealer
+        agents: list
+            The agents playing, in the order they play
+
+        Returns
+        -------
+        result: dict
+            The outcome of the game: who ended it, the number of turns, the
+            number of moves each agent missed, the rule guessed and the score
+            of each agent, and the wall time in seconds
+        """
+        start = time.perf_counter()
+        result = {'game': game, 'rule': rule,
+                  'agents': [a.name for a in agents]}
+        try:
+            tree = parse(rule)
+            cards = dealCards(tree)
+            board_state = [(c, []) for c in cards]
+            for i, agent in enumerate(agents):
+                agent.send({'type': 'start', 'game': game, 'seat': i,
+                            'players': len(agents), 'cards': cards})
+
+            prev2, prev = cards[1], cards[2]
+            turns = 0
+            missed = [0] * len(agents)
+            ended_by = None
+            ended_rule = None
+            for round_num in range(self.rounds):
+                for i, agent in enumerate(agents):
+                    move = await self._move(agent,
+                                            {'type': 'play', 'game': game})
+                    if move is None:
+                        missed[i] += 1
+                        continue
+                    if not is_card(move):
+                        ended_by, ended_rule = i, move
+                        break
+                    turns += 1
+                    accepted = await self.dealer.accepts(
+                        tree, [prev2, prev, move])
+                    if accepted:
+                        board_state.append((move, []))
+                        prev2, prev = prev, move
+                    else:
+                        board_state[-1][1].append(move)
+                    for a in agents:
+                        a.send({'type': 'result', 'game': game, 'seat': i,
+                                'card': move, 'accepted': accepted})
+                if ended_by is not None:
+                    break
+
+            for agent in agents:
+                agent.send({'type': 'end', 'game': game,
+                            'ended_by': ended_by, 'rule': ended_rule})
+            guesses = await asyncio.gather(*[
+                self._move(agent, {'type': 'guess', 'game': game})
+                for agent in agents])
+            scorer = Game.Scorer(rule, phase2.GameContext())
+            guessed = [i for i, guess in enumerate(guesses)
+                       if isinstance(guess, str) and not is_card(guess)]
+            scores = [None] * len(agents)
+            finished = [Game.FinishedPlayer(board_state, guesses[i])
+                        for i in guessed]
+            guessed_scores = scorer.score_many(
+                finished,
+                guessed.index(ended_by) if ended_by in guessed else None,
+                skip_errors=True)
+            for i, score in zip(guessed, guessed_scores):
+                scores[i] = score
+            for agent, score in zip(agents, scores):
+                agent.send({'type': 'score', 'game': game, 'score': score})
+
+            result['ended_by'] = ended_by
+            result['turns'] = turns
+            result['missed'] = missed
+            result['guesses'] = guesses
+            result['scores'] = scores
+        except Exception as e:
+            result['error'] = repr(e)
+        result['wall_time'] = time.perf_counter() - start
+        return result
+
+    async def tournament(self, num_games, players=4, concurrency=64, seed=0,
+                         rules=None):
+        """
+        Plays a batch of games between the connected agents, and yields
+        their results as they finish
+
+        Parameters
+        ----------
+        num_games: int
+            The number of games
+        players: int
+            The number of agents in each game; game i seats the agents
+            starting from the i-th one, so that they rotate through the seats
+        concurrency: int
+            The maximum number of games played at once
+        seed: int
+            The seed of the first game; game i uses seed + i to pick its rule
+            when no rules are given
+        rules: list
+            String representations of the rules to cycle through, or None to
+            use random rules
+        """
+        await self.waitForAgents(players)
+        results = asyncio.Queue()
+        games = iter(range(num_games))
+
+        async def worker():
+            for game in games:
+                if rules:
+                    rule = rules[game % len(rules)]
+                else:
+                    random.seed(seed + game)
+                    rule = str(getRandomRule())
+                await self.waitForAgents(players)
+                agents = [self.agents[(game + j) % len(self.agents)]
+                          for j in range(players)]
+                await results.put(await self.playGame(game, rule, agents))
+
+        workers = [asyncio.ensure_future(worker())
+                   for i in range(min(concurrency, num_games))]
+        try:
+            for i in range(num_games):
+                yield await results.get()
+        finally:
+            for w in workers:
+                w.cancel()
+
+
+async def runAgent(kind, name=None, host=None, port=None, path=None):
+    """
+    Connects an in-process player to a server as an agent, and plays until
+    the server closes the connection
+
+    Parameters
+    ----------
+    kind: str
+        The kind of player, one of AGENT_KINDS
+    name: str
+        The name of the agent; the kind by default
+    host, port: str, int
+        The TCP address of the server
+    path: str
+        The Unix socket of the server, used instead of host and port
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    handler = AgentHandler(AGENT_KINDS[kind])
+    writer.write(json.dumps({'type': 'hello',
+                             'name': name or kind}).encode() + b'\n')
+    try:
+        async for line in reader:
+            message = json.loads(line)
+            if 'game' not in message:
+                continue
+            move = handler.reply(message)
+            if 'id' in message:
+                writer.write(json.dumps({'id': message['id'],
+                                         'move': move}).encode() + b'\n')
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def loadTest(num_games, kinds, concurrency=64, transport='unix',
+                   rounds=14, move_timeout=1.0, seed=0):
+    """
+    Plays games between stand-in agents, all in this process, and measures
+    the throughput of the server
+
+    Parameters
+    ----------
+    num_games: int
+        The number of games
+    kinds: list
+        The kinds of the agents (see AGENT_KINDS); every game seats all of
+        them
+    concurrency: int
+        The maximum number of games played at once
+    transport: str
+        'unix' or 'tcp' to connect the agents through sockets, or 'local'
+        to call them directly
+    rounds, move_timeout:
+        See DealerServer
+    seed: int
+        See DealerServer.tournament
+
+    Returns
+    -------
+    report: dict
+        The number of games played and failed, the games per second, the
+        median and 99th percentile of the time to get a move, and the mean
+        number of cards judged per batch by the dealer
+    """
+    server = DealerServer(rounds, move_timeout)
+    listening = None
+    clients = []
+    directory = None
+    if transport == 'local':
+        for i, kind in enumerate(kinds):
+            server.addAgent(LocalAgent('{}-{}'.format(kind, i),
+                                       AGENT_KINDS[kind]))
+    else:
+        address = {}
+        if transport == 'unix':
+            directory = tempfile.mkdtemp()
+            address['path'] = os.path.join(directory, 'dealer.sock')
+            listening = await server.listen(path=address['path'])
+        else:
+            listening = await server.listen('127.0.0.1', 0)
+            address['host'] = '127.0.0.1'
+            address['port'] = listening.sockets[0].getsockname()[1]
+        clients = [asyncio.ensure_future(
+            runAgent(kind, '{}-{}'.format(kind, i), **address))
+            for i, kind in enumerate(kinds)]
+
+    start = time.perf_counter()
+    errors = 0
+    async for result in server.tournament(num_games, len(kinds), concurrency,
+                                          seed):
+        errors += 'error' in result
+    elapsed = time.perf_counter() - start
+
+    if listening is not None:
+        listening.close()
+        await server.close()
+        await asyncio.gather(*clients, return_exceptions=True)
+    if directory is not None:
+        os.unlink(address['path'])
+        os.rmdir(directory)
+
+    times = sorted(server.move_times) or [0.0]
+    return {'games': num_games, 'errors': errors,
+            'games_per_second': num_games / elapsed,
+            'move_time_median': statistics.median(times),
+            'move_time_p99': times[int(0.99 * (len(times) - 1))],
+            'cards_per_batch': server.dealer.evaluations /
+            max(1, server.dealer.batches)}
+
+
+def _address(args):
+    if args.unix:
+        return {'path': args.unix}
+    host, port = args.tcp.rsplit(':', 1)
+    return {'host': host, 'port': int(port)}
+
+
+async def _serve(args):
+    server = DealerServer(args.rounds, args.timeout)
+    listening = await server.listen(**_address(args))
+    rules = None
+    if args.rules:
+        with open(args.rules) as f:
+            rules = [line.strip() for line in f if line.strip()]
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        async for result in server.tournament(args.games, args.players,
+                                              args.concurrency, args.seed,
+                                              rules):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        listening.close()
+        await server.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+async def _agents(args):
+    await asyncio.gather(*[
+        runAgent(kind, '{}-{}'.format(kind, i), **_address(args))
+        for i, kind in enumerate(args.kinds)])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='host games for agents')
+    agents = commands.add_parser('agent',
+                                 help='connect in-process players as agents')
+    for p in [serve, agents]:
+        where = p.add_mutually_exclusive_group(required=True)
+        where.add_argument('--tcp', metavar='HOST:PORT',
+                           help='TCP address of the server')
+        where.add_argument('--unix', metavar='PATH',
+                           help='Unix socket of the server')
+    serve.add_argument('--games', type=int, default=100,
+                       help='number of games to play')
+    serve.add_argument('--players', type=int, default=4,
+                       help='number of agents in each game')
+    serve.add_argument('--rules',
+                       help='file with one rule per line; random rules are '
+                            'used when not given')
+    serve.add_argument('--output', help='JSONL output file (default stdout)')
+    agents.add_argument('kinds', nargs='+', choices=sorted(AGENT_KINDS),
+                        help='the kinds of the agents to connect')
+
+    load = commands.add_parser('loadtest',
+                               help='play games between stand-in agents in '
+                                    'this process and report the throughput')
+    load.add_argument('--games', type=int, default=1000,
+                      help='number of games to play')
+    load.add_argument('--kinds', nargs='+', choices=sorted(AGENT_KINDS),
+                      default=['player', 'adversary', 'adversary',
+                               'adversary'],
+                      help='the kinds of the agents playing every game')
+    load.add_argument('--transport', choices=['unix', 'tcp', 'local'],
+                      default='unix',
+                      help='how the agents are connected to the server')
+
+    for p in [serve, load]:
+        p.add_argument('--concurrency', type=int, default=64,
+                       help='maximum number of games played at once')
+        p.add_argument('--rounds', type=int, default=14,
+                       help='maximum number of rounds per game')
+        p.add_argument('--timeout', type=float, default=1.0,
+                       help='seconds an agent has to answer with a move')
+        p.add_argument('--seed', type=int, default=0,
+                       help='seed of the first game')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        asyncio.run(_serve(args))
+    elif args.command == 'agent':
+        asyncio.run(_agents(args))
+    else:
+        report = asyncio.run(loadTest(args.games, args.kinds,
+                                      args.concurrency, args.transport,
+                                      args.rounds, args.timeout, args.seed))
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+from itertools import product
+
+import server
+from server import *
+
+
+class SlowAgent(LocalAgent):
+    """An agent which never answers in time"""
+    async def request(self, message):
+        await asyncio.sleep(1)
+
+
+class FakeCardAgent(LocalAgent):
+    """An agent which plays a card that does not exist"""
+    async def request(self, message):
+        if message['type'] == 'play':
+            return "14H"
+        return await super().request(message)
+
+
+class TestServer(unittest.TestCase):
+
+    def test_dealer_batcher(self):
+        rule = parse("or(equal(color(current), R), "
+                     "greater(value(current), value(previous)))")
+        sequences = [list(cards) for cards in
+                     product(["2D", "10S", "KC"], ["1H", "4S"], ALL_CARDS)]
+
+        async def judge(threshold):
+            server.TABLE_THRESHOLD = threshold
+            dealer = DealerBatcher()
+            futures = [dealer.accepts(rule, cards) for cards in sequences]
+            return await asyncio.gather(*futures), dealer
+
+        evaluate = rule.compile()
+        expected = [bool(evaluate(cards)) for cards in sequences]
+        threshold = server.TABLE_THRESHOLD
+        try:
+            for t in [len(sequences) + 1, 1]:
+                accepted, dealer = asyncio.run(judge(t))
+                self.assertEqual(expected, accepted)
+                self.assertEqual(1, dealer.batches)
+                self.assertEqual(t == 1, rule in dealer.tables)
+        finally:
+            server.TABLE_THRESHOLD = threshold
+
+    def test_dealer_batcher_invalid_cards(self):
+        rule = parse("equal(color(current), R)")
+
+        async def judge():
+            dealer = DealerBatcher()
+            futures = [dealer.accepts(rule, ["2D", "4S", card])
+                       for card in ["0S", "3H"]]
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        threshold = server.TABLE_THRESHOLD
+        try:
+            # the batch is looked up in the truth table of the rule, which
+            # has no index for "0S"
+            server.TABLE_THRESHOLD = 1
+            results = asyncio.run(asyncio.wait_for(judge(), 5))
+            self.assertIsInstance(results[0], KeyError)
+            self.assertIsInstance(results[1], KeyError)
+        finally:
+            server.TABLE_THRESHOLD = threshold
+
+    def test_invalid_card_missed(self):
+        async def play():
+            dealer = DealerServer(rounds=2)
+            dealer.addAgent(FakeCardAgent('fake', AGENT_KINDS['adversary']))
+            dealer.addAgent(LocalAgent('player', AGENT_KINDS['player']))
+            return await dealer.playGame(0, "equal(color(current), R)",
+                                         dealer.agents)
+        result = asyncio.run(asyncio.wait_for(play(), 30))
+        self.assertNotIn('error', result)
+        self.assertEqual(2, result['missed'][0])
+
+    def test_wait_for_agents(self):
+        async def wait():
+            dealer = DealerServer()
+            waiters = [asyncio.ensure_future(dealer.waitForAgents(n))
+                       for n in [1, 2, 2]]
+            await asyncio.sleep(0)
+            for i in range(2):
+                dealer.addAgent(LocalAgent(str(i), AGENT_KINDS['adversary']))
+                await asyncio.sleep(0)
+            await asyncio.wait_for(asyncio.gather(*waiters), 5)
+        asyncio.run(wait())
+
+    def test_load_test(self):
+        for transport in ['local', 'unix', 'tcp']:
+            report = asyncio.run(loadTest(
+                4, ['player', 'adversary', 'adversary'], concurrency=2,
+                transport=transport, rounds=3))
+            self.assertEqual(4, report['games'])
+            self.assertEqual(0, report['errors'])
+
+    def test_timeout(self):
+        async def play():
+            dealer = DealerServer(rounds=2, move_timeout=0.01)
+            dealer.addAgent(SlowAgent('slow', AGENT_KINDS['adversary']))
+            dealer.addAgent(LocalAgent('player', AGENT_KINDS['player']))
+            return await dealer.playGame(0, "equal(color(current), R)",
+                                         dealer.agents)
+        result = asyncio.run(play())
+        self.assertEqual([2, 0], result['missed'])
+        self.assertIsNone(result['guesses'][0])
+        self.assertIsNone(result['scores'][0])
+        self.assertIsNotNone(result['scores'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
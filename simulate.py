@@ -0,0 +1,240 @@
+"""
+Runs many games of New Eleusis without printing, optionally across several
+processes, and streams the result of every game as a line of JSON
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import instrumentation
+import phase2
+import Game
+from engine import GameEngine
+from rule_functions import *
+from rule_index import RuleIndex
+from truth_table import acceptanceMask, sequenceCards, useRuleIndex
+
+
+def dealCards(rule):
+    """
+    Picks three random cards that are accepted by the rule, to start a game
+
+    Parameters
+    ----------
+    rule: Tree
+        The rule of the dealer
+
+    Returns
+    -------
+    cards: list
+        Three cards, or three random cards if the rule accepts nothing
+    """
+    accepted = np.flatnonzero(acceptanceMask(rule))
+    if len(accepted) == 0:
+        return [random.choice(ALL_CARDS) for i in range(3)]
+    return sequenceCards(int(accepted[random.randrange(len(accepted))]))
+
+
+def runGame(rule, seed, rounds=14, num_adversaries=3, max_rule_constancy=5,
+            strategy='parity', metrics=False):
+    """
+    Plays one game between a Player and a number of phase2.Adversary players
+
+    Parameters
+    ----------
+    rule: str
+        String representation of the dealer's rule
+    seed: int
+        Seed of the random number generator, which makes the game repeatable
+    rounds: int
+        The maximum number of rounds, where every player plays once per round
+    num_adversaries: int
+        The number of adversaries playing after the Player in each round
+    max_rule_constancy: int
+        See Game.Player
+    strategy: str
+        How the Player chooses its cards, see Game.Player
+    metrics: bool
+        Whether to record the metrics of the game (see instrumentation)
+
+    Returns
+    -------
+    result: dict
+        The outcome of the game: the number of turns, the size of the
+        hypothesis set after each turn, the guessed rule, the score and the
+        wall time in seconds, and the snapshot of its metrics if recorded
+    """
+    if metrics:
+        instrumentation.reset()
+        instrumentation.enable()
+    start = time.perf_counter()
+    random.seed(seed)
+    context = phase2.GameContext()
+
+    result = {'rule': rule, 'seed': seed}
+    try:
+        tree = parse(rule)
+        cards = dealCards(tree)
+        player = Game.Player(list(cards),
+                             max_rule_constancy=max_rule_constancy,
+                             strategy=strategy, context=context)
+        players = [player] + [phase2.Adversary()
+                              for i in range(num_adversaries)]
+
+        hypothesis_sizes = []
+        game = GameEngine(tree, players, cards, rounds,
+                          on_play=lambda i, card, accepted:
+                          hypothesis_sizes.append(len(player.hypothesis_set)),
+                          context=context)
+        outcome = game.run()
+
+        result['guess'] = player.play()
+        result['ended_by'] = outcome.ended_by
+        result['turns'] = outcome.turns
+        result['hypothesis_sizes'] = hypothesis_sizes
+        # the guess is already simplified, so the Scorer does not ask the
+        # Player for it again
+        result['score'] = Game.Scorer(rule, context).score(
+            Game.FinishedPlayer(player.boardState(), result['guess']),
+            outcome.ended_by == 0)
+    except Exception as e:
+        result['error'] = repr(e)
+    result['wall_time'] = time.perf_counter() - start
+    if metrics:
+        instrumentation.disable()
+        result['metrics'] = instrumentation.snapshot()
+    return result
+
+
+def _runTask(task):
+    rule, seed, options = task
+    return runGame(rule, seed, **options)
+
+
+def gameTasks(num_games, seed, rules=None, **options):
+    """
+    Yields the arguments of the games to play
+
+    Parameters
+    ----------
+    num_games: int
+        The number of games
+    seed: int
+        The seed of the first game; game i uses seed + i
+    rules: list
+        String representations of the rules to cycle through. When not
+        given, each game uses rule_functions.getRandomRule
+    options: dict
+        Extra keyword arguments for runGame
+    """
+    for i in range(num_games):
+        if rules:
+            rule = rules[i % len(rules)]
+        else:
+            random.seed(seed + i)
+            rule = str(getRandomRule())
+        yield (rule, seed + i, options)
+
+
+def _openRuleIndex(path):
+    useRuleIndex(None if path is None else RuleIndex(path, readonly=True))
+
+
+def simulate(num_games, workers=1, seed=0, rules=None, index_path=None,
+             **options):
+    """
+    Plays a batch of games and yields their results, in order
+
+    Parameters
+    ----------
+    num_games: int
+        The number of games
+    workers: int
+        The number of processes to play the games in
+    seed: int
+        The seed of the first game; game i uses seed + i
+    rules: list
+        String representations of the rules to cycle through, or None to
+        use random rules
+    index_path: str
+        A rule index (see rule_index.RuleIndex) to look the truth tables of
+        the rules up in, opened read-only by every process
+    options: dict
+        Extra keyword arguments for runGame
+    """
+    tasks = gameTasks(num_games, seed, rules, **options)
+    if workers <= 1:
+        _openRuleIndex(index_path)
+        try:
+            for task in tasks:
+                yield _runTask(task)
+        finally:
+            _openRuleIndex(None)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_openRuleIndex,
+                             initargs=(index_path,)) as executor:
+        chunksize = max(1, min(64, num_games // (workers * 4)))
+        for result in executor.map(_runTask, tasks, chunksize=chunksize):
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--games', type=int, default=100,
+                        help='number of games to play')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first game')
+    parser.add_argument('--rules',
+                        help='file with one rule per line; random rules are '
+                             'used when not given')
+    parser.add_argument('--rounds', type=int, default=14,
+                        help='maximum number of rounds per game')
+    parser.add_argument('--adversaries', type=int, default=3,
+                        help='number of adversaries in each game')
+    parser.add_argument('--strategy', choices=Game.STRATEGIES,
+                        default='parity',
+                        help='how the Player chooses the cards to play')
+    parser.add_argument('--output', help='JSONL output file (default stdout)')
+    parser.add_argument('--rule-index',
+                        help='rule index to look the truth tables of the '
+                             'rules up in (see rule_index.py)')
+    parser.add_argument('--metrics',
+                        help='file to write the metrics of all the games to, '
+                             'in the Prometheus text format if it ends with '
+                             '.prom and as JSON otherwise')
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules) as f:
+            rules = [line.strip() for line in f if line.strip()]
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    metrics = []
+    try:
+        for result in simulate(args.games, args.workers, args.seed, rules,
+                               args.rule_index, rounds=args.rounds,
+                               num_adversaries=args.adversaries,
+                               strategy=args.strategy,
+                               metrics=bool(args.metrics)):
+            if args.metrics:
+                metrics = [instrumentation.merge(
+                    metrics + [result.pop('metrics')])]
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.metrics:
+        instrumentation.dump(args.metrics, instrumentation.merge(metrics))
+
+
+if __name__ == '__main__':
+    main()
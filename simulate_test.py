@@ -0,0 +1,67 @@
+import json
+import unittest
+from unittest import mock
+from simulate import *
+
+
+def without_times(results):
+    return [{k: v for k, v in r.items() if k != 'wall_time'}
+            for r in results]
+
+
+class TestSimulate(unittest.TestCase):
+
+    fields = {'rule', 'seed', 'guess', 'ended_by', 'turns',
+              'hypothesis_sizes', 'score', 'wall_time'}
+
+    def test_run_game(self):
+        result = runGame("equal(color(current), R)", 3, rounds=4)
+        self.assertEqual(self.fields, set(result))
+        self.assertEqual("equal(color(current), R)", result['rule'])
+        self.assertEqual(3, result['seed'])
+        self.assertEqual(result['turns'], len(result['hypothesis_sizes']))
+        self.assertLessEqual(result['turns'], 4 * 4)
+        self.assertEqual(result, json.loads(json.dumps(result)))
+        again = runGame("equal(color(current), R)", 3, rounds=4)
+        self.assertEqual(without_times([result]), without_times([again]))
+
+    def test_guess_once(self):
+        play = Game.Player.play
+        ended = []
+
+        def recorded(player):
+            ended.append(player.context.game_ended)
+            return play(player)
+        with mock.patch.object(Game.Player, 'play', recorded):
+            result = runGame("equal(color(current), R)", 3, rounds=4)
+        self.assertNotIn('error', result)
+        self.assertEqual(1, ended.count(True))
+
+    def test_error(self):
+        result = runGame("less(value(current), 5)", 0, rounds=2)
+        self.assertEqual({'rule', 'seed', 'error', 'wall_time'}, set(result))
+
+    def test_simulate(self):
+        results = list(simulate(6, seed=10, rounds=3))
+        self.assertEqual(list(range(10, 16)), [r['seed'] for r in results])
+        for result in results:
+            self.assertEqual(self.fields, set(result))
+            json.dumps(result)
+        self.assertEqual(without_times(results),
+                         without_times(simulate(6, seed=10, rounds=3)))
+        self.assertEqual(without_times(results),
+                         without_times(simulate(6, workers=2, seed=10,
+                                                rounds=3)))
+        self.assertNotEqual(without_times(results),
+                            without_times(simulate(6, seed=11, rounds=3)))
+
+    def test_rules(self):
+        rules = ["equal(color(current), R)", "odd(current)"]
+        results = list(simulate(4, workers=2, seed=5, rules=rules,
+                                rounds=2))
+        self.assertEqual(rules * 2, [r['rule'] for r in results])
+        self.assertEqual([5, 6, 7, 8], [r['seed'] for r in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
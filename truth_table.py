@@ -0,0 +1,628 @@
+"""
+Vectorized evaluation of rules over every possible sequence of three cards
+"""
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+from new_eleusis import *
+from cards import ALL_CARDS as DECK, CARD_INDEX, NUM_CARDS
+
+NUM_SEQUENCES = NUM_CARDS ** 3
+
+# Axis of the (previous2, previous, current) grid each card name varies along,
+# so that the flattened grid follows the order of product(DECK, repeat=3)
+_axes = {'previous2': 0, 'previous': 1, 'current': 2}
+
+
+class _Error:
+    """Marks the cells where evaluating the rule raised an exception"""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _Column:
+    """
+    A dictionary-encoded column of values over the grid of three cards
+
+    Parameters
+    ----------
+    vocab: list
+        The distinct values taken by an expression
+    codes: numpy.ndarray
+        Indices into vocab, broadcastable to the (52, 52, 52) grid
+    """
+    def __init__(self, vocab, codes):
+        # merge repeated values so that the following operations stay small;
+        # the type is part of the key so that True and 1 are kept apart
+        index = {}
+        remap = []
+        new_vocab = []
+        for v in vocab:
+            key = (_Error, None) if isinstance(v, _Error) else (type(v), v)
+            if key not in index:
+                index[key] = len(new_vocab)
+                new_vocab.append(v)
+            remap.append(index[key])
+        if len(new_vocab) != len(vocab):
+            codes = np.array(remap, dtype=np.intp)[codes]
+        self.vocab = new_vocab
+        self.codes = codes
+
+    def truth(self):
+        """Returns the codes mapped to 0 (falsy), 1 (truthy) or 2 (error)"""
+        table = np.array([2 if isinstance(v, _Error) else int(bool(v))
+                          for v in self.vocab], dtype=np.int8)
+        return table[self.codes]
+
+
+def _call(f, *args):
+    """Calls a primitive, turning errors into _Error values"""
+    for a in args:
+        if isinstance(a, _Error):
+            return a
+    try:
+        return f(*args)
+    except Exception as e:
+        return _Error(e)
+
+
+def _leaf(expr):
+    """Makes the column of a leaf of a Tree, mirroring subeval in evaluate"""
+    if isinstance(expr, str) and expr in _axes:
+        shape = [1, 1, 1]
+        shape[_axes[expr]] = NUM_CARDS
+        return _Column(DECK, np.arange(NUM_CARDS).reshape(shape))
+    if expr == "True":
+        expr = True
+    elif expr == "False":
+        expr = False
+    return _Column([expr], np.zeros((1, 1, 1), dtype=np.intp))
+
+
+def _unary(f, a):
+    return _Column([_call(f, v) for v in a.vocab], a.codes)
+
+
+def _binary(f, a, b):
+    nb = len(b.vocab)
+    pairs = a.codes * nb + b.codes
+    if pairs.size < len(a.vocab) * nb:
+        # only a few of the possible pairs occur, evaluate just those
+        present, inverse = np.unique(pairs, return_inverse=True)
+        vocab = [_call(f, a.vocab[p // nb], b.vocab[p % nb])
+                 for p in present.tolist()]
+        return _Column(vocab, inverse.reshape(pairs.shape))
+    vocab = [_call(f, va, vb) for va in a.vocab for vb in b.vocab]
+    return _Column(vocab, pairs)
+
+
+def _select(test, a, b):
+    """Takes the values of a where test is truthy and those of b elsewhere"""
+    error = _Error(None)
+    for v in test.vocab:
+        if isinstance(v, _Error):
+            error = v
+    t = test.truth()
+    na = len(a.vocab)
+    codes = np.where(t == 1, a.codes,
+                     np.where(t == 0, b.codes + na, na + len(b.vocab)))
+    return _Column(a.vocab + b.vocab + [error], codes)
+
+
+def _constant(v):
+    return _Column([v], np.zeros((1, 1, 1), dtype=np.intp))
+
+
+def _children(expr):
+    """The children of a Tree in the order _combine takes their columns"""
+    if expr.root == iff:
+        return [expr.test, expr.left, expr.right]
+    if expr.root in [andf, orf]:
+        return list(expr.args)
+    if expr.root in [equal, less, greater]:
+        # a test given to them is ignored, like evaluate does
+        return [expr.left, expr.right]
+    return [expr.left]
+
+
+def _combine(expr, columns):
+    """The column of a Tree from the columns of its children"""
+    f = expr.root
+
+    if f in [suit, color, value, is_royal, minus1, plus1, even, odd]:
+        return _unary(f, columns[0])
+
+    elif f in [equal, less, greater]:
+        return _binary(f, columns[0], columns[1])
+
+    elif f == andf:
+        # and(a, b, c) is and(a, and(b, c)), folded from the last argument
+        column = columns[-1]
+        for arg in reversed(columns[:-1]):
+            column = _select(arg, column, _constant(False))
+        return column
+
+    elif f == orf:
+        column = columns[-1]
+        for arg in reversed(columns[:-1]):
+            column = _select(arg, _constant(True), column)
+        return column
+
+    elif f == notf:
+        return _unary(lambda v: not v, columns[0])
+
+    elif f == iff:
+        return _select(columns[0], columns[1], columns[2])
+
+
+def _evaluate(expr):
+    """Evaluates an expression over the whole grid, returning a _Column"""
+    # the Trees are combined in postfix order from an explicit stack, so that
+    # deeply nested rules do not hit the recursion limit; the columns of the
+    # children waiting for their siblings are kept on another stack
+    columns = []
+    stack = [(expr, False)]
+    while stack:
+        expr, visited = stack.pop()
+        if not isinstance(expr, Tree):
+            columns.append(_leaf(expr))
+            continue
+        children = _children(expr)
+        if visited:
+            args = columns[len(columns) - len(children):]
+            del columns[len(columns) - len(children):]
+            columns.append(_combine(expr, args))
+            continue
+        stack.append((expr, True))
+        for child in reversed(children):
+            stack.append((child, False))
+    return columns[0]
+
+
+def acceptanceMask(rule, truthiness=False):
+    """
+    Evaluates a rule on every possible list of three cards at once
+
+    Parameters
+    ----------
+    rule: Tree
+        The rule to evaluate
+    truthiness: bool
+        If True, a list of cards is accepted when the value of the rule is
+        truthy, like a dealer judging a card with the compiled rule does.
+        Otherwise a string value is only accepting when it is "True", with
+        the same meaning as in rule_functions.getAllValidSequences
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        Boolean array of length 52 ** 3, where the entry for the cards
+        (DECK[i], DECK[j], DECK[k]) is at index i * 52 * 52 + j * 52 + k and
+        tells whether the rule accepts them
+    """
+    return _mask(_evaluate(rule), truthiness)
+
+
+def _mask(column, truthiness):
+    """The acceptance mask of the values of a rule, see acceptanceMask"""
+    accepts = []
+    for v in column.vocab:
+        if isinstance(v, _Error):
+            if np.any(column.codes == len(accepts)):
+                raise v.exception
+            accepts.append(False)
+        elif isinstance(v, str) and not truthiness:
+            accepts.append(v == "True")
+        else:
+            accepts.append(bool(v))
+    mask = np.array(accepts, dtype=bool)[column.codes]
+    return np.broadcast_to(mask, (NUM_CARDS,) * 3).ravel()
+
+
+def sequenceCards(index):
+    """Returns the three cards of the sequence at the given mask index"""
+    return [DECK[index // (NUM_CARDS * NUM_CARDS)],
+            DECK[index // NUM_CARDS % NUM_CARDS], DECK[index % NUM_CARDS]]
+
+
+def sequenceIndex(cards):
+    """Returns the mask index of a list of three cards"""
+    a, b, c = (CARD_INDEX[card] for card in cards)
+    return (a * NUM_CARDS + b) * NUM_CARDS + c
+
+
+# number of set bits in every possible byte
+_popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class TruthTable:
+    """
+    The set of lists of three cards accepted by a rule, stored as a bitmap
+    of 52 ** 3 bits packed into 17,576 bytes
+
+    Parameters
+    ----------
+    bits: numpy.ndarray
+        The packed bitmap, as returned by numpy.packbits on an acceptance mask
+    """
+    def __init__(self, bits):
+        assert bits.dtype == np.uint8 and bits.shape == (NUM_SEQUENCES // 8,)
+        self.bits = bits
+        self._fingerprint = None
+
+    @classmethod
+    def fromRule(cls, rule, truthiness=False):
+        """Builds the truth table of a rule Tree (see acceptanceMask)"""
+        return cls(np.packbits(acceptanceMask(rule, truthiness)))
+
+    def mask(self):
+        """Returns the unpacked boolean acceptance mask"""
+        return np.unpackbits(self.bits).astype(bool)
+
+    def lookup(self, indices):
+        """Returns a boolean array telling whether each of the lists of three
+        cards at the given mask indices is accepted"""
+        indices = np.asarray(indices, dtype=np.intp)
+        return (self.bits[indices >> 3] &
+                (0x80 >> (indices & 7)).astype(np.uint8)) != 0
+
+    def fingerprint(self):
+        """Returns a hash of the bitmap, which identifies the rules that are
+        logically equivalent to each other"""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.blake2b(
+                self.bits.tobytes(), digest_size=16).hexdigest()
+        return self._fingerprint
+
+    def issubset(self, other):
+        """Tells if every list of cards accepted here is accepted by other"""
+        return not np.any(self.bits & ~other.bits)
+
+    def count(self):
+        """Returns the number of accepted lists of three cards"""
+        return int(_popcount[self.bits].sum(dtype=np.int64))
+
+    def differenceCount(self, other):
+        """Returns the number of lists of three cards on which the two truth
+        tables disagree"""
+        return int(_popcount[self.bits ^ other.bits].sum(dtype=np.int64))
+
+    def difference(self, other, sample_size=10):
+        """
+        Compares two truth tables
+
+        Parameters
+        ----------
+        other: TruthTable
+            The truth table to compare with
+        sample_size: int
+            The maximum number of disagreeing lists of cards to return
+
+        Returns
+        -------
+        count: int
+            The number of lists of three cards on which the tables disagree
+        sample: list
+            Up to sample_size lists of three cards on which they disagree
+        """
+        xor = self.bits ^ other.bits
+        count = int(_popcount[xor].sum(dtype=np.int64))
+        sample = []
+        for byte in np.flatnonzero(xor).tolist():
+            if len(sample) >= sample_size:
+                break
+            for bit in range(8):
+                if len(sample) < sample_size and xor[byte] & (0x80 >> bit):
+                    sample.append(sequenceCards(byte * 8 + bit))
+        return count, sample
+
+    def __eq__(self, other):
+        return isinstance(other, TruthTable) and \
+            np.array_equal(self.bits, other.bits)
+
+    def __hash__(self):
+        return hash(self.bits.tobytes())
+
+    def __and__(self, other):
+        return TruthTable(self.bits & other.bits)
+
+    def __or__(self, other):
+        return TruthTable(self.bits | other.bits)
+
+    def __xor__(self, other):
+        return TruthTable(self.bits ^ other.bits)
+
+    def __invert__(self):
+        return TruthTable(~self.bits)
+
+
+# Maximum number of rules whose truth table is kept in memory (each one takes
+# 17,576 bytes)
+RULE_TABLE_CACHE_SIZE = 4096
+
+
+# The rule_index.RuleIndex used by ruleTruthTable, see useRuleIndex
+_rule_index = None
+
+
+def useRuleIndex(index):
+    """
+    Makes ruleTruthTable look the truth tables of rules up in a persistent
+    rule index, and add the ones it computes to it unless it is read-only
+
+    Parameters
+    ----------
+    index: rule_index.RuleIndex
+        The index to use, or None to stop using one
+    """
+    global _rule_index
+    _rule_index = index
+    ruleTruthTable.cache_clear()
+
+
+@lru_cache(maxsize=RULE_TABLE_CACHE_SIZE)
+def ruleTruthTable(rule, truthiness=False):
+    """
+    Returns the truth table of a rule, cached by its string representation
+    and looked up in the rule index in use, if any (see useRuleIndex)
+
+    Parameters
+    ----------
+    rule: str
+        String representation of a rule
+    truthiness: bool
+        Whether the lists of cards on which the rule is truthy are accepted
+        (see acceptanceMask); the rule index only holds the other tables
+
+    Returns
+    -------
+    table: TruthTable
+        The truth table, which is shared and must not be modified
+    """
+    if truthiness:
+        return ruleTruthTables(rule)[1]
+    index = _rule_index
+    if index is not None:
+        fingerprint = index.fingerprint(rule)
+        if fingerprint is not None:
+            return index.table(fingerprint)
+    table = ruleTruthTables(rule)[0]
+    if index is not None and not index.readonly:
+        index.add(rule, table)
+    return table
+
+
+@lru_cache(maxsize=RULE_TABLE_CACHE_SIZE)
+def ruleTruthTables(rule):
+    """
+    Returns both truth tables of a rule (see acceptanceMask), evaluating the
+    rule only once; they are the same table for a rule which only returns
+    True or False
+
+    Parameters
+    ----------
+    rule: str
+        String representation of a rule
+
+    Returns
+    -------
+    table: TruthTable
+        The truth table where only the value "True" of a string accepts
+    truthy_table: TruthTable
+        The truth table where any truthy value accepts, as for a dealer
+    """
+    column = _evaluate(parse(rule))
+    tables = []
+    for truthiness in [False, True]:
+        if truthiness and not any(isinstance(v, str) for v in column.vocab):
+            tables.append(tables[0])
+            break
+        table = TruthTable(np.packbits(_mask(column, truthiness)))
+        table.bits.flags.writeable = False
+        tables.append(table)
+    return tuple(tables)
+
+
+def canonicalRule(rule):
+    """
+    Returns the shortest rule equivalent to a rule string known to the rule
+    index in use (see useRuleIndex), or the rule itself if there is no index
+    or it knows no shorter one. Constants like "True" are not rules of their
+    own, since they do not parse into a Tree.
+    """
+    if _rule_index is None:
+        return rule
+    canonical = _rule_index.canonical(ruleTruthTable(rule).fingerprint())
+    if canonical is None or (len(rule), rule) <= (len(canonical), canonical) \
+            or not isinstance(parse(canonical), Tree):
+        return rule
+    return canonical
+
+
+def ruleSetTruthTable(rule_set):
+    """
+    Returns the truth table of the conjunction of a list of rules, which are
+    expected to be predicates (returning True or False) like the ones the
+    Player builds its rule sets from
+    """
+    bits = np.full(NUM_SEQUENCES // 8, 0xff, dtype=np.uint8)
+    for r in rule_set:
+        bits &= ruleTruthTable(r).bits
+    return TruthTable(bits)
+
+
+def rulesAcceptance(rules, sequences):
+    """
+    Evaluates many rules on many lists of three cards at once, by looking
+    the lists up in the cached truth tables of the rules
+
+    Parameters
+    ----------
+    rules: list
+        String representations of predicates
+    sequences: list
+        Lists of three cards
+
+    Returns
+    -------
+    accepted: numpy.ndarray
+        Boolean array of shape (len(rules), len(sequences)) telling whether
+        each rule accepts each list of cards
+    """
+    indices = np.array([sequenceIndex(cards) for cards in sequences],
+                       dtype=np.intp)
+    if not rules:
+        return np.zeros((0, len(indices)), dtype=bool)
+    return np.stack([ruleTruthTable(r).lookup(indices) for r in rules])
+
+
+class BoardCheck:
+    """
+    The result of checking a rule against the cards played on a board, see
+    checkBoard
+
+    Parameters
+    ----------
+    accepted: numpy.ndarray
+        Whether the rule accepts each window of three consecutive accepted
+        cards, the first one ending with the third card of the board
+    rejected: numpy.ndarray
+        Whether the rule accepts each rejected card after the two accepted
+        cards before it, in the order of the board
+    violation: tuple
+        (position, cards) of the first list of cards, in the order they were
+        played, which the rule judges differently from the dealer: position
+        is the index in the board of the last accepted card of the list and
+        cards are the three cards. None if the rule describes the board
+    """
+    def __init__(self, accepted, rejected, violation):
+        self.accepted = accepted
+        self.rejected = rejected
+        self.violation = violation
+
+    @property
+    def describes(self):
+        """Whether the rule judges all the cards like the dealer did"""
+        return self.violation is None
+
+
+def boardSequences(board_state):
+    """
+    Lists the judged lists of three cards of a board, in the order they were
+    played
+
+    Parameters
+    ----------
+    board_state: list
+        Tuples of an accepted card and the list of the cards rejected after
+        it, as returned by Game.Player.boardState
+
+    Returns
+    -------
+    sequences: list
+        Tuples of (position, cards, accepted), where position is the index of
+        the tuple of the board the cards end at or were rejected after.
+        Like the Scorer always did, the first two tuples of the board only
+        start windows and their rejected cards are not listed.
+    """
+    sequences = []
+    for i in range(2, len(board_state)):
+        sequences.append((i, [board_state[i - 2][0], board_state[i - 1][0],
+                              board_state[i][0]], True))
+        for card in board_state[i][1]:
+            sequences.append(
+                (i, [board_state[i - 1][0], board_state[i][0], card], False))
+    return sequences
+
+
+def checkBoard(rule, board_state, truthiness=True, early_exit=False,
+               table=None):
+    """
+    Checks whether a rule accepts all the windows of accepted cards of a
+    board and rejects all the rejected cards
+
+    Parameters
+    ----------
+    rule: str
+        String representation of the rule
+    board_state: list
+        Tuples of an accepted card and the list of the cards rejected after
+        it, as returned by Game.Player.boardState
+    truthiness: bool
+        Whether a truthy value of the rule accepts cards, as when a dealer
+        judges them with the compiled rule (see acceptanceMask)
+    early_exit: bool
+        If True, the rule is compiled and evaluated on one list of cards
+        after the other up to the first violation, which is cheaper for a
+        rule that is only checked once. Otherwise all the lists are looked
+        up at once in the cached truth table of the rule (see ruleTruthTable)
+    table: TruthTable
+        The truth table of the rule matching truthiness, if already known
+
+    Returns
+    -------
+    check: BoardCheck
+        The results; with early_exit, they stop at the first violation
+    """
+    sequences = boardSequences(board_state)
+    if early_exit:
+        evaluate = parse(rule).compile()
+        results = []
+        for position, cards, expected in sequences:
+            value = evaluate(cards)
+            if isinstance(value, str) and not truthiness:
+                value = value == "True"
+            results.append(bool(value))
+            if results[-1] != expected:
+                break
+        results = np.array(results, dtype=bool)
+    else:
+        if table is None:
+            table = ruleTruthTable(rule, truthiness)
+        results = table.lookup(
+            [sequenceIndex(cards) for position, cards, expected in sequences])
+
+    expected = np.array([e for p, c, e in sequences[:len(results)]],
+                        dtype=bool)
+    wrong = np.flatnonzero(results != expected)
+    violation = None
+    if len(wrong):
+        position, cards, e = sequences[wrong[0]]
+        violation = (position, cards)
+    return BoardCheck(results[expected], results[~expected], violation)
+
+
+def ruleFingerprint(rule):
+    """Returns the fingerprint of the truth table of a rule string"""
+    return ruleTruthTable(rule).fingerprint()
+
+
+def ruleSetFingerprint(rule_set):
+    """Returns the fingerprint of the truth table of a list of rules"""
+    return ruleSetTruthTable(rule_set).fingerprint()
+
+
+def removeImpliedRules(rule_set):
+    """
+    Drops the rules of a conjunction which are implied by another of its
+    rules, keeping the first of any group of equivalent rules
+
+    Parameters
+    ----------
+    rule_set: list
+        List of string representations of predicates
+
+    Returns
+    -------
+    kept: list
+        The rules that are kept, in their original order
+    """
+    kept = []
+    for r in rule_set:
+        table = ruleTruthTable(r)
+        if any(ruleTruthTable(k).issubset(table) for k in kept):
+            continue
+        kept = [k for k in kept if not table.issubset(ruleTruthTable(k))]
+        kept.append(r)
+    return kept
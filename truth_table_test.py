@@ -0,0 +1,150 @@
+import unittest
+from itertools import product
+from truth_table import *
+from rule_functions import ALL_CARDS, parse
+
+
+def loop_mask(rule):
+    """The accepted sequences, computed one list of cards at a time"""
+    mask = []
+    evaluate = rule.compile()
+    for cards in product(ALL_CARDS, repeat=3):
+        good = evaluate(cards)
+        if isinstance(good, str):
+            mask.append(good == "True")
+        else:
+            mask.append(bool(good))
+    return mask
+
+
+class TestTruthTable(unittest.TestCase):
+
+    rules = [
+        "equal(color(current), R)",
+        "if(is_royal(current), False)",
+        "not(equal(suit(current), suit(previous)))",
+        "and(greater(value(current), value(previous)), odd(previous2))",
+        "equal(plus1(plus1(value(previous))), value(current))",
+        "equal(minus1(value(current)), value(previous))",
+        "or(less(suit(current), suit(previous)), equal(current, AS))",
+        "less(current, previous)",
+        """iff(equal(suit(previous), suit(previous2)),
+               is_royal(current),
+               not(is_royal(current)))""",
+        "iff(even(current), suit(current), True)",
+    ]
+
+    def test_deck(self):
+        self.assertEqual(ALL_CARDS, DECK)
+        self.assertEqual(140608, NUM_SEQUENCES)
+        self.assertEqual(["AD", "2D", "3D"], sequenceCards(52 + 2))
+        self.assertEqual(["KC", "KC", "KC"], sequenceCards(NUM_SEQUENCES - 1))
+
+    def test_acceptance_mask(self):
+        for rule in self.rules:
+            tree = parse(rule)
+            mask = acceptanceMask(tree)
+            self.assertEqual(NUM_SEQUENCES, len(mask))
+            self.assertEqual(loop_mask(tree), mask.tolist(), rule)
+
+    def test_deep_rules(self):
+        red = "equal(color(current), R)"
+        rule = red
+        for i in range(20001):
+            rule = "not(" + rule + ")"
+        self.assertEqual(ruleTruthTable("not(" + red + ")"),
+                         ruleTruthTable(rule))
+        rule = "even(current)"
+        for i in range(2000):
+            rule = "and(" + rule + ", odd(previous))"
+        self.assertEqual(
+            ruleTruthTable("and(even(current), odd(previous))"),
+            ruleTruthTable(rule))
+
+    def test_errors(self):
+        # less between a value and a string raises, as it does in evaluate
+        with self.assertRaises(TypeError):
+            acceptanceMask(parse("less(value(current), 5)"))
+        # but not when the failing branch is never taken
+        mask = acceptanceMask(parse(
+            "and(equal(suit(current), X), less(value(current), 5))"))
+        self.assertFalse(mask.any())
+
+    def test_truth_table(self):
+        red = TruthTable.fromRule(parse("equal(color(current), R)"))
+        black = TruthTable.fromRule(parse("equal(color(current), B)"))
+        hearts = TruthTable.fromRule(parse("equal(suit(current), H)"))
+        self.assertEqual(17576, red.bits.nbytes)
+        self.assertEqual(NUM_SEQUENCES // 2, red.count())
+        self.assertEqual(red, ~black)
+        self.assertEqual(hash(red), hash(~black))
+        self.assertEqual(hearts, red & hearts)
+        self.assertEqual(red, red | hearts)
+        self.assertEqual(NUM_SEQUENCES, red.differenceCount(black))
+
+        count, sample = red.difference(hearts, sample_size=3)
+        self.assertEqual(NUM_SEQUENCES // 4, count)
+        self.assertEqual([["AD", "AD", "AD"], ["AD", "AD", "2D"],
+                          ["AD", "AD", "3D"]], sample)
+        self.assertEqual((0, []), red.difference(red))
+
+    def test_fingerprints(self):
+        self.assertEqual(
+            ruleFingerprint("not(equal(color(current), R))"),
+            ruleFingerprint("equal(color(current), B)"))
+        self.assertNotEqual(
+            ruleFingerprint("equal(color(current), R)"),
+            ruleFingerprint("equal(color(current), B)"))
+        self.assertEqual(
+            ruleSetFingerprint(["equal(suit(current), H)",
+                                "equal(color(current), R)"]),
+            ruleFingerprint("equal(suit(current), H)"))
+
+    def test_rules_acceptance(self):
+        rules = ["equal(color(current), R)",
+                 "greater(value(current), value(previous))",
+                 "less(suit(previous), suit(current))"]
+        sequences = [["3D", "7S", c] for c in ALL_CARDS] + [["1D", "KH", "1S"]]
+        accepted = rulesAcceptance(rules, sequences)
+        self.assertEqual((3, 53), accepted.shape)
+        for i, r in enumerate(rules):
+            evaluate = parse(r).compile()
+            for j, cards in enumerate(sequences):
+                self.assertEqual(bool(evaluate(cards)), accepted[i, j])
+
+    def test_remove_implied_rules(self):
+        self.assertEqual(
+            ["equal(suit(current), H)", "equal(even(current), True)"],
+            removeImpliedRules(["equal(color(current), R)",
+                                "equal(suit(current), H)",
+                                "equal(even(current), True)",
+                                "not(equal(color(current), B))",
+                                "equal(suit(current), H)"]))
+
+    def test_check_board(self):
+        board = [("2H", ["3C"]), ("4D", []), ("6H", ["7S", "8S"]),
+                 ("9D", []), ("10S", ["JH"])]
+        red = checkBoard("equal(color(current), R)", board)
+        self.assertEqual([True, True, False], list(red.accepted))
+        self.assertEqual([False, False, True], list(red.rejected))
+        self.assertEqual((4, ["6H", "9D", "10S"]), red.violation)
+        self.assertFalse(red.describes)
+        early = checkBoard("equal(color(current), R)", board, early_exit=True)
+        self.assertEqual(red.violation, early.violation)
+        self.assertEqual([True, True, False], list(early.accepted))
+        self.assertEqual([False, False], list(early.rejected))
+        for early_exit in [False, True]:
+            self.assertTrue(checkBoard(
+                "not(or(equal(value(current), 7), equal(value(current), 8), "
+                "is_royal(current)))",
+                board, early_exit=early_exit).describes)
+            # a string value of a rule is truthy to a dealer
+            self.assertEqual(
+                [True, False],
+                [checkBoard("suit(current)", [(c, []) for c, r in board[:3]],
+                            truthiness, early_exit).describes
+                 for truthiness in [True, False]])
+
+
+if __name__ == '__main__':
+    unittest.main()